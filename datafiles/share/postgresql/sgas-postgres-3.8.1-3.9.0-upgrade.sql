@@ -0,0 +1,295 @@
+-- logic for upgrading the SGAS PostgreSQL schema from version 3.8.1 to 3.9.0
+-- SGAS should preferable be stopped when performing this upgrade
+-- after running this file, sgas-postgres-functions.sql should be loaded
+-- (it contains the new urcreate_ids and urcreate_bulk functions, the
+-- update_uraggregate_monthly function, and the trigger refreshing
+-- hostscalefactors_daily)
+
+BEGIN;
+
+-- template for the temporary staging table used by the bulk insert path
+-- (urcreate_bulk). Column names follow the argument list of urcreate.
+CREATE TABLE urbulk_template (
+    record_id               varchar,
+    create_time             timestamp,
+    global_job_id           varchar,
+    local_job_id            varchar,
+    local_user_id           varchar,
+    global_user_name        varchar,
+    vo_type                 varchar,
+    vo_issuer               varchar,
+    vo_name                 varchar,
+    vo_attributes           varchar[][],
+    machine_name            varchar,
+    job_name                varchar,
+    charge                  integer,
+    status                  varchar,
+    queue                   varchar,
+    host                    varchar,
+    node_count              integer,
+    processors              integer,
+    project_name            varchar,
+    submit_host             varchar,
+    start_time              timestamp,
+    end_time                timestamp,
+    submit_time             timestamp,
+    cpu_duration            bigint,
+    wall_duration           integer,
+    user_time               integer,
+    kernel_time             integer,
+    major_page_faults       integer,
+    runtime_environments    varchar[],
+    exit_code               integer,
+    downloads               varchar[],
+    uploads                 varchar[],
+    insert_hostname         varchar,
+    insert_identity         varchar,
+    insert_time             timestamp,
+    memory                  sgas_memory[],
+    row_id                  integer,
+    new_row                 boolean         NOT NULL DEFAULT false
+);
+
+-- used for updating the aggregated data one slice at a time
+CREATE INDEX uraggregated_data_slice_idx ON uraggregated_data (insert_time, machine_name_id);
+
+-- used for updating the monthly rollup one machine / month at a time
+CREATE INDEX uraggregated_data_execution_idx ON uraggregated_data (machine_name_id, execution_time);
+
+-- monthly rollup of the aggregated data, used for queries over whole months
+-- cputime and walltime are in hours, summed from the (rounded) hours of the
+-- aggregated data, so the sums are the same as when using the aggregated data
+CREATE TABLE uraggregated_monthly_data (
+    execution_month         date,
+    machine_name_id         integer,
+    queue_id                integer,
+    global_user_name_id     integer,
+    local_user_id           integer,
+    vo_information_id       integer,
+    project_name_id         integer,
+    runtime_environments_id integer[],
+    status_id               integer,
+    insert_host_id          integer,
+    first_execution_time    date,
+    last_execution_time     date,
+    n_jobs                  integer,
+    cputime                 numeric,
+    walltime                numeric,
+    generate_time           timestamp
+);
+
+CREATE INDEX uraggregated_monthly_data_idx ON uraggregated_monthly_data (execution_month, machine_name_id);
+
+-- the machine / months of the monthly rollup which needs to be updated
+CREATE TABLE uraggregated_monthly_update (
+    execution_month     date,
+    machine_name_id     integer,
+    queued              timestamp       DEFAULT now(),
+    PRIMARY KEY (execution_month, machine_name_id)
+);
+
+-- initial content of the monthly rollup
+INSERT INTO uraggregated_monthly_data
+    (execution_month, machine_name_id, queue_id, global_user_name_id, local_user_id,
+     vo_information_id, project_name_id, runtime_environments_id, status_id, insert_host_id,
+     first_execution_time, last_execution_time, n_jobs, cputime, walltime, generate_time)
+SELECT
+    date_trunc('month', execution_time)::date, machine_name_id, queue_id, global_user_name_id, local_user_id,
+    vo_information_id, project_name_id, runtime_environments_id, status_id, insert_host_id,
+    min(execution_time), max(execution_time), sum(n_jobs), sum(ROUND(cputime / 3600.0, 2)), sum(ROUND(walltime / 3600.0, 2)), now()
+FROM uraggregated_data
+WHERE execution_time IS NOT NULL
+GROUP BY
+    date_trunc('month', execution_time)::date, machine_name_id, queue_id, global_user_name_id, local_user_id,
+    vo_information_id, project_name_id, runtime_environments_id, status_id, insert_host_id;
+
+
+-- the monthly rollup, with the same columns as uraggregated (execution_time
+-- is the first day of the month)
+CREATE VIEW uraggregated_monthly AS
+SELECT
+    execution_month                                                                 AS execution_time,
+    first_execution_time                                                            AS first_execution_time,
+    last_execution_time                                                             AS last_execution_time,
+    machinename.machine_name                                                        AS machine_name,
+    jobqueue.queue                                                                  AS queue,
+    CASE WHEN global_user_name_id IS NOT NULL THEN globalusername.global_user_name
+        ELSE machine_name || ':' || localuser.local_user
+    END                                                                             AS user_identity,
+    CASE WHEN vo_information_id IS NOT NULL THEN
+        CASE WHEN voinformation.vo_issuer LIKE 'file:///%' THEN NULL
+             WHEN voinformation.vo_issuer LIKE 'http://%'  THEN NULL
+             WHEN voinformation.vo_issuer LIKE 'https://%' THEN NULL
+             ELSE voinformation.vo_issuer
+        END
+        ELSE NULL
+    END                                                                             AS vo_issuer,
+    CASE WHEN vo_information_id IS NOT NULL THEN
+        CASE WHEN voinformation.vo_name LIKE '/%' THEN NULL
+             ELSE voinformation.vo_name
+        END
+        ELSE machine_name || ':' || projectname.project_name
+    END                                                                             AS vo_name,
+    voinformation.vo_attributes[1][1]                                               AS vo_group,
+    voinformation.vo_attributes[1][2]                                               AS vo_role,
+    CASE WHEN runtime_environments_id IS NOT NULL
+        THEN ARRAY(SELECT runtime_environment FROM runtimeenvironment WHERE id IN (SELECT unnest(runtime_environments_id)))
+        ELSE NULL
+    END                                                                             AS runtime_environments,
+    jobstatus.status                                                                AS status,
+    inserthost.insert_host                                                          AS insert_host,
+    n_jobs                                                                          AS n_jobs,
+    cputime                                                                         AS cputime,
+    walltime                                                                        AS walltime,
+    generate_time                                                                   AS generate_time
+FROM
+    uraggregated_monthly_data
+LEFT OUTER JOIN machinename         ON (uraggregated_monthly_data.machine_name_id     = machinename.id)
+LEFT OUTER JOIN jobqueue            ON (uraggregated_monthly_data.queue_id            = jobqueue.id)
+LEFT OUTER JOIN globalusername      ON (uraggregated_monthly_data.global_user_name_id = globalusername.id)
+LEFT OUTER JOIN localuser           ON (uraggregated_monthly_data.local_user_id       = localuser.id)
+LEFT OUTER JOIN voinformation       ON (uraggregated_monthly_data.vo_information_id   = voinformation.id)
+LEFT OUTER JOIN projectname         ON (uraggregated_monthly_data.project_name_id     = projectname.id)
+LEFT OUTER JOIN jobstatus           ON (uraggregated_monthly_data.status_id           = jobstatus.id)
+LEFT OUTER JOIN inserthost          ON (uraggregated_monthly_data.insert_host_id      = inserthost.id)
+;
+
+-- the scaled columns of usagerecords and uraggregated use the scale factor
+-- valid when the job executed (instead of the current one)
+CREATE OR REPLACE VIEW usagerecords AS
+SELECT
+    record_id,
+    create_time,
+    globalusername.global_user_name,
+    voinformation.vo_type,
+    voinformation.vo_issuer,
+    voinformation.vo_name,
+    voinformation.vo_attributes,
+    machinename.machine_name,
+    global_job_id,
+    local_job_id,
+    localuser.local_user,
+    job_name,
+    charge,
+    jobstatus.status,
+    jobqueue.queue,
+    host.host,
+    node_count,
+    processors,
+    projectname.project_name,
+    submithost.submit_host,
+    start_time,
+    end_time,
+    submit_time,
+    cpu_duration,
+    wall_duration,
+    cpu_duration  * hs.scale_factor AS cpu_duration_scaled,
+    wall_duration * hs.scale_factor AS wall_duration_scaled,
+    user_time,
+    kernel_time,
+    major_page_faults,
+    ARRAY(SELECT runtimeenvironment.runtime_environment
+          FROM runtimeenvironment, runtimeenvironment_usagedata
+          WHERE usagedata.id = runtimeenvironment_usagedata.usagedata_id AND
+                runtimeenvironment_usagedata.runtimeenvironments_id = runtimeenvironment.id)
+    AS runtime_environments,
+    exit_code,
+    inserthost.insert_host,
+    insertidentity.insert_identity,
+    insert_time
+FROM
+    usagedata
+-- the scale factor (of the default type) valid when the job started, the
+-- validity periods of a machine do not overlap, so there is at most one
+LEFT OUTER JOIN hostscalefactors_data hs ON (usagedata.machine_name_id = hs.machine_name_id AND
+                                             hs.scalefactor_type_id = (SELECT id FROM hostscalefactor_type_default LIMIT 1) AND
+                                             hs.validity_period @> start_time)
+LEFT OUTER JOIN globalusername  ON (usagedata.global_user_name_id = globalusername.id)
+LEFT OUTER JOIN voinformation   ON (usagedata.vo_information_id   = voinformation.id)
+LEFT OUTER JOIN localuser       ON (usagedata.local_user_id       = localuser.id)
+LEFT OUTER JOIN machinename     ON (usagedata.machine_name_id     = machinename.id)
+LEFT OUTER JOIN jobqueue        ON (usagedata.queue_id            = jobqueue.id)
+LEFT OUTER JOIN host            ON (usagedata.host_id             = host.id)
+LEFT OUTER JOIN jobstatus       ON (usagedata.status_id           = jobstatus.id)
+LEFT OUTER JOIN projectname     ON (usagedata.project_name_id     = projectname.id)
+LEFT OUTER JOIN submithost      ON (usagedata.submit_host_id      = submithost.id)
+LEFT OUTER JOIN inserthost      ON (usagedata.insert_host_id      = inserthost.id)
+LEFT OUTER JOIN insertidentity  ON (usagedata.insert_identity_id  = insertidentity.id)
+;
+
+
+CREATE OR REPLACE VIEW uraggregated AS
+SELECT
+    execution_time                                                                  AS execution_time,
+    insert_time                                                                     AS insert_time,
+    machinename.machine_name                                                        AS machine_name,
+    jobqueue.queue                                                                  AS queue,
+    CASE WHEN global_user_name_id IS NOT NULL THEN globalusername.global_user_name
+        ELSE machine_name || ':' || localuser.local_user
+    END                                                                             AS user_identity,
+    CASE WHEN vo_information_id IS NOT NULL THEN
+        CASE WHEN voinformation.vo_issuer LIKE 'file:///%' THEN NULL
+             WHEN voinformation.vo_issuer LIKE 'http://%'  THEN NULL
+             WHEN voinformation.vo_issuer LIKE 'https://%' THEN NULL
+             ELSE voinformation.vo_issuer
+        END
+        ELSE NULL
+    END                                                                             AS vo_issuer,
+    CASE WHEN vo_information_id IS NOT NULL THEN
+        CASE WHEN voinformation.vo_name LIKE '/%' THEN NULL
+             ELSE voinformation.vo_name
+        END
+        ELSE machine_name || ':' || projectname.project_name
+    END                                                                             AS vo_name,
+    voinformation.vo_attributes[1][1]                                               AS vo_group,
+    voinformation.vo_attributes[1][2]                                               AS vo_role,
+    CASE WHEN runtime_environments_id IS NOT NULL
+        THEN ARRAY(SELECT runtime_environment FROM runtimeenvironment WHERE id IN (SELECT unnest(runtime_environments_id)))
+        ELSE NULL
+    END                                                                             AS runtime_environments,
+    jobstatus.status                                                                AS status,
+    inserthost.insert_host                                                          AS insert_host,
+    n_jobs                                                                          AS n_jobs,
+    ROUND(cputime  / 3600.0, 2)                                                     AS cputime,
+    ROUND(walltime / 3600.0, 2)                                                     AS walltime,
+    ROUND(cputime  / 3600.0, 2) * hs.scale_factor                                   AS cputime_scaled,
+    ROUND(walltime / 3600.0, 2) * hs.scale_factor                                   AS walltime_scaled,
+    generate_time                                                                   AS generate_time
+FROM
+    uraggregated_data
+-- the scale factor (of the default type) valid at the execution day
+LEFT OUTER JOIN hostscalefactors_data hs ON (uraggregated_data.machine_name_id = hs.machine_name_id AND
+                                             hs.scalefactor_type_id = (SELECT id FROM hostscalefactor_type_default LIMIT 1) AND
+                                             hs.validity_period @> execution_time::timestamp)
+LEFT OUTER JOIN machinename         ON (uraggregated_data.machine_name_id     = machinename.id)
+LEFT OUTER JOIN jobqueue            ON (uraggregated_data.queue_id            = jobqueue.id)
+LEFT OUTER JOIN globalusername      ON (uraggregated_data.global_user_name_id = globalusername.id)
+LEFT OUTER JOIN localuser           ON (uraggregated_data.local_user_id       = localuser.id)
+LEFT OUTER JOIN voinformation       ON (uraggregated_data.vo_information_id   = voinformation.id)
+LEFT OUTER JOIN projectname         ON (uraggregated_data.project_name_id     = projectname.id)
+LEFT OUTER JOIN jobstatus           ON (uraggregated_data.status_id           = jobstatus.id)
+LEFT OUTER JOIN inserthost          ON (uraggregated_data.insert_host_id      = inserthost.id)
+;
+
+
+-- per-day cache of the scale factors, for custom views and queries using
+-- scaled numbers: join on machine_name_id, scalefactor_type_id and day (e.g.,
+-- execution_time). The factor of a day is the one valid at its start, open
+-- ended validity periods are expanded from 2000-01-01 to a year after the
+-- refresh. It is refreshed when hostscalefactors_data changes (see
+-- sgas-postgres-functions.sql) and when SGAS starts.
+CREATE MATERIALIZED VIEW hostscalefactors_daily AS
+        SELECT hs.machine_name_id,
+               hs.scalefactor_type_id,
+               d.day::date AS day,
+               hs.scale_factor
+        FROM hostscalefactors_data hs
+        CROSS JOIN LATERAL generate_series(date_trunc('day', GREATEST(lower(hs.validity_period), TIMESTAMP '2000-01-01')),
+                                           LEAST(upper(hs.validity_period), current_date + 366),
+                                           interval '1 day') AS d(day)
+        WHERE hs.validity_period @> d.day
+;
+
+CREATE UNIQUE INDEX hostscalefactors_daily_idx ON hostscalefactors_daily (machine_name_id, day, scalefactor_type_id);
+
+COMMIT;
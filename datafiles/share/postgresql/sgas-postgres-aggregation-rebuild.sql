@@ -3,11 +3,15 @@
 -- Increasing the work_mem parameter to 16-24 MB (from the default 1 MB),
 -- can decrease the time significantly.
 -- SGAS should NOT be running while this script is running.
+-- For large databases, use the sgas-aggregation-rebuild tool instead, which
+-- rebuilds in parallel, can be resumed, and does not require stopping SGAS.
 
 
 -- clear the aggregation tables
 TRUNCATE TABLE uraggregated_data;
 TRUNCATE TABLE uraggregated_update;
+TRUNCATE TABLE uraggregated_monthly_data;
+TRUNCATE TABLE uraggregated_monthly_update;
 
 -- update all aggregation combinations
 INSERT INTO uraggregated_update SELECT DISTINCT insert_time::DATE, machine_name_id FROM usagedata;
@@ -27,6 +31,13 @@ BEGIN
         END IF;
         updates = updates + 1;
     END LOOP;
+    -- then the monthly rollup, the months are marked by update_uraggregate
+    LOOP
+        SELECT update_uraggregate_monthly() INTO update_info;
+        IF update_info IS NULL THEN
+            EXIT;
+        END IF;
+    END LOOP;
     RETURN updates;
 END;
 $updates$
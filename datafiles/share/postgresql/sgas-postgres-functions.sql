@@ -348,6 +348,472 @@ LANGUAGE plpgsql;
 
 
 
+CREATE OR REPLACE FUNCTION urcreate_ids (
+    in_record_id               varchar,
+    in_create_time             timestamp,
+    in_global_job_id           varchar,
+    in_local_job_id            varchar,
+    in_local_user_id           integer,
+    in_global_user_name_id     integer,
+    in_vo_information_id       integer,
+    in_machine_name_id         integer,
+    in_job_name                varchar,
+    in_charge                  integer,
+    in_status_id               integer,
+    in_queue_id                integer,
+    in_host_id                 integer,
+    in_node_count              integer,
+    in_processors              integer,
+    in_project_name_id         integer,
+    in_submit_host_id          integer,
+    in_start_time              timestamp,
+    in_end_time                timestamp,
+    in_submit_time             timestamp,
+    in_cpu_duration            bigint,
+    in_wall_duration           integer,
+    in_user_time               integer,
+    in_kernel_time             integer,
+    in_major_page_faults       integer,
+    in_runtime_environments    varchar[],
+    in_exit_code               integer,
+    in_downloads               varchar[],
+    in_uploads                 varchar[],
+    in_insert_host_id          integer,
+    in_insert_identity_id      integer,
+    in_insert_time             timestamp,
+    in_memory                  sgas_memory[]
+)
+RETURNS varchar[] AS $recordid_rowid$
+
+-- variant of urcreate, where the dimension values (local user, machine name, etc.)
+-- have already been resolved into ids by the caller (see the dimension cache)
+
+DECLARE
+    runtime_environment_id  integer;
+    jobtransferurl_id       integer;
+
+    ur_id                   integer;
+    ur_global_job_id        varchar;
+    ur_machine_name_id      integer;
+    ur_insert_time          date;
+
+    result                  varchar[];
+BEGIN
+    -- first check that we do not have the record already
+    SELECT usagedata.id, global_job_id, machine_name_id, insert_time::date
+           INTO ur_id, ur_global_job_id, ur_machine_name_id, ur_insert_time
+           FROM usagedata
+           WHERE record_id = in_record_id;
+    IF FOUND THEN
+        -- same replacement rules as in urcreate
+        IF in_global_job_id = ur_global_job_id OR in_global_job_id = in_record_id THEN
+            result[0] = in_record_id;
+            result[1] = ur_id;
+            RETURN result;
+        ELSE
+            DELETE FROM usagedata WHERE record_id = in_record_id;
+            PERFORM * FROM uraggregated_update WHERE insert_time = ur_insert_time::date AND machine_name_id = ur_machine_name_id;
+            IF NOT FOUND THEN
+                INSERT INTO uraggregated_update (insert_time, machine_name_id) VALUES (ur_insert_time, ur_machine_name_id);
+            END IF;
+        END IF;
+    END IF;
+
+    INSERT INTO usagedata (
+                        record_id,
+                        create_time,
+                        global_user_name_id,
+                        vo_information_id,
+                        machine_name_id,
+                        global_job_id,
+                        local_job_id,
+                        local_user_id,
+                        job_name,
+                        charge,
+                        status_id,
+                        queue_id,
+                        host_id,
+                        node_count,
+                        processors,
+                        project_name_id,
+                        submit_host_id,
+                        start_time,
+                        end_time,
+                        submit_time,
+                        cpu_duration,
+                        wall_duration,
+                        user_time,
+                        kernel_time,
+                        major_page_faults,
+                        exit_code,
+                        insert_host_id,
+                        insert_identity_id,
+                        insert_time,
+                        memory
+                    )
+            VALUES (
+                        in_record_id,
+                        in_create_time,
+                        in_global_user_name_id,
+                        in_vo_information_id,
+                        in_machine_name_id,
+                        in_global_job_id,
+                        in_local_job_id,
+                        in_local_user_id,
+                        in_job_name,
+                        in_charge,
+                        in_status_id,
+                        in_queue_id,
+                        in_host_id,
+                        in_node_count::smallint,
+                        in_processors,
+                        in_project_name_id,
+                        in_submit_host_id,
+                        in_start_time,
+                        in_end_time,
+                        in_submit_time,
+                        in_cpu_duration,
+                        in_wall_duration,
+                        in_user_time,
+                        in_kernel_time,
+                        in_major_page_faults,
+                        in_exit_code::smallint,
+                        in_insert_host_id,
+                        in_insert_identity_id,
+                        in_insert_time,
+                        in_memory
+                    )
+            RETURNING id into ur_id;
+
+    -- runtime environments
+    IF in_runtime_environments IS NOT NULL THEN
+        FOR i IN array_lower(in_runtime_environments, 1) .. array_upper(in_runtime_environments, 1) LOOP
+            SELECT INTO runtime_environment_id id FROM runtimeenvironment WHERE runtime_environment = in_runtime_environments[i];
+            IF NOT FOUND THEN
+                INSERT INTO runtimeenvironment (runtime_environment) VALUES (in_runtime_environments[i]) RETURNING id INTO runtime_environment_id;
+            END IF;
+            PERFORM * FROM runtimeenvironment_usagedata WHERE usagedata_id = ur_id AND runtime_environment_id = runtimeenvironments_id;
+            IF NOT FOUND THEN
+                INSERT INTO runtimeenvironment_usagedata (usagedata_id, runtimeenvironments_id) VALUES (ur_id, runtime_environment_id);
+            END IF;
+        END LOOP;
+    END IF;
+
+    -- create rows for file transfers
+    IF in_downloads IS NOT NULL THEN
+        FOR i IN array_lower(in_downloads, 1) .. array_upper(in_downloads, 1) LOOP
+            SELECT INTO jobtransferurl_id id FROM jobtransferurl WHERE url = in_downloads[i][1];
+            IF NOT FOUND THEN
+                INSERT INTO jobtransferurl (url) VALUES (in_downloads[i][1]) RETURNING id INTO jobtransferurl_id;
+            END IF;
+            INSERT INTO jobtransferdata (usage_data_id, job_transfer_url_id, transfer_type,
+                                         size, start_time, end_time, bypass_cache, retrieved_from_cache)
+                   VALUES (ur_id, jobtransferurl_id, 'download',
+                           in_downloads[i][2]::bigint, in_downloads[i][3]::timestamp, in_downloads[i][4]::timestamp,
+                           in_downloads[i][5]::boolean, in_downloads[i][6]::boolean);
+        END LOOP;
+    END IF;
+
+    IF in_uploads IS NOT NULL THEN
+        FOR i IN array_lower(in_uploads, 1) .. array_upper(in_uploads, 1) LOOP
+            SELECT INTO jobtransferurl_id id FROM jobtransferurl WHERE url = in_uploads[i][1];
+            IF NOT FOUND THEN
+                INSERT INTO jobtransferurl (url) VALUES (in_uploads[i][1]) RETURNING id INTO jobtransferurl_id;
+            END IF;
+            INSERT INTO jobtransferdata (usage_data_id, job_transfer_url_id, transfer_type, size, start_time, end_time)
+                   VALUES (ur_id, jobtransferurl_id, 'upload',
+                           in_uploads[i][2]::bigint, in_uploads[i][3]::timestamp, in_uploads[i][4]::timestamp);
+        END LOOP;
+    END IF;
+
+    -- finally we update the table describing what aggregated information should be updated
+    PERFORM * FROM uraggregated_update WHERE insert_time = in_insert_time::date AND machine_name_id = in_machine_name_id;
+    IF NOT FOUND THEN
+        INSERT INTO uraggregated_update (insert_time, machine_name_id) VALUES (in_insert_time::date, in_machine_name_id);
+    END IF;
+
+    result[0] = in_record_id;
+    result[1] = ur_id;
+    RETURN result;
+
+END;
+$recordid_rowid$
+LANGUAGE plpgsql;
+
+
+
+CREATE OR REPLACE FUNCTION uraggregate_bulk_delta ( )
+RETURNS void AS $$
+
+BEGIN
+    -- adds the records inserted by urcreate_bulk (the new rows in urbulk_staging)
+    -- to the aggregated data, as deltas to the existing aggregation rows, instead
+    -- of marking their slices for a full update (see update_uraggregate)
+
+    -- lock the slices, so the deltas are not applied while update_uraggregate
+    -- recomputes the same slice (locks are taken in order to avoid deadlocks)
+    PERFORM pg_advisory_xact_lock(l.machine_name_id, l.insert_time - DATE '2000-01-01')
+        FROM (SELECT DISTINCT u.machine_name_id, u.insert_time::date AS insert_time
+              FROM urbulk_staging s JOIN usagedata u ON (u.id = s.row_id)
+              WHERE s.new_row
+              ORDER BY 1, 2) l;
+
+    -- mark the months of the deltas for the monthly rollup
+    INSERT INTO uraggregated_monthly_update (execution_month, machine_name_id)
+        SELECT DISTINCT date_trunc('month', COALESCE(u.end_time, u.create_time))::date, u.machine_name_id
+        FROM urbulk_staging s JOIN usagedata u ON (u.id = s.row_id)
+        WHERE s.new_row AND COALESCE(u.end_time, u.create_time) IS NOT NULL AND u.machine_name_id IS NOT NULL
+        ORDER BY 1, 2
+    ON CONFLICT (execution_month, machine_name_id) DO UPDATE SET queued = now();
+
+    WITH delta AS (
+        SELECT
+            COALESCE(u.end_time::DATE, u.create_time::DATE)                                 AS execution_time,
+            u.insert_time::DATE                                                             AS insert_time,
+            u.machine_name_id                                                               AS machine_name_id,
+            u.queue_id                                                                      AS queue_id,
+            u.global_user_name_id                                                           AS global_user_name_id,
+            CASE WHEN u.global_user_name_id IS NULL THEN u.local_user_id ELSE NULL END      AS local_user_id,
+            u.vo_information_id                                                             AS vo_information_id,
+            CASE WHEN u.vo_information_id IS NULL THEN u.project_name_id ELSE NULL END      AS project_name_id,
+            ARRAY(SELECT r.runtimeenvironments_id
+                  FROM runtimeenvironment_usagedata r
+                  WHERE r.usagedata_id = u.id)                                              AS runtime_environments_id,
+            u.status_id                                                                     AS status_id,
+            u.insert_host_id                                                                AS insert_host_id,
+            count(*)                                                                        AS n_jobs,
+            SUM(COALESCE(u.cpu_duration::bigint,0))                                         AS cputime,
+            SUM(COALESCE(u.wall_duration::bigint,0) * COALESCE(u.processors,1))             AS walltime
+        FROM urbulk_staging s JOIN usagedata u ON (u.id = s.row_id)
+        WHERE s.new_row
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11
+    ),
+    updated AS (
+        UPDATE uraggregated_data a
+            SET n_jobs = a.n_jobs + d.n_jobs,
+                cputime = a.cputime + d.cputime,
+                walltime = a.walltime + d.walltime,
+                generate_time = now()
+            FROM delta d
+            WHERE a.insert_time = d.insert_time AND a.machine_name_id = d.machine_name_id AND
+                  (a.execution_time, a.queue_id, a.global_user_name_id, a.local_user_id, a.vo_information_id,
+                   a.project_name_id, a.runtime_environments_id, a.status_id, a.insert_host_id)
+                  IS NOT DISTINCT FROM
+                  (d.execution_time, d.queue_id, d.global_user_name_id, d.local_user_id, d.vo_information_id,
+                   d.project_name_id, d.runtime_environments_id, d.status_id, d.insert_host_id)
+            RETURNING d.*
+    )
+    INSERT INTO uraggregated_data
+        (execution_time, insert_time, machine_name_id, queue_id,
+         global_user_name_id, local_user_id, vo_information_id, project_name_id,
+         runtime_environments_id, status_id, insert_host_id, n_jobs, cputime, walltime, generate_time)
+    SELECT d.*, now()
+    FROM delta d
+    WHERE NOT EXISTS (SELECT 1 FROM updated x
+                      WHERE x.insert_time = d.insert_time AND x.machine_name_id = d.machine_name_id AND
+                            (x.execution_time, x.queue_id, x.global_user_name_id, x.local_user_id, x.vo_information_id,
+                             x.project_name_id, x.runtime_environments_id, x.status_id, x.insert_host_id)
+                            IS NOT DISTINCT FROM
+                            (d.execution_time, d.queue_id, d.global_user_name_id, d.local_user_id, d.vo_information_id,
+                             d.project_name_id, d.runtime_environments_id, d.status_id, d.insert_host_id));
+
+END;
+$$
+LANGUAGE plpgsql;
+
+
+
+-- the function used to take no arguments
+DROP FUNCTION IF EXISTS urcreate_bulk ( );
+
+CREATE OR REPLACE FUNCTION urcreate_bulk ( in_delta_aggregation boolean DEFAULT false )
+RETURNS SETOF varchar[] AS $recordid_rowid$
+
+BEGIN
+    -- set-based variant of urcreate, which inserts all records loaded into the
+    -- urbulk_staging table (a temporary table created from urbulk_template) in
+    -- a handful of statements. The replacement rules are the same as for urcreate.
+    -- The caller must collapse duplicate record ids in the batch before loading.
+
+    -- existing records which should not be replaced
+    UPDATE urbulk_staging s SET row_id = u.id
+        FROM usagedata u
+        WHERE u.record_id = s.record_id AND
+              (s.global_job_id = u.global_job_id OR s.global_job_id = s.record_id);
+
+    -- existing records which will be replaced, mark their slices for update and delete them
+    INSERT INTO uraggregated_update (insert_time, machine_name_id)
+        SELECT DISTINCT u.insert_time::date, u.machine_name_id
+        FROM usagedata u JOIN urbulk_staging s ON (u.record_id = s.record_id)
+        WHERE s.row_id IS NULL AND
+              NOT EXISTS (SELECT 1 FROM uraggregated_update a
+                          WHERE a.insert_time = u.insert_time::date AND a.machine_name_id = u.machine_name_id);
+
+    DELETE FROM usagedata u USING urbulk_staging s
+        WHERE u.record_id = s.record_id AND s.row_id IS NULL;
+
+    -- dimensions
+    INSERT INTO localuser (local_user)
+        SELECT DISTINCT local_user_id FROM urbulk_staging WHERE row_id IS NULL AND local_user_id IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO globalusername (global_user_name)
+        SELECT DISTINCT global_user_name FROM urbulk_staging WHERE row_id IS NULL AND global_user_name IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO voinformation (vo_type, vo_issuer, vo_name, vo_attributes)
+        SELECT DISTINCT s.vo_type, s.vo_issuer, s.vo_name, s.vo_attributes
+        FROM urbulk_staging s
+        WHERE s.row_id IS NULL AND s.vo_name IS NOT NULL AND
+              NOT EXISTS (SELECT 1 FROM voinformation v
+                          WHERE v.vo_type       IS NOT DISTINCT FROM s.vo_type AND
+                                v.vo_issuer     IS NOT DISTINCT FROM s.vo_issuer AND
+                                v.vo_name       IS NOT DISTINCT FROM s.vo_name AND
+                                v.vo_attributes IS NOT DISTINCT FROM s.vo_attributes);
+    INSERT INTO machinename (machine_name)
+        SELECT DISTINCT machine_name FROM urbulk_staging WHERE row_id IS NULL AND machine_name IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO jobstatus (status)
+        SELECT DISTINCT status FROM urbulk_staging WHERE row_id IS NULL AND status IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO jobqueue (queue)
+        SELECT DISTINCT queue FROM urbulk_staging WHERE row_id IS NULL AND queue IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO host (host)
+        SELECT DISTINCT host FROM urbulk_staging WHERE row_id IS NULL AND host IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO projectname (project_name)
+        SELECT DISTINCT project_name FROM urbulk_staging WHERE row_id IS NULL AND project_name IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO submithost (submit_host)
+        SELECT DISTINCT submit_host FROM urbulk_staging WHERE row_id IS NULL AND submit_host IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO inserthost (insert_host)
+        SELECT DISTINCT insert_hostname FROM urbulk_staging WHERE row_id IS NULL AND insert_hostname IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    INSERT INTO insertidentity (insert_identity)
+        SELECT DISTINCT insert_identity FROM urbulk_staging WHERE row_id IS NULL AND insert_identity IS NOT NULL
+        ON CONFLICT DO NOTHING;
+
+    -- the records themselves
+    WITH inserted AS (
+        INSERT INTO usagedata (
+                        record_id, create_time, global_user_name_id, vo_information_id, machine_name_id,
+                        global_job_id, local_job_id, local_user_id, job_name, charge, status_id, queue_id,
+                        host_id, node_count, processors, project_name_id, submit_host_id, start_time,
+                        end_time, submit_time, cpu_duration, wall_duration, user_time, kernel_time,
+                        major_page_faults, exit_code, insert_host_id, insert_identity_id, insert_time, memory
+                    )
+            SELECT
+                s.record_id,
+                s.create_time,
+                globalusername.id,
+                (SELECT min(v.id) FROM voinformation v
+                 WHERE v.vo_type       IS NOT DISTINCT FROM s.vo_type AND
+                       v.vo_issuer     IS NOT DISTINCT FROM s.vo_issuer AND
+                       v.vo_name       IS NOT DISTINCT FROM s.vo_name AND
+                       v.vo_attributes IS NOT DISTINCT FROM s.vo_attributes),
+                machinename.id,
+                s.global_job_id,
+                s.local_job_id,
+                localuser.id,
+                s.job_name,
+                s.charge,
+                jobstatus.id,
+                jobqueue.id,
+                host.id,
+                s.node_count::smallint,
+                s.processors,
+                projectname.id,
+                submithost.id,
+                s.start_time,
+                s.end_time,
+                s.submit_time,
+                s.cpu_duration,
+                s.wall_duration,
+                s.user_time,
+                s.kernel_time,
+                s.major_page_faults,
+                s.exit_code::smallint,
+                inserthost.id,
+                insertidentity.id,
+                s.insert_time,
+                s.memory
+            FROM urbulk_staging s
+            LEFT OUTER JOIN localuser       ON (localuser.local_user             = s.local_user_id)
+            LEFT OUTER JOIN globalusername  ON (globalusername.global_user_name  = s.global_user_name)
+            LEFT OUTER JOIN machinename     ON (machinename.machine_name         = s.machine_name)
+            LEFT OUTER JOIN jobstatus       ON (jobstatus.status                 = s.status)
+            LEFT OUTER JOIN jobqueue        ON (jobqueue.queue                   = s.queue)
+            LEFT OUTER JOIN host            ON (host.host                        = s.host)
+            LEFT OUTER JOIN projectname     ON (projectname.project_name         = s.project_name)
+            LEFT OUTER JOIN submithost      ON (submithost.submit_host           = s.submit_host)
+            LEFT OUTER JOIN inserthost      ON (inserthost.insert_host           = s.insert_hostname)
+            LEFT OUTER JOIN insertidentity  ON (insertidentity.insert_identity   = s.insert_identity)
+            WHERE s.row_id IS NULL
+            RETURNING id, record_id
+    )
+    UPDATE urbulk_staging s SET row_id = inserted.id, new_row = true
+        FROM inserted
+        WHERE s.record_id = inserted.record_id;
+
+    -- runtime environments
+    INSERT INTO runtimeenvironment (runtime_environment)
+        SELECT DISTINCT re.runtime_environment
+        FROM urbulk_staging s CROSS JOIN LATERAL unnest(s.runtime_environments) AS re(runtime_environment)
+        WHERE s.new_row
+        ON CONFLICT DO NOTHING;
+    INSERT INTO runtimeenvironment_usagedata (usagedata_id, runtimeenvironments_id)
+        SELECT DISTINCT s.row_id, runtimeenvironment.id
+        FROM urbulk_staging s CROSS JOIN LATERAL unnest(s.runtime_environments) AS re(runtime_environment)
+        JOIN runtimeenvironment ON (runtimeenvironment.runtime_environment = re.runtime_environment)
+        WHERE s.new_row;
+
+    -- file transfers
+    INSERT INTO jobtransferurl (url)
+        SELECT s.downloads[i][1]
+        FROM urbulk_staging s CROSS JOIN LATERAL generate_subscripts(s.downloads, 1) AS i
+        WHERE s.new_row
+        UNION
+        SELECT s.uploads[i][1]
+        FROM urbulk_staging s CROSS JOIN LATERAL generate_subscripts(s.uploads, 1) AS i
+        WHERE s.new_row
+        ON CONFLICT DO NOTHING;
+    INSERT INTO jobtransferdata (usage_data_id, job_transfer_url_id, transfer_type,
+                                 size, start_time, end_time, bypass_cache, retrieved_from_cache)
+        SELECT s.row_id, jobtransferurl.id, 'download',
+               s.downloads[i][2]::bigint, s.downloads[i][3]::timestamp, s.downloads[i][4]::timestamp,
+               s.downloads[i][5]::boolean, s.downloads[i][6]::boolean
+        FROM urbulk_staging s CROSS JOIN LATERAL generate_subscripts(s.downloads, 1) AS i
+        JOIN jobtransferurl ON (jobtransferurl.url = s.downloads[i][1])
+        WHERE s.new_row;
+    INSERT INTO jobtransferdata (usage_data_id, job_transfer_url_id, transfer_type, size, start_time, end_time)
+        SELECT s.row_id, jobtransferurl.id, 'upload',
+               s.uploads[i][2]::bigint, s.uploads[i][3]::timestamp, s.uploads[i][4]::timestamp
+        FROM urbulk_staging s CROSS JOIN LATERAL generate_subscripts(s.uploads, 1) AS i
+        JOIN jobtransferurl ON (jobtransferurl.url = s.uploads[i][1])
+        WHERE s.new_row;
+
+    IF in_delta_aggregation THEN
+        -- add the new records to the aggregated data right away, only the slices
+        -- of replaced records (marked above) are updated by update_uraggregate
+        PERFORM uraggregate_bulk_delta();
+    ELSE
+        -- finally we update the table describing what aggregated information should be updated
+        INSERT INTO uraggregated_update (insert_time, machine_name_id)
+            SELECT DISTINCT s.insert_time::date, u.machine_name_id
+            FROM urbulk_staging s JOIN usagedata u ON (u.id = s.row_id)
+            WHERE s.new_row AND
+                  NOT EXISTS (SELECT 1 FROM uraggregated_update a
+                              WHERE a.insert_time = s.insert_time::date AND a.machine_name_id = u.machine_name_id);
+    END IF;
+
+    RETURN QUERY SELECT ARRAY[s.record_id, s.row_id::varchar] FROM urbulk_staging s;
+
+END;
+$recordid_rowid$
+LANGUAGE plpgsql;
+
+
+
 CREATE OR REPLACE FUNCTION update_uraggregate ( )
 RETURNS varchar[] AS $insertdate_machinename$
 
@@ -361,16 +827,29 @@ BEGIN
     -- start a transaction, at which time it is to late to set it
     -- therefore we trust the caller of the function to set it for us
 
-    -- get data for what to update
+    -- get data for what to update, slices being updated by other
+    -- aggregation workers are locked, and skipped
     SELECT insert_time, machine_name_id INTO q_insert_date, q_machine_name_id
-        FROM uraggregated_update ORDER BY insert_time LIMIT 1;
+        FROM uraggregated_update ORDER BY insert_time LIMIT 1
+        FOR UPDATE SKIP LOCKED;
     IF NOT FOUND THEN
         -- nothing to update
         RETURN result;
     END IF;
 
+    -- wait for inserts adding deltas to the slice (see uraggregate_bulk_delta)
+    PERFORM pg_advisory_xact_lock(q_machine_name_id, q_insert_date - DATE '2000-01-01');
+
     -- delete aggregation update row
     DELETE FROM uraggregated_update WHERE insert_time = q_insert_date AND machine_name_id = q_machine_name_id;
+    -- mark the months of the slice for the monthly rollup, both the months of
+    -- the existing rows (which may disappear) and the months of the new rows
+    INSERT INTO uraggregated_monthly_update (execution_month, machine_name_id)
+        SELECT DISTINCT date_trunc('month', execution_time)::date, machine_name_id
+        FROM uraggregated_data
+        WHERE insert_time = q_insert_date AND machine_name_id = q_machine_name_id AND execution_time IS NOT NULL
+        ORDER BY 1
+    ON CONFLICT (execution_month, machine_name_id) DO UPDATE SET queued = now();
     -- delete existing aggregated rows that will be updated
     DELETE FROM uraggregated_data WHERE insert_time = q_insert_date AND machine_name_id = q_machine_name_id;
 
@@ -405,6 +884,13 @@ BEGIN
         s_global_user_name_id, s_local_user_id, s_vo_information_id, s_project_name_id,
         s_runtime_environments, s_status_id, s_insert_host_id;
 
+    INSERT INTO uraggregated_monthly_update (execution_month, machine_name_id)
+        SELECT DISTINCT date_trunc('month', execution_time)::date, machine_name_id
+        FROM uraggregated_data
+        WHERE insert_time = q_insert_date AND machine_name_id = q_machine_name_id AND execution_time IS NOT NULL
+        ORDER BY 1
+    ON CONFLICT (execution_month, machine_name_id) DO UPDATE SET queued = now();
+
     result[0] = q_insert_date::varchar;
     result[1] = q_machine_name_id;
     RETURN result;
@@ -642,3 +1128,72 @@ END;
 $recordid_rowid$
 LANGUAGE plpgsql;
 
+
+
+CREATE OR REPLACE FUNCTION update_uraggregate_monthly ( )
+RETURNS varchar[] AS $month_machinename$
+
+DECLARE
+    q_month             date;
+    q_machine_name_id   integer;
+    result              varchar[];
+BEGIN
+    -- updates one machine / month of the monthly rollup from the aggregated data
+    -- like update_uraggregate, this should run with serializable isolation level,
+    -- so a month marked again while being updated makes the update fail (and retry)
+
+    SELECT execution_month, machine_name_id INTO q_month, q_machine_name_id
+        FROM uraggregated_monthly_update ORDER BY execution_month LIMIT 1
+        FOR UPDATE SKIP LOCKED;
+    IF NOT FOUND THEN
+        -- nothing to update
+        RETURN result;
+    END IF;
+
+    DELETE FROM uraggregated_monthly_update WHERE execution_month = q_month AND machine_name_id = q_machine_name_id;
+    DELETE FROM uraggregated_monthly_data WHERE execution_month = q_month AND machine_name_id = q_machine_name_id;
+
+    INSERT INTO uraggregated_monthly_data
+        (execution_month, machine_name_id, queue_id, global_user_name_id, local_user_id,
+         vo_information_id, project_name_id, runtime_environments_id, status_id, insert_host_id,
+         first_execution_time, last_execution_time, n_jobs, cputime, walltime, generate_time)
+    SELECT
+        q_month, machine_name_id, queue_id, global_user_name_id, local_user_id,
+        vo_information_id, project_name_id, runtime_environments_id, status_id, insert_host_id,
+        min(execution_time), max(execution_time), sum(n_jobs),
+        sum(ROUND(cputime / 3600.0, 2)), sum(ROUND(walltime / 3600.0, 2)), now()
+    FROM
+        uraggregated_data
+    WHERE
+        machine_name_id = q_machine_name_id AND
+        execution_time >= q_month AND execution_time < q_month + interval '1 month'
+    GROUP BY
+        machine_name_id, queue_id, global_user_name_id, local_user_id,
+        vo_information_id, project_name_id, runtime_environments_id, status_id, insert_host_id;
+
+    result[0] = q_month::varchar;
+    result[1] = q_machine_name_id;
+    RETURN result;
+
+END;
+$month_machinename$
+LANGUAGE plpgsql;
+
+
+
+CREATE OR REPLACE FUNCTION hostscalefactors_daily_refresh ( )
+RETURNS trigger AS $$
+
+BEGIN
+    -- keeps the per-day scale factor cache in sync with the scale factors
+    REFRESH MATERIALIZED VIEW hostscalefactors_daily;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS hostscalefactors_daily_refresh ON hostscalefactors_data;
+
+CREATE TRIGGER hostscalefactors_daily_refresh
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON hostscalefactors_data
+    FOR EACH STATEMENT EXECUTE PROCEDURE hostscalefactors_daily_refresh();
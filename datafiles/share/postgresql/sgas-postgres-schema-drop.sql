@@ -2,6 +2,7 @@
 -- drop statement to clear the database
 
 DROP VIEW usagerecords;
+DROP MATERIALIZED VIEW hostscalefactors_daily;
 
 DROP TABLE usagedata;
 DROP TABLE insertidentity;
@@ -11,6 +12,9 @@ DROP TABLE globalusername;
 
 DROP TABLE uraggregated;
 DROP TABLE uraggregated_update;
+DROP VIEW uraggregated_monthly;
+DROP TABLE uraggregated_monthly_data;
+DROP TABLE uraggregated_monthly_update;
 
 DROP FUNCTION urcreate ( character varying, timestamp without time zone, character varying, character varying, character varying, character varying, character varying, character varying, character varying, character varying[], character varying, character varying, numeric, character varying, character varying, character varying, integer, character varying, character varying, timestamp without time zone, timestamp without time zone, timestamp without time zone, numeric, numeric, numeric, numeric, integer, integer, integer, character varying[], integer, character varying, character varying, timestamp without time zone) ;
 
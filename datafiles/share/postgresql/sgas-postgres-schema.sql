@@ -173,6 +173,9 @@ CREATE TABLE uraggregated_data (
     generate_time           timestamp
 );
 
+-- used for updating the aggregated data one slice at a time
+CREATE INDEX uraggregated_data_slice_idx ON uraggregated_data (insert_time, machine_name_id);
+
 -- this table is used for storing information about which parts
 -- of the aggregartion table that needs to be updated
 CREATE TABLE uraggregated_update (
@@ -180,6 +183,85 @@ CREATE TABLE uraggregated_update (
     machine_name_id     integer
 );
 
+-- used for updating the monthly rollup one machine / month at a time
+CREATE INDEX uraggregated_data_execution_idx ON uraggregated_data (machine_name_id, execution_time);
+
+-- monthly rollup of the aggregated data, used for queries over whole months
+-- cputime and walltime are in hours, summed from the (rounded) hours of the
+-- aggregated data, so the sums are the same as when using the aggregated data
+CREATE TABLE uraggregated_monthly_data (
+    execution_month         date,
+    machine_name_id         integer,
+    queue_id                integer,
+    global_user_name_id     integer,
+    local_user_id           integer,
+    vo_information_id       integer,
+    project_name_id         integer,
+    runtime_environments_id integer[],
+    status_id               integer,
+    insert_host_id          integer,
+    first_execution_time    date,
+    last_execution_time     date,
+    n_jobs                  integer,
+    cputime                 numeric,
+    walltime                numeric,
+    generate_time           timestamp
+);
+
+CREATE INDEX uraggregated_monthly_data_idx ON uraggregated_monthly_data (execution_month, machine_name_id);
+
+-- the machine / months of the monthly rollup which needs to be updated
+CREATE TABLE uraggregated_monthly_update (
+    execution_month     date,
+    machine_name_id     integer,
+    queued              timestamp       DEFAULT now(),
+    PRIMARY KEY (execution_month, machine_name_id)
+);
+
+
+-- template for the temporary staging table used by the bulk insert path
+-- (urcreate_bulk). Column names follow the argument list of urcreate.
+CREATE TABLE urbulk_template (
+    record_id               varchar,
+    create_time             timestamp,
+    global_job_id           varchar,
+    local_job_id            varchar,
+    local_user_id           varchar,
+    global_user_name        varchar,
+    vo_type                 varchar,
+    vo_issuer               varchar,
+    vo_name                 varchar,
+    vo_attributes           varchar[][],
+    machine_name            varchar,
+    job_name                varchar,
+    charge                  integer,
+    status                  varchar,
+    queue                   varchar,
+    host                    varchar,
+    node_count              integer,
+    processors              integer,
+    project_name            varchar,
+    submit_host             varchar,
+    start_time              timestamp,
+    end_time                timestamp,
+    submit_time             timestamp,
+    cpu_duration            bigint,
+    wall_duration           integer,
+    user_time               integer,
+    kernel_time             integer,
+    major_page_faults       integer,
+    runtime_environments    varchar[],
+    exit_code               integer,
+    downloads               varchar[],
+    uploads                 varchar[],
+    insert_hostname         varchar,
+    insert_identity         varchar,
+    insert_time             timestamp,
+    memory                  sgas_memory[],
+    row_id                  integer,
+    new_row                 boolean         NOT NULL DEFAULT false
+);
+
 
 -- storage schema
 
@@ -11,6 +11,27 @@ CREATE VIEW hostscalefactors AS
 ;
 
 
+-- per-day cache of the scale factors, for custom views and queries using
+-- scaled numbers: join on machine_name_id, scalefactor_type_id and day (e.g.,
+-- execution_time). The factor of a day is the one valid at its start, open
+-- ended validity periods are expanded from 2000-01-01 to a year after the
+-- refresh. It is refreshed when hostscalefactors_data changes (see
+-- sgas-postgres-functions.sql) and when SGAS starts.
+CREATE MATERIALIZED VIEW hostscalefactors_daily AS
+        SELECT hs.machine_name_id,
+               hs.scalefactor_type_id,
+               d.day::date AS day,
+               hs.scale_factor
+        FROM hostscalefactors_data hs
+        CROSS JOIN LATERAL generate_series(date_trunc('day', GREATEST(lower(hs.validity_period), TIMESTAMP '2000-01-01')),
+                                           LEAST(upper(hs.validity_period), current_date + 366),
+                                           interval '1 day') AS d(day)
+        WHERE hs.validity_period @> d.day
+;
+
+CREATE UNIQUE INDEX hostscalefactors_daily_idx ON hostscalefactors_daily (machine_name_id, day, scalefactor_type_id);
+
+
 -- create view of the usage records in the database
 -- the purpose of the view is to make data easily accessable so users do not
 -- have to do the joins between the tables them selves.
@@ -43,10 +64,8 @@ SELECT
     submit_time,
     cpu_duration,
     wall_duration,
-    cpu_duration  * (SELECT scale_factor FROM hostscalefactors WHERE machine_name = machinename.machine_name AND from_time < start_time ORDER BY from_time DESC LIMIT 1) AS cpu_duration_scaled,
-    wall_duration * (SELECT scale_factor FROM hostscalefactors WHERE machine_name = machinename.machine_name AND from_time < start_time ORDER BY from_time DESC LIMIT 1) AS wall_duration_scaled,
-    -- cpu_duration  * hs.scale_factor AS cpu_duration_scaled,
-    -- wall_duration * hs.scale_factor AS wall_duration_scaled,
+    cpu_duration  * hs.scale_factor AS cpu_duration_scaled,
+    wall_duration * hs.scale_factor AS wall_duration_scaled,
     user_time,
     kernel_time,
     major_page_faults,
@@ -61,7 +80,11 @@ SELECT
     insert_time
 FROM
     usagedata
--- LEFT OUTER JOIN hostscalefactors hs ON (usagedata.machine_name_id = hs.machine_name_id AND hs.scalefactor_type_id = 1 AND start_time <@ hs.validity_period)
+-- the scale factor (of the default type) valid when the job started, the
+-- validity periods of a machine do not overlap, so there is at most one
+LEFT OUTER JOIN hostscalefactors_data hs ON (usagedata.machine_name_id = hs.machine_name_id AND
+                                             hs.scalefactor_type_id = (SELECT id FROM hostscalefactor_type_default LIMIT 1) AND
+                                             hs.validity_period @> start_time)
 LEFT OUTER JOIN globalusername  ON (usagedata.global_user_name_id = globalusername.id)
 LEFT OUTER JOIN voinformation   ON (usagedata.vo_information_id   = voinformation.id)
 LEFT OUTER JOIN localuser       ON (usagedata.local_user_id       = localuser.id)
@@ -134,14 +157,15 @@ SELECT
     n_jobs                                                                          AS n_jobs,
     ROUND(cputime  / 3600.0, 2)                                                     AS cputime,
     ROUND(walltime / 3600.0, 2)                                                     AS walltime,
-    ROUND(cputime  / 3600.0, 2) * (SELECT scale_factor FROM hostscalefactors WHERE machine_name = machinename.machine_name)
-                                                                                    AS cputime_scaled,
-    ROUND(walltime / 3600.0, 2) * (SELECT scale_factor FROM hostscalefactors WHERE machine_name = machinename.machine_name)
-                                                                                    AS walltime_scaled,
+    ROUND(cputime  / 3600.0, 2) * hs.scale_factor                                   AS cputime_scaled,
+    ROUND(walltime / 3600.0, 2) * hs.scale_factor                                   AS walltime_scaled,
     generate_time                                                                   AS generate_time
 FROM
     uraggregated_data
--- LEFT OUTER JOIN hostscalefactors hs ON (uraggregated_data.machine_name_id = hs.machine_name_id AND hs.scalefactor_type_id = 1 AND execution_time::timestamp <@ hs.validity_period)
+-- the scale factor (of the default type) valid at the execution day
+LEFT OUTER JOIN hostscalefactors_data hs ON (uraggregated_data.machine_name_id = hs.machine_name_id AND
+                                             hs.scalefactor_type_id = (SELECT id FROM hostscalefactor_type_default LIMIT 1) AND
+                                             hs.validity_period @> execution_time::timestamp)
 LEFT OUTER JOIN machinename         ON (uraggregated_data.machine_name_id     = machinename.id)
 LEFT OUTER JOIN jobqueue            ON (uraggregated_data.queue_id            = jobqueue.id)
 LEFT OUTER JOIN globalusername      ON (uraggregated_data.global_user_name_id = globalusername.id)
@@ -153,6 +177,57 @@ LEFT OUTER JOIN inserthost          ON (uraggregated_data.insert_host_id      =
 ;
 
 
+-- the monthly rollup, with the same columns as uraggregated (execution_time
+-- is the first day of the month)
+CREATE VIEW uraggregated_monthly AS
+SELECT
+    execution_month                                                                 AS execution_time,
+    first_execution_time                                                            AS first_execution_time,
+    last_execution_time                                                             AS last_execution_time,
+    machinename.machine_name                                                        AS machine_name,
+    jobqueue.queue                                                                  AS queue,
+    CASE WHEN global_user_name_id IS NOT NULL THEN globalusername.global_user_name
+        ELSE machine_name || ':' || localuser.local_user
+    END                                                                             AS user_identity,
+    CASE WHEN vo_information_id IS NOT NULL THEN
+        CASE WHEN voinformation.vo_issuer LIKE 'file:///%' THEN NULL
+             WHEN voinformation.vo_issuer LIKE 'http://%'  THEN NULL
+             WHEN voinformation.vo_issuer LIKE 'https://%' THEN NULL
+             ELSE voinformation.vo_issuer
+        END
+        ELSE NULL
+    END                                                                             AS vo_issuer,
+    CASE WHEN vo_information_id IS NOT NULL THEN
+        CASE WHEN voinformation.vo_name LIKE '/%' THEN NULL
+             ELSE voinformation.vo_name
+        END
+        ELSE machine_name || ':' || projectname.project_name
+    END                                                                             AS vo_name,
+    voinformation.vo_attributes[1][1]                                               AS vo_group,
+    voinformation.vo_attributes[1][2]                                               AS vo_role,
+    CASE WHEN runtime_environments_id IS NOT NULL
+        THEN ARRAY(SELECT runtime_environment FROM runtimeenvironment WHERE id IN (SELECT unnest(runtime_environments_id)))
+        ELSE NULL
+    END                                                                             AS runtime_environments,
+    jobstatus.status                                                                AS status,
+    inserthost.insert_host                                                          AS insert_host,
+    n_jobs                                                                          AS n_jobs,
+    cputime                                                                         AS cputime,
+    walltime                                                                        AS walltime,
+    generate_time                                                                   AS generate_time
+FROM
+    uraggregated_monthly_data
+LEFT OUTER JOIN machinename         ON (uraggregated_monthly_data.machine_name_id     = machinename.id)
+LEFT OUTER JOIN jobqueue            ON (uraggregated_monthly_data.queue_id            = jobqueue.id)
+LEFT OUTER JOIN globalusername      ON (uraggregated_monthly_data.global_user_name_id = globalusername.id)
+LEFT OUTER JOIN localuser           ON (uraggregated_monthly_data.local_user_id       = localuser.id)
+LEFT OUTER JOIN voinformation       ON (uraggregated_monthly_data.vo_information_id   = voinformation.id)
+LEFT OUTER JOIN projectname         ON (uraggregated_monthly_data.project_name_id     = projectname.id)
+LEFT OUTER JOIN jobstatus           ON (uraggregated_monthly_data.status_id           = jobstatus.id)
+LEFT OUTER JOIN inserthost          ON (uraggregated_monthly_data.insert_host_id      = inserthost.id)
+;
+
+
 CREATE VIEW storagerecords AS
 SELECT
         record_id                       AS record_id,
@@ -83,13 +83,14 @@ setup(name='sgas-luts-service',
                                           'datafiles/share/postgresql/sgas-postgres-3.6.2-3.6.3-upgrade.sql',
                                           'datafiles/share/postgresql/sgas-postgres-3.6.3-3.7.0-upgrade.sql',
                                           'datafiles/share/postgresql/sgas-postgres-3.7.1-3.7.2-upgrade.sql',
+                                          'datafiles/share/postgresql/sgas-postgres-3.8.1-3.9.0-upgrade.sql',
                                           'datafiles/share/postgresql/sgas-postgres-aggregation-rebuild.sql',
                                           'datafiles/share/postgresql/sgas-postgres-cluster.sql']),
           ('/etc/',                      ['datafiles/etc/sgas.conf']),
           ('/etc/',                      ['datafiles/etc/sgas.authz']),
           ('/etc/init.d',                ['datafiles/etc/sgas']),
           ('/etc/nginx/sites-available', ['datafiles/etc/nginx/sites-available/sgas']),
-          ('bin',                        ['sgas-db-tool', 'sgas-hs-tool'])
+          ('bin',                        ['sgas-db-tool', 'sgas-hs-tool', 'sgas-aggregation-rebuild'])
       ]
 
 )
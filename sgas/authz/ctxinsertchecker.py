@@ -9,6 +9,7 @@ Copyright: Nordic Data Grid Facility (2009, 2010)
 """
 
 
+import functools
 
 from sgas.authz import rights
 from sgas.server.resourceutil import getCN
@@ -36,16 +37,15 @@ class InsertChecker:
         if action_context is None:
             return True # compat mode
 
-        subject_fqdn = extractFQDNfromX509Identity(subject_identity)
         insert_context = [ ctx_value for ctx_key, ctx_value in action_context if ctx_key == self.CONTEXT_KEY ]
 
         # insert context explicitely allowed
-        explicit_allowed_contexts = []
+        explicit_allowed_contexts = set()
         for sr in subject_rights:
-            explicit_allowed_contexts += sr.get(self.CONTEXT_KEY, [])
+            explicit_allowed_contexts.update(sr.get(self.CONTEXT_KEY, ()))
 
         # subject name parts for depth checking
-        id_parts = [ p for p in subject_fqdn.split('.') if p != '' ]
+        id_parts = _fqdnParts(subject_identity)
         cd = min(self.check_depth, len(id_parts))
 
         # go through all requested machine names and check if insert is allowed
@@ -72,6 +72,13 @@ class InsertChecker:
         return all(allowed)
 
 
+@functools.lru_cache(maxsize=4096)
+def _fqdnParts(identity):
+    # the name parts of the identity fqdn, which are the same for every check
+    fqdn = extractFQDNfromX509Identity(identity)
+    return tuple( [ p for p in fqdn.split('.') if p != '' ] )
+
+
 def extractFQDNfromX509Identity(identity):
     """
     Returns the FQDN of the identity.
@@ -18,21 +18,20 @@ class SetChecker:
 
     def contextCheck(self, subject_identity, subject_rights, action_context):
 
+        # group the action context values by key, so each right is checked
+        # with a lookup per key (the right values are frozensets)
+        action_values = {}
+        for cik, civ in action_context:
+            action_values.setdefault(cik, []).append(civ)
+
         for ctx in subject_rights:
             ctx_allow = []
             for cak, cav in ctx.items():
-                #print "CAK", cak, cav, action_context
-                found_match = False
-                for cik, civ in action_context:
-                    if cak == cik:
-                        found_match = True
-                        if civ in cav:
-                            ctx_allow.append(True)
-                        else:
-                            ctx_allow.append(False)
-
-                if not found_match:
+                values = action_values.get(cak)
+                if values is None:
                     ctx_allow.append(False)
+                else:
+                    ctx_allow += [ civ in cav for civ in values ]
 
             allowed = self.operator(ctx_allow or [False])
             if allowed:
@@ -3,15 +3,50 @@ SGAS authorization framework.
 """
 
 import re
+import collections
 
 from twisted.python import log
 
 from sgas.authz import rights, ctxinsertchecker, ctxsetchecker
+from sgas.server import stats
 
 
 # regular expression for matching authz lines
 AUTHZ_RX = re.compile("""\s*"(.*)"\s*(.*)""")
 
+# logging of authz checks
+LOG_ALL         = 'all'
+LOG_DENIED      = 'denied'
+LOG_SAMPLED     = 'sampled'     # all denied checks, and every LOG_SAMPLE_RATE allowed
+LOG_NONE        = 'none'
+LOG_MODES       = (LOG_ALL, LOG_DENIED, LOG_SAMPLED, LOG_NONE)
+LOG_SAMPLE_RATE = 100
+
+# max number of cached authz decisions
+DECISION_CACHE_SIZE = 10000
+
+
+def _contextValue(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _flattenContext(context):
+    """
+    Flatten a context into (key, value) pairs with a single value each, e.g.,
+    query arguments, where each key has a list of (bytes) values.
+    """
+    if context is None:
+        return None
+    flat_context = []
+    for key, value in context:
+        key = _contextValue(key)
+        if isinstance(value, (list, tuple)):
+            flat_context += [ (key, _contextValue(v)) for v in value ]
+        else:
+            flat_context.append( (key, _contextValue(value)) )
+    return flat_context
+
+
 
 class AuthzRights:
 
@@ -31,25 +66,94 @@ class AuthzRights:
 
 
 
+class CompiledRights:
+    """
+    Rights of a subject for an action, in the form used for checking: the all
+    option as a flag, and the contexts with the values as frozensets.
+    """
+    __slots__ = ('all', 'contexts')
+
+    def __init__(self, authz_rights):
+        self.all = rights.OPTION_ALL in authz_rights.options
+        self.contexts = tuple( [ dict( [ (key, frozenset(values)) for key, values in ctx.items() ] )
+                                 for ctx in authz_rights.contexts ] )
+
+
+
 class AuthorizationEngine:
 
-    def __init__(self, insert_check_depth, authz_file=None):
+    def __init__(self, insert_check_depth, authz_file=None, log_mode=LOG_ALL):
         self.authz_rights = {}  # subject -> [action : AuthzRights ]
+        self.policy = {}        # (subject, action) -> CompiledRights
         self.context_checkers = {}
         self.authz_file = authz_file
         self.insert_check_depth = insert_check_depth
         self.rights = rights.Rights()
+        if log_mode not in LOG_MODES:
+            raise ValueError('Invalid authz log mode: %s' % log_mode)
+        self.log_mode = log_mode
+        self.n_allowed = 0
+        self.decisions = collections.OrderedDict()
+        self.decision_hits = 0
+        self.decision_misses = 0
+        stats.registerProvider('authz', self.getStatistics)
 
     def initAuthzFile(self):
         if self.authz_file is not None:
             authz_data = open(self.authz_file).read()
             self.parseAuthzData(authz_data)        
 
+    def reloadAuthzFile(self):
+        # replace the current rights with the ones in the authz file
+        if self.authz_file is None:
+            return
+        try:
+            authz_data = open(self.authz_file).read()
+        except IOError as e:
+            log.msg('Error reading authz file %s, keeping current rights: %s' % (self.authz_file, str(e)), system='sgas.Authorizer')
+            return
+        # parse into new rights, so a failed parse leaves the current ones intact
+        authz_rights = {}
+        try:
+            self._parseAuthzRights(authz_data, authz_rights)
+        except Exception as e:
+            log.msg('Error parsing authz file %s, keeping current rights: %s' % (self.authz_file, str(e)), system='sgas.Authorizer')
+            return
+        self.authz_rights = authz_rights
+        self.compile()
+        log.msg('Reloaded authz file %s (%i subjects)' % (self.authz_file, len(self.authz_rights)), system='sgas.Authorizer')
+
     def addChecker(self, action, checker):
         self.context_checkers[action] = checker;
+        self.decisions.clear()
+
+    def compile(self):
+        # build the per (subject, action) rights used for checking, and
+        # invalidate cached decisions made with the old rights
+        policy = {}
+        for subject, user_authz_rights in self.authz_rights.items():
+            for action, authz_rights in user_authz_rights.items():
+                policy[(subject, action)] = CompiledRights(authz_rights)
+        self.policy = policy
+        self.decisions.clear()
+
+    def getStatistics(self):
+        lookups = self.decision_hits + self.decision_misses
+        return {
+            'subjects'          : len(self.authz_rights),
+            'cached_decisions'  : len(self.decisions),
+            'hits'              : self.decision_hits,
+            'misses'            : self.decision_misses,
+            'hit_ratio'         : round(float(self.decision_hits) / lookups, 3) if lookups else None
+        }
 
     def parseAuthzData(self, authz_data):
         # parse authorization data given as input string
+        self._parseAuthzRights(authz_data, self.authz_rights)
+        self.compile()
+
+
+    def _parseAuthzRights(self, authz_data, authz_rights):
 
         authz_lines = authz_data.split('\n')
 
@@ -62,7 +166,7 @@ class AuthorizationEngine:
                 continue
             subject, action_segment = m.groups()
 
-            user_authz_rights = self.authz_rights.setdefault(subject, {})
+            user_authz_rights = authz_rights.setdefault(subject, {})
             for action_desc in action_segment.split(','):
                 self._parseActions(action_desc.strip(), user_authz_rights)
 
@@ -128,10 +232,25 @@ class AuthorizationEngine:
 
         Returns True if the subject has a relevant right, otherwise False.
         """
-        if subject in self.authz_rights and action in self.authz_rights[subject]:
+        return (subject, action) in self.policy
+
+
+    def _checkAllowed(self, subject, action, context):
+
+        action_rights = self.policy.get( (subject, action) )
+        if action_rights is None:
+            # subject or action not found -> denied
+            return False
+
+        if action_rights.all:
+            # special all option is set for the subject -> granted
             return True
-        else:
+
+        # perform context check
+        ctx_checker = self.context_checkers.get(action)
+        if ctx_checker is None:
             return False
+        return ctx_checker.contextCheck(subject, action_rights.contexts, context)
 
 
     def isAllowed(self, subject, action, context):
@@ -141,30 +260,32 @@ class AuthorizationEngine:
 
         Returns True if the subject is allowed, otherwise False.
         """
-
-        allowed = False
-
+        context = _flattenContext(context)
         try:
-            user_authz_rights = self.authz_rights[subject]
-            # subject is not found -> keyerror -> denied
-
-            user_action_rights = user_authz_rights[action]
-            # action is not found -> keyerror -> denied
-
-            if rights.OPTION_ALL in user_action_rights.options:
-            # special all option is set for the subject -> granted
-                allowed = True
-
-            # perform context check
-            ctx_checker = self.context_checkers[action]
-            if ctx_checker.contextCheck(subject, user_action_rights.contexts, context):
-                allowed = True
-
-        except KeyError:
-            pass
-
-        log.msg("Authz check: Subject %s, Action %s, Context: %s. Access allowed: %s" % \
-                 (subject, action, context, allowed), system='sgas.Authorizer')
+            key = (subject, action, frozenset(context) if context is not None else None)
+        except TypeError:
+            key = None # unhashable context, not cached
+
+        allowed = self.decisions.get(key) if key is not None else None
+        if allowed is None:
+            self.decision_misses += 1
+            allowed = self._checkAllowed(subject, action, context)
+            if key is not None:
+                self.decisions[key] = allowed
+                if len(self.decisions) > DECISION_CACHE_SIZE:
+                    self.decisions.popitem(last=False)
+        else:
+            self.decision_hits += 1
+            self.decisions.move_to_end(key)
+
+        if self.log_mode != LOG_NONE:
+            log_check = True
+            if allowed and self.log_mode != LOG_ALL:
+                self.n_allowed += 1
+                log_check = self.log_mode == LOG_SAMPLED and self.n_allowed % LOG_SAMPLE_RATE == 0
+            if log_check:
+                log.msg("Authz check: Subject %s, Action %s, Context: %s. Access allowed: %s" % \
+                         (subject, action, context, allowed), system='sgas.Authorizer')
 
         return allowed
 
@@ -8,12 +8,15 @@ Copyright: Nordic Data Grid Facility (2010)
 """
 
 from twisted.python import log
+from twisted.internet import defer
 from twisted.web import resource, server
 
 from sgas.ext.python import json
 from sgas.authz import rights as authrights, ctxsetchecker
 from sgas.customqueryengine import rights
-from sgas.server import resourceutil
+from sgas.server import resourceutil, jsonstream
+from sgas.database import error as dberror
+from sgas.database.postgresql import database
 from sgas.customqueryengine import querydefinition
 
 
@@ -22,6 +25,13 @@ HTTP_HEADER_CONTENT_TYPE   = 'content-type'
 
 ACTION_CUSTOMQUERY  = 'customquery'
 
+# streaming options
+PLUGIN_CFG_BLOCK    = 'plugin:customquery'
+STREAMING           = 'streaming'
+STREAMING_BATCH_SIZE = 'streaming_batch_size'
+STATEMENT_TIMEOUT   = 'statement_timeout'
+
+
 class QueryResource(resource.Resource):
     
     PLUGIN_ID   = 'customquery'
@@ -40,9 +50,27 @@ class QueryResource(resource.Resource):
         self.authorizer.rights.addOptions(ACTION_CUSTOMQUERY,[authrights.OPTION_ALL])
         self.authorizer.rights.addContexts(ACTION_CUSTOMQUERY,[rights.CTX_QUERYGROUP])
 
+        # stream results from a server-side cursor, instead of building them in memory
+        self.streaming = False
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STREAMING):
+            self.streaming = cfg.getboolean(PLUGIN_CFG_BLOCK, STREAMING)
+        self.streaming_batch_size = database.DEFAULT_STREAM_BATCH_SIZE
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STREAMING_BATCH_SIZE):
+            self.streaming_batch_size = cfg.getint(PLUGIN_CFG_BLOCK, STREAMING_BATCH_SIZE)
+
+        # queries running for longer are cancelled by the database, e.g., '30s'
+        self.statement_timeout = None
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STATEMENT_TIMEOUT):
+            self.statement_timeout = cfg.get(PLUGIN_CFG_BLOCK, STATEMENT_TIMEOUT)
+
 
     def queryDatabase(self, query, query_args):
-        return self.db.dictquery(query, query_args)
+        return self.db.dictquery(query, query_args, statement_timeout=self.statement_timeout)
+
+
+    def streamDatabase(self, query, query_args, rowsReceived):
+        return self.db.streamquery(query, query_args, rowsReceived, dict_rows=True, batch_size=self.streaming_batch_size,
+                                   statement_timeout=self.statement_timeout)
 
 
     def render_GET(self, request):
@@ -90,8 +118,11 @@ class QueryResource(resource.Resource):
             return ("CustomQuery not allowed for given context for identity %s" % subject).encode('utf-8')
         # request allowed, continue
 
-        hostname = resourceutil.getHostname(request)
-        log.msg('Accepted query request from %s' % hostname, system='sgas.QueryResource')
+        d = resourceutil.getHostname(request)
+        d.addCallback(lambda hostname : log.msg('Accepted query request from %s' % hostname, system='sgas.QueryResource'))
+
+        if self.streaming:
+            return self.renderStream(request, query, query_args)
 
         def gotDatabaseResult(rows):
             payload = json.dumps(rows).encode('utf-8')
@@ -100,21 +131,46 @@ class QueryResource(resource.Resource):
             request.finish()
 
         def queryError(error):
-            log.msg('Queryengine error: %s' % str(error), system='sgas.QueryResource')
-            log.msg('Queryengine error args' % str(query_args), system='sgas.QueryResource')
-            request.setResponseCode(500)
-            request.write('Queryengine error (%s)' % str(error), system='sgas.QueryResource')
+            if error.check(defer.CancelledError):
+                log.msg('Client disconnected, query cancelled', system='sgas.QueryResource')
+                return
+            log.msg('Queryengine error: %s' % str(error.value), system='sgas.QueryResource')
+            log.msg('Queryengine error args: %s' % str(query_args), system='sgas.QueryResource')
+            if error.check(dberror.QueryTimeoutError):
+                request.setResponseCode(504)
+            else:
+                request.setResponseCode(500)
+            request.write(('Queryengine error (%s)' % str(error.value)).encode('utf-8'))
             request.finish()
 
         def resultHandlingError(error):
-            log.msg('Query result error: %s' % str(error), system='sgas.QueryResource')
-            log.msg('Query result error args' % str(query_args), system='sgas.QueryResource')
+            log.msg('Query result error: %s' % str(error.value), system='sgas.QueryResource')
+            log.msg('Query result error args: %s' % str(query_args), system='sgas.QueryResource')
             request.setResponseCode(500)
-            request.write('Query result error (%s)' % str(error), system='sgas.QueryResource')
+            request.write(('Query result error (%s)' % str(error.value)).encode('utf-8'))
             request.finish()
 
         d = self.queryDatabase(query.query,query_args)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallbacks(gotDatabaseResult, queryError)
         d.addErrback(resultHandlingError)
         return server.NOT_DONE_YET
 
+
+    def renderStream(self, request, query, query_args):
+
+        stream = jsonstream.JSONStream(request)
+
+        def streamError(error):
+            if error.check(jsonstream.StreamStopped, defer.CancelledError):
+                log.msg('Client disconnected during custom query %s' % query.query_name, system='sgas.QueryResource')
+            else:
+                log.msg('Queryengine error: %s' % str(error.value), system='sgas.QueryResource')
+                log.msg('Queryengine error args: %s' % str(query_args), system='sgas.QueryResource')
+            stream.fail('Queryengine error (%s)' % str(error.value))
+
+        d = self.streamDatabase(query.query, query_args, stream.writeRows)
+        resourceutil.cancelOnDisconnect(request, d)
+        d.addCallbacks(lambda _ : stream.finish(), streamError)
+        d.addErrback(lambda error : log.msg('Query result error: %s' % str(error.value), system='sgas.QueryResource'))
+        return server.NOT_DONE_YET
@@ -42,3 +42,10 @@ class SecurityError(SGASDatabaseError):
     of the inserter, or for another reason not allowed to insert data.
     """
 
+
+class QueryTimeoutError(SGASDatabaseError):
+    """
+    Error raised when a query was cancelled by the database, as it ran for
+    longer than the statement timeout.
+    """
+
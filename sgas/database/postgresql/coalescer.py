@@ -0,0 +1,96 @@
+"""
+Coalescing of identical concurrent queries.
+
+Some pages are loaded by many people at the same time (e.g., the WLCG views
+at the start of the month), each triggering the same, possibly slow, query.
+With coalescing, a query which is identical (same SQL, arguments and statement
+timeout) to one already running is not sent to the database, instead the
+caller waits for the running query, and gets its result.
+
+Every caller gets its own copy of the result, as the callers tend to modify
+the rows when rendering them. A caller can cancel its wait (see
+resourceutil.cancelOnDisconnect), the query itself is only cancelled when all
+callers waiting for it have cancelled.
+
+Coalescing is opt-in for each call (coalesce=True for query), as it only makes
+sense for read-only queries, which do not depend on having been started after
+the call.
+"""
+
+import copy
+
+from twisted.python import failure
+from twisted.internet import defer
+
+
+
+def queryKey(query, query_args, statement_timeout):
+    # query arguments can be lists or dicts (not hashable), but are always
+    # built from simple values, so the representation identifies them
+    return (query, repr(query_args), statement_timeout)
+
+
+
+class QueryCoalescer:
+
+    def __init__(self):
+        self.inflight = {} # key -> [ query deferred, waiting deferreds ]
+
+        self.queries = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+
+    def run(self, key, runQuery):
+        """
+        Return a deferred firing with (a copy of) the result of the query
+        identified by key. If the query is not already running, it is started
+        by calling runQuery, which returns a deferred.
+        """
+        entry = self.inflight.get(key)
+        if entry is None:
+            self.queries += 1
+            entry = [ None, [] ] # query deferred, waiting deferreds
+            self.inflight[key] = entry
+        else:
+            self.coalesced += 1
+
+        d = defer.Deferred(lambda d : self._cancelWait(key, entry, d))
+        entry[1].append(d)
+
+        if entry[0] is None:
+            entry[0] = runQuery()
+            entry[0].addBoth(self._queryDone, key, entry)
+        return d
+
+
+    def _queryDone(self, result, key, entry):
+
+        if self.inflight.get(key) is entry:
+            del self.inflight[key]
+        for d in entry[1]:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(copy.deepcopy(result))
+
+
+    def _cancelWait(self, key, entry, d):
+
+        self.cancelled += 1
+        entry[1].remove(d)
+        if not entry[1]:
+            # no one is waiting for the result anymore
+            if self.inflight.get(key) is entry:
+                del self.inflight[key]
+            entry[0].cancel()
+
+
+    def getStatistics(self):
+        return {
+            'queries'   : self.queries,
+            'coalesced' : self.coalesced,
+            'cancelled' : self.cancelled,
+            'inflight'  : len(self.inflight)
+        }
+
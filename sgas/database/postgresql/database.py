@@ -5,35 +5,216 @@ Author: Henrik Thostrup Jensen <htj@ndgf.org>
 Copyright: Nordic Data Grid Facility (2010)
 """
 
+import time
 import types
+import random
 import decimal
-import time
+import threading
 
 import psycopg2
 import psycopg2.extensions # not used, but enables tuple adaption
 import psycopg2.extras
 
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import defer, reactor, task, threads
 from twisted.enterprise import adbapi
 from twisted.application import service
 
 from sgas.database import error
+from sgas.server import stats, config
+from sgas.database.postgresql import pgcopy, dimcache, coalescer
 #from sgas.database.postgresql import updater
 
 
 DEFAULT_POSTGRESQL_PORT = 5432
 
+# connection pools, each sized independently, so slow reports (views, queries)
+# cannot take the connections needed for registrations and aggregation
+INGEST_POOL         = 'ingest'
+AGGREGATION_POOL    = 'aggregation'
+READ_POOL           = 'read'
+
+DEFAULT_POOL_SIZE   = 5 # connections
+MIN_POOL_THREADS    = 3
+
+# server options
+DB_READ                 = 'db_read'
+DB_READ_SESSION_ATTRS   = 'db_read_session_attrs'
+DB_POOL_SIZE            = 'db_%s_pool_size'
+
+PRIMARY_SESSION_ATTRS   = 'read-write'
+SESSION_ATTRS           = ('any', 'read-write', 'read-only', 'primary', 'standby', 'prefer-standby')
+
+RECONNECT_DELAY = 3 # seconds
+
+# retries of an aggregation slice after a serialization failure, with a
+# randomized backoff, so contending workers do not retry in lockstep
+SERIALIZATION_RETRIES = 10
+SERIALIZATION_BACKOFF = 0.05 # seconds, doubled for every retry
+
+STREAM_CURSOR_NAME = 'sgas_stream'
+DEFAULT_STREAM_BATCH_SIZE = 1000 # rows
+
 SQL_SERIALIZABLE_TRANSACTION = '''SET TRANSACTION ISOLATION LEVEL SERIALIZABLE'''
+SQL_SET_WORK_MEM             = '''SET LOCAL work_mem = %s'''
+SQL_SET_STATEMENT_TIMEOUT    = '''SET LOCAL statement_timeout = %s'''
+
+SQL_CREATE_STAGING_TABLE = '''CREATE TEMPORARY TABLE %s (LIKE %s INCLUDING DEFAULTS) ON COMMIT DROP'''
+SQL_COPY_STAGING_TABLE   = '''COPY %s (%s) FROM STDIN'''
+
+SQL_SAVEPOINT            = '''SAVEPOINT sgas_record'''
+SQL_ROLLBACK_SAVEPOINT   = '''ROLLBACK TO SAVEPOINT sgas_record'''
+SQL_RELEASE_SAVEPOINT    = '''RELEASE SAVEPOINT sgas_record'''
+
+PG_FOREIGN_KEY_VIOLATION = '23503'
+
+# errors caused by the content of a single record (bad values, raised exceptions
+# in the procedure), as opposed to connection or server problems
+RECORD_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, psycopg2.InternalError)
+
+
+
+def _buildValue(value):
+    if type(value) in (str, int, float, bool, type(None)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        sv = str(value)
+        return int(sv) if sv.isalnum() else float(sv)
+    # bad catch-all
+    return str(value)
+
+
+
+class _QueryCancel:
+    # cancellation of a query running in a pool thread. The connection is only
+    # attached while the query runs, so a cancel cannot hit a later query on
+    # the same (pooled) connection.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.cancelled = False
+
+
+    def run(self, conn, f, *args):
+        # executed in the pool thread
+        with self.lock:
+            if self.cancelled:
+                raise defer.CancelledError()
+            self.conn = conn
+        try:
+            return f(conn, *args)
+        finally:
+            with self.lock:
+                self.conn = None
+
+
+    def cancel(self):
+        # sending the cancel request blocks, so it is done in a thread
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                log.msg('Cancelling running query', system='sgas.PostgreSQLDatabase')
+                self.conn.cancel()
+
+
+
+def _setStatementTimeout(conn, statement_timeout):
+    if statement_timeout is not None:
+        cur = conn.cursor()
+        cur.execute(SQL_SET_STATEMENT_TIMEOUT, (statement_timeout,))
+        cur.close()
+
+
+
+class InsertResult(dict):
+    """
+    Result of a chunked insert: maps the record ids of inserted records to
+    their row ids. The records which could not be inserted are in rejected,
+    mapping record ids to the reason.
+    """
+    def __init__(self, inserted=None, rejected=None):
+        dict.__init__(self, inserted or {})
+        self.rejected = rejected or {}
+
+
+
+class _PoolMetrics:
+    # occupancy and wait times of a connection pool. Updated from the pool
+    # threads, and kept when the pool is replaced after a reconnect
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.size = size
+        self.busy = 0
+        self.max_busy = 0
+        self.waiting = 0
+        self.runs = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+    def wrap(self, f):
+        # wrap a function submitted to the pool, so it is measured when run
+        submitted = time.time()
+        with self.lock:
+            self.waiting += 1
+
+        def run(*args, **kw):
+            wait = time.time() - submitted
+            with self.lock:
+                self.waiting -= 1
+                self.busy += 1
+                self.max_busy = max(self.busy, self.max_busy)
+                self.runs += 1
+                self.wait_total += wait
+                self.wait_max = max(wait, self.wait_max)
+            try:
+                return f(*args, **kw)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+        return run
+
+
+    def getStatistics(self):
+        with self.lock:
+            return {
+                'size'      : self.size,
+                'busy'      : self.busy,
+                'max_busy'  : self.max_busy,
+                'waiting'   : self.waiting,
+                'runs'      : self.runs,
+                'wait_avg'  : round(self.wait_total / self.runs, 3) if self.runs else 0.0,
+                'wait_max'  : round(self.wait_max, 3)
+            }
+
+
+
+class _MeteredConnectionPool(adbapi.ConnectionPool):
+    # runQuery and runOperation go through runInteraction
+
+    metrics = None
+
+    def runInteraction(self, interaction, *args, **kw):
+        return adbapi.ConnectionPool.runInteraction(self, self.metrics.wrap(interaction), *args, **kw)
+
+
+    def runWithConnection(self, func, *args, **kw):
+        return adbapi.ConnectionPool.runWithConnection(self, self.metrics.wrap(func), *args, **kw)
+
 
 
 class _DatabasePoolProxy:
     # abstraction over a database pool object, so we can provide a sensible way
     # to replace the pool if something goes wrong.
 
-    def __init__(self, connect_info):
+    def __init__(self, connect_info, size=DEFAULT_POOL_SIZE, session_attrs=PRIMARY_SESSION_ATTRS):
 
         self.connect_info = connect_info
+        self.size = size
+        self.session_attrs = session_attrs
+        self.metrics = _PoolMetrics(size)
         self.dbpool = None
         self.reconnect()
 
@@ -43,7 +224,11 @@ class _DatabasePoolProxy:
         host, port, database, user, password = args[:5]
         if port is None:
             port = DEFAULT_POSTGRESQL_PORT
-        return adbapi.ConnectionPool('psycopg2', host=host, port=port, database=database, user=user, password=password, target_session_attrs="read-write")
+        pool = _MeteredConnectionPool('psycopg2', host=host, port=port, database=database, user=user, password=password,
+                                      target_session_attrs=self.session_attrs,
+                                      cp_min=min(MIN_POOL_THREADS, self.size), cp_max=self.size)
+        pool.metrics = self.metrics
+        return pool
 
 
     def reconnect(self):
@@ -58,13 +243,64 @@ class _DatabasePoolProxy:
 
 
 
+def createDatabase(cfg):
+    """
+    Create the database from the server block options.
+    """
+    connect_info = cfg.get(config.SERVER_BLOCK, config.DB)
+    read_connect_info = None
+    if cfg.has_option(config.SERVER_BLOCK, DB_READ):
+        read_connect_info = cfg.get(config.SERVER_BLOCK, DB_READ)
+    read_session_attrs = None
+    if cfg.has_option(config.SERVER_BLOCK, DB_READ_SESSION_ATTRS):
+        read_session_attrs = cfg.get(config.SERVER_BLOCK, DB_READ_SESSION_ATTRS).strip().lower()
+        if read_session_attrs not in SESSION_ATTRS:
+            raise config.ConfigurationError('Invalid %s: %s (must be one of %s)' % (DB_READ_SESSION_ATTRS, read_session_attrs, ', '.join(SESSION_ATTRS)))
+
+    pool_sizes = {}
+    for pool in (INGEST_POOL, AGGREGATION_POOL, READ_POOL):
+        option = DB_POOL_SIZE % pool
+        if cfg.has_option(config.SERVER_BLOCK, option):
+            pool_sizes[pool] = cfg.getint(config.SERVER_BLOCK, option)
+            if pool_sizes[pool] < 1:
+                raise config.ConfigurationError('Invalid %s: %i (must be at least 1)' % (option, pool_sizes[pool]))
+
+    return PostgreSQLDatabase(connect_info, read_connect_info, read_session_attrs, pool_sizes)
+
+
+
 class PostgreSQLDatabase(service.MultiService):
 
     service = []
     
-    def __init__(self, connect_info):
+    def __init__(self, connect_info, read_connect_info=None, read_session_attrs=None, pool_sizes=None):
+        """
+        The read pool (queries, views) connects to read_connect_info if given,
+        e.g., a streaming replica, with the given target_session_attrs
+        (default any). The other pools always connect to the primary.
+        pool_sizes maps pool names to their number of connections.
+        """
         service.MultiService.__init__(self)
-        self.pool_proxy = _DatabasePoolProxy(connect_info)
+        pool_sizes = pool_sizes or {}
+        self.pools = {}
+        for pool in (INGEST_POOL, AGGREGATION_POOL):
+            self.pools[pool] = _DatabasePoolProxy(connect_info, pool_sizes.get(pool, DEFAULT_POOL_SIZE))
+        # results read from a replica can lag behind the aggregation generation
+        self.read_replica = read_connect_info is not None
+        if read_connect_info is None:
+            self.pools[READ_POOL] = _DatabasePoolProxy(connect_info, pool_sizes.get(READ_POOL, DEFAULT_POOL_SIZE))
+        else:
+            self.pools[READ_POOL] = _DatabasePoolProxy(read_connect_info, pool_sizes.get(READ_POOL, DEFAULT_POOL_SIZE),
+                                                       read_session_attrs or 'any')
+        for pool, pool_proxy in self.pools.items():
+            stats.registerProvider('dbpool:' + pool, pool_proxy.metrics.getStatistics)
+        # inserts, and other writes (dimension cache, host scale factors)
+        self.pool_proxy = self.pools[INGEST_POOL]
+        self.dimension_cache = None
+        # increased whenever the aggregated data has changed
+        self.aggregation_generation = 0
+        self.coalescer = coalescer.QueryCoalescer()
+        stats.registerProvider('querycoalescing', self.coalescer.getStatistics)
 
 
     def startService(self):
@@ -81,23 +317,73 @@ class PostgreSQLDatabase(service.MultiService):
         self.service += [service]
 
 
+    def enableDimensionCache(self):
+        # the cache is shared between all users of the database
+        if self.dimension_cache is None:
+            self.dimension_cache = dimcache.DimensionCache(self.pool_proxy)
+            self.attachService(self.dimension_cache)
+        return self.dimension_cache
+
+
+    def aggregationUpdated(self):
+        """
+        Called when the aggregated data has changed. Results computed from the
+        aggregated data under an earlier generation are stale.
+        """
+        self.aggregation_generation += 1
+
+
+    def _runCancellable(self, pool, f, *args):
+        """
+        Run f with a connection from pool (like runWithConnection). The
+        returned deferred can be cancelled, which cancels the query running on
+        the connection (the connection itself is kept).
+        """
+        def queryDone(result):
+            # after a cancel, the (failed) result of the query is discarded
+            if not d.called:
+                d.callback(result)
+
+        qc = _QueryCancel()
+        d = defer.Deferred(lambda _ : reactor.callInThread(qc.cancel))
+        self.pools[pool].dbpool.runWithConnection(qc.run, f, *args).addBoth(queryDone)
+        return d
+
+
+    def query(self, query, query_args=None, statement_timeout=None, coalesce=False, pool=READ_POOL):
+        """
+        Execute query and return the rows. If statement_timeout is given (a
+        PostgreSQL interval, e.g., '30s') the query is cancelled by the server
+        if it runs for longer, and QueryTimeoutError is raised. The returned
+        deferred can be cancelled, e.g., when the client has disconnected.
+        With coalesce, the result of an identical query which is already
+        running is used, instead of running the query again (see coalescer.py).
+        The query is run in the read pool, unless another pool is given (the
+        read pool may be connected to a replica).
+        """
+        if coalesce:
+            key = coalescer.queryKey(query, query_args, statement_timeout) + (pool,)
+            return self.coalescer.run(key, lambda : self._query(query, query_args, statement_timeout, pool))
+        return self._query(query, query_args, statement_timeout, pool)
+
+
     @defer.inlineCallbacks
-    def query(self, query, query_args=None, retry=False):
-        def buildValue(value):
-            if type(value) in (str, int, float, bool, type(None)):
-                return value
-            if isinstance(value, decimal.Decimal):
-                sv = str(value)
-                return int(sv) if sv.isalnum() else float(sv)
-            # bad catch-all
-            return str(value)
+    def _query(self, query, query_args, statement_timeout, pool, retry=False):
+        def conn(conn):
+            _setStatementTimeout(conn, statement_timeout)
+            cur = conn.cursor()
+            cur.execute(query, query_args)
+            return cur.fetchall()
 
         try:
-            query_result = yield self.pool_proxy.dbpool.runQuery(query, query_args)
+            query_result = yield self._runCancellable(pool, conn)
             results = []
             for row in query_result:
-                results.append( [ buildValue(e) for e in row ] )
+                results.append( [ _buildValue(e) for e in row ] )
             defer.returnValue(results)
+        except psycopg2.extensions.QueryCanceledError as e:
+            # subclass of OperationalError, but the connection is fine
+            raise error.QueryTimeoutError(str(e))
         except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
             # this usually happens if the database was restarted,
             # and the existing connection to the database was closed
@@ -106,8 +392,9 @@ class PostgreSQLDatabase(service.MultiService):
                 raise error.DatabaseUnavailableError(str(e))
             else:
                 log.msg('Got interface error while querying database(%s), attempting to reconnect' % str(e), system='sgas.PostgreSQLDatabase')
-                self.pool_proxy.reconnect()
-                yield self.query(query, query_args, retry=True)
+                self.pools[pool].reconnect()
+                results = yield self._query(query, query_args, statement_timeout, pool, retry=True)
+                defer.returnValue(results)
 
 
     @defer.inlineCallbacks
@@ -145,9 +432,11 @@ class PostgreSQLDatabase(service.MultiService):
             if not retry:
                 log.msg('Got interface error while attempting insert: %s.' % str(e), system='sgas.PostgreSQLDatabase')
                 log.msg('Attempting to reconnect.', system='sgas.PostgreSQLDatabase')
-                time.sleep(3)
+                # give the database a moment, without blocking the reactor
+                yield task.deferLater(reactor, RECONNECT_DELAY, lambda : None)
                 self.pool_proxy.reconnect()
-                yield self.recordInserter(type, proc, arg_list, retry=True)
+                id_dict = yield self.recordInserter(type, proc, arg_list, retry=True)
+                defer.returnValue(id_dict)
             if retry:
                 log.msg('Got interface error after retrying to connect, bailing out.', system='sgas.PostgreSQLDatabase')
                 raise error.DatabaseUnavailableError(str(e))
@@ -163,86 +452,316 @@ class PostgreSQLDatabase(service.MultiService):
                     log.msg('Database: error: proc: %s, Args: "None"' % (proc), system='sgas.PostgreSQLDatabase')
             raise
 
+
+    @defer.inlineCallbacks
+    def recordChunkInserter(self, type, proc, arg_list, chunk_size, retry=False):
+        # variant of recordInserter, which commits the records in chunks of
+        # chunk_size, and rejects records which cannot be inserted, instead of
+        # failing the entire batch
+        def insertChunk(txn, chunk, isolate):
+            # executed in seperate thread, so it is safe to block
+            id_dict = {}
+            rejected = {}
+            for args in chunk:
+                if isolate:
+                    txn.execute(SQL_SAVEPOINT)
+                try:
+                    txn.callproc(proc, args)
+                    record_id, row_id = txn.fetchall()[0][0]
+                    id_dict[record_id] = str(row_id)
+                except RECORD_ERRORS as e:
+                    if not isolate:
+                        raise
+                    txn.execute(SQL_ROLLBACK_SAVEPOINT)
+                    rejected[args[0]] = e.diag.message_primary or str(e).strip()
+                    continue
+                if isolate:
+                    txn.execute(SQL_RELEASE_SAVEPOINT)
+            return id_dict, rejected
+
+        result = InsertResult()
+        offset = 0
+        try:
+            while offset < len(arg_list):
+                chunk = arg_list[offset:offset+chunk_size]
+                try:
+                    # savepoints are only used, if the chunk fails without them
+                    id_dict, rejected = yield self.pool_proxy.dbpool.runInteraction(insertChunk, chunk, False)
+                except RECORD_ERRORS:
+                    id_dict, rejected = yield self.pool_proxy.dbpool.runInteraction(insertChunk, chunk, True)
+                    for record_id, reason in rejected.items():
+                        log.msg('Rejected %s record %s: %s' % (type, record_id, reason), system='sgas.PostgreSQLDatabase')
+                result.update(id_dict)
+                result.rejected.update(rejected)
+                offset += len(chunk)
+
+            log.msg('Database: %i %s records inserted, %i rejected (%i chunks)' % \
+                    (len(result), type, len(result.rejected), (len(arg_list) + chunk_size - 1) // chunk_size), system='sgas.PostgreSQLDatabase')
+            defer.returnValue(result)
+
+        except psycopg2.OperationalError as e:
+            if 'Connection refused' in str(e):
+                raise error.DatabaseUnavailableError(str(e))
+            raise # re-raise current exception
+        except psycopg2.InterfaceError as e:
+            # this usually happens if the database was restarted,
+            # and the existing connection to the database was closed
+            if retry:
+                log.msg('Got interface error after retrying to connect, bailing out.', system='sgas.PostgreSQLDatabase')
+                raise error.DatabaseUnavailableError(str(e))
+            log.msg('Got interface error while attempting insert: %s.' % str(e), system='sgas.PostgreSQLDatabase')
+            log.msg('Attempting to reconnect.', system='sgas.PostgreSQLDatabase')
+            self.pool_proxy.reconnect()
+            # committed chunks are kept, continue from the failed chunk
+            remaining = yield self.recordChunkInserter(type, proc, arg_list[offset:], chunk_size, retry=True)
+            result.update(remaining)
+            result.rejected.update(remaining.rejected)
+            defer.returnValue(result)
+
+
+    @defer.inlineCallbacks
+    def recordBulkInserter(self, type, proc, staging_table, template, columns, arg_list, proc_args=(), retry=False):
+        # set-based variant of recordInserter: the arguments are copied into a
+        # temporary staging table, after which a single procedure call inserts them
+        def bulkInsert(txn):
+            # executed in seperate thread, so it is safe to block
+            txn.execute(SQL_CREATE_STAGING_TABLE % (staging_table, template))
+            txn.copy_expert(SQL_COPY_STAGING_TABLE % (staging_table, ','.join(columns)), pgcopy.CopyReader(arg_list))
+            txn.callproc(proc, proc_args)
+            id_dict = {}
+            for r in txn.fetchall():
+                record_id, row_id = r[0]
+                id_dict[record_id] = str(row_id)
+            return id_dict
+
+        try:
+            id_dict = yield self.pool_proxy.dbpool.runInteraction(bulkInsert)
+            log.msg('Database: %i %s records inserted (bulk)' % (len(id_dict), type), system='sgas.PostgreSQLDatabase')
+            defer.returnValue(id_dict)
+
+        except psycopg2.OperationalError as e:
+            if 'Connection refused' in str(e):
+                raise error.DatabaseUnavailableError(str(e))
+            raise # re-raise current exception
+        except psycopg2.InterfaceError as e:
+            # this usually happens if the database was restarted,
+            # and the existing connection to the database was closed
+            if retry:
+                log.msg('Got interface error after retrying to connect, bailing out.', system='sgas.PostgreSQLDatabase')
+                raise error.DatabaseUnavailableError(str(e))
+            log.msg('Got interface error while attempting bulk insert: %s.' % str(e), system='sgas.PostgreSQLDatabase')
+            log.msg('Attempting to reconnect.', system='sgas.PostgreSQLDatabase')
+            self.pool_proxy.reconnect()
+            id_dict = yield self.recordBulkInserter(type, proc, staging_table, template, columns, arg_list, proc_args, retry=True)
+            defer.returnValue(id_dict)
+        except Exception as e:
+            log.msg('Unexpected database error during bulk insert (%i %s records, proc: %s)' % (len(arg_list), type, proc), system='sgas.PostgreSQLDatabase')
+            log.err(e, system='sgas.PostgreSQLDatabase')
+            raise
+
+
     @defer.inlineCallbacks
-    def dictquery(self, query, query_args=None, retry=False):
+    def recordIdInserter(self, type, proc, arg_names, arg_list, retry=False):
+        # variant of recordInserter, where dimension values are resolved into ids
+        # using the dimension cache, before calling a procedure taking ids (urcreate_ids)
+        def idInsert(txn):
+            # executed in seperate thread, so it is safe to block
+            pending = {}
+            id_arg_list = self.dimension_cache.resolveArguments(txn, arg_names, arg_list, pending)
+            id_dict = {}
+            for args in id_arg_list:
+                txn.callproc(proc, args)
+                record_id, row_id = txn.fetchall()[0][0]
+                id_dict[record_id] = str(row_id)
+            return id_dict, pending
 
-        def buildValue(value):
-            if type(value) in (str, int, float, bool, type(None)):
-                return value
-            if isinstance(value, decimal.Decimal):
-                sv = str(value)
-                return int(sv) if sv.isalnum() else float(sv)
-            # bad catch-all
-            return str(value)
+        try:
+            id_dict, pending = yield self.pool_proxy.dbpool.runInteraction(idInsert)
+            # only entries from committed transactions goes into the cache
+            self.dimension_cache.update(pending)
+            log.msg('Database: %i %s records inserted' % (len(id_dict), type), system='sgas.PostgreSQLDatabase')
+            defer.returnValue(id_dict)
+
+        except psycopg2.IntegrityError as e:
+            if e.pgcode == PG_FOREIGN_KEY_VIOLATION and not retry:
+                # a cached dimension row has been removed, flush cache and retry with fresh ids
+                log.msg('Foreign key violation during insert, clearing dimension cache and retrying.', system='sgas.PostgreSQLDatabase')
+                self.dimension_cache.clear()
+                id_dict = yield self.recordIdInserter(type, proc, arg_names, arg_list, retry=True)
+                defer.returnValue(id_dict)
+            raise
+        except psycopg2.OperationalError as e:
+            if 'Connection refused' in str(e):
+                raise error.DatabaseUnavailableError(str(e))
+            raise # re-raise current exception
+        except psycopg2.InterfaceError as e:
+            # this usually happens if the database was restarted,
+            # and the existing connection to the database was closed
+            if retry:
+                log.msg('Got interface error after retrying to connect, bailing out.', system='sgas.PostgreSQLDatabase')
+                raise error.DatabaseUnavailableError(str(e))
+            log.msg('Got interface error while attempting insert: %s.' % str(e), system='sgas.PostgreSQLDatabase')
+            log.msg('Attempting to reconnect.', system='sgas.PostgreSQLDatabase')
+            self.pool_proxy.reconnect()
+            id_dict = yield self.recordIdInserter(type, proc, arg_names, arg_list, retry=True)
+            defer.returnValue(id_dict)
+
+
+    @defer.inlineCallbacks
+    def dictquery(self, query, query_args=None, statement_timeout=None, retry=False):
 
         def conn(conn, query, query_args):
+            _setStatementTimeout(conn, statement_timeout)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             cur.execute(query,query_args)
             return cur.fetchall()
 
         try:
-            query_result = yield self.pool_proxy.dbpool.runWithConnection(conn, query, query_args)
+            query_result = yield self._runCancellable(READ_POOL, conn, query, query_args)
             results = []
             for row in query_result:
-                results.append(dict([(k,buildValue(row[k])) for k in row]))
+                results.append(dict([(k,_buildValue(row[k])) for k in row]))
             defer.returnValue(results)
+        except psycopg2.extensions.QueryCanceledError as e:
+            raise error.QueryTimeoutError(str(e))
         except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
             # this usually happens if the database was restarted,
             # and the existing connection to the database was closed
             if not retry:
                 log.msg('Got interface error while querying database(%s), attempting to reconnect' % str(e), system='sgas.PostgreSQLDatabase')
-                self.pool_proxy.reconnect()
-                yield self.query(query, query_args, retry=True)
+                self.pools[READ_POOL].reconnect()
+                results = yield self.dictquery(query, query_args, statement_timeout, retry=True)
+                defer.returnValue(results)
             if retry:
                 log.msg('Got interface error after retrying to connect, bailing out.', system='sgas.PostgreSQLDatabase')
                 raise error.DatabaseUnavailableError(str(e))
 
 
     @defer.inlineCallbacks
-    def updateAggregator(self,aggregator,service=None,retry=False):
-        try:
-            conn = adbapi.Connection(self.pool_proxy.dbpool)
+    def streamquery(self, query, query_args, rowsReceived, dict_rows=False, batch_size=DEFAULT_STREAM_BATCH_SIZE, statement_timeout=None, retry=False):
+        """
+        Execute query with a server-side cursor, and deliver the result in
+        batches of up to batch_size rows, by calling rowsReceived with a list of
+        rows (in the reactor thread). If rowsReceived returns a deferred, the next
+        batch is not fetched before it fires, so the receiver controls the pace.
+        If rowsReceived raises (or the deferred fails), the query is stopped, and
+        the error is passed on. Returns the number of delivered rows. The
+        statement_timeout and cancellation are as for query.
+        """
+        delivered = [ 0 ]
+
+        def stream(conn):
+            # executed in seperate thread, so it is safe to block
+            _setStatementTimeout(conn, statement_timeout)
+            if dict_rows:
+                cur = conn.cursor(STREAM_CURSOR_NAME, cursor_factory=psycopg2.extras.RealDictCursor)
+            else:
+                cur = conn.cursor(STREAM_CURSOR_NAME)
+            cur.itersize = batch_size
+            cur.execute(query, query_args)
             while True:
-                try:
-                    txn = adbapi.Transaction(self, conn)
-
-                    # the update_uraggregate function requires serializable isolation level
-                    # in order to execute correctly
-                    txn.execute(SQL_SERIALIZABLE_TRANSACTION)
-                    yield txn.callproc(aggregator)
-                    idmn = txn.fetchall()
-                    txn.close()
-                    conn.commit()
-
-                    if idmn in (None, [(None,)]): # empty array -> response when all done
-                        break
-                    else:
-                        insert_date, machine_name = idmn[0][0]
-                        log.msg('Aggregation(%s) updated: %s / %s' % (aggregator,insert_date, machine_name), system='sgas.AggregationUpdater')
-                    if service and service.stopping:
-                        break
-                except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
-                    # typically means we lost the connection due to a db restart
-                    if retry:
-                        log.msg('Reconnect in update failed, bailing out.', system='sgas.AggregationUpdater')
-                        raise
-                    else:
-                        log.msg('Got InterfaceError while attempting update: %s.' % str(e), system='sgas.AggregationUpdater')
-                        log.msg('Attempting reconnect.', system='sgas.AggregationUpdater')
-                        retry = True
-                        time.sleep(3)
-                        self.pool_proxy.reconnect()
-                        log.msg("Reconnected ...", system='sgas.AggregationUpdater')
-                        self.updateAggregator(aggregator, service, retry=True)
-                        break
-                except Exception as e:
-                    log.msg("Got exception '%s', trying rollback" % e, system='sgas.AggregationUpdater')
-                    conn.rollback()
+                rows = cur.fetchmany(cur.itersize)
+                if not rows:
+                    break
+                if dict_rows:
+                    rows = [ dict([ (k, _buildValue(row[k])) for k in row ]) for row in rows ]
+                else:
+                    rows = [ [ _buildValue(e) for e in row ] for row in rows ]
+                threads.blockingCallFromThread(reactor, rowsReceived, rows)
+                delivered[0] += len(rows)
+            cur.close()
+            return delivered[0]
+
+        try:
+            n_rows = yield self._runCancellable(READ_POOL, stream)
+            defer.returnValue(n_rows)
+        except psycopg2.extensions.QueryCanceledError as e:
+            raise error.QueryTimeoutError(str(e))
+        except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
+            # this usually happens if the database was restarted, and the
+            # existing connection to the database was closed. The query can
+            # only be restarted if nothing has been delivered yet
+            if retry or delivered[0]:
+                log.msg('Got interface error while streaming query result, bailing out.', system='sgas.PostgreSQLDatabase')
+                raise error.DatabaseUnavailableError(str(e))
+            log.msg('Got interface error while querying database(%s), attempting to reconnect' % str(e), system='sgas.PostgreSQLDatabase')
+            self.pools[READ_POOL].reconnect()
+            n_rows = yield self.streamquery(query, query_args, rowsReceived, dict_rows, batch_size, statement_timeout, retry=True)
+            defer.returnValue(n_rows)
+
+
+    @defer.inlineCallbacks
+    def _aggregationWorker(self, aggregator, worker, work_mem, service, retry=False):
+        # updates slices until the update queue is empty, each slice in its own
+        # transaction. Slices are claimed with FOR UPDATE SKIP LOCKED in the
+        # aggregator, so several workers can run at the same time
+        def updateSlice(txn):
+            # executed in seperate thread, so it is safe to block
+            # the update_uraggregate function requires serializable isolation level
+            # in order to execute correctly
+            txn.execute(SQL_SERIALIZABLE_TRANSACTION)
+            if work_mem is not None:
+                # only for this transaction, the connection is shared with other work
+                txn.execute(SQL_SET_WORK_MEM, (work_mem,))
+            txn.callproc(aggregator)
+            return txn.fetchall()
+
+        pool_proxy = self.pools[AGGREGATION_POOL]
+        updates = 0
+        rollbacks = 0
+        while not (service and service.stopping):
+            pool = pool_proxy.dbpool
+            try:
+                idmn = yield pool.runInteraction(updateSlice)
+            except psycopg2.extensions.TransactionRollbackError as e:
+                # serialization failure or deadlock with another worker or an insert, try again
+                rollbacks += 1
+                if rollbacks > SERIALIZATION_RETRIES:
+                    log.msg('Aggregation(%s) worker %i: transaction rolled back %i times, giving up' % (aggregator, worker, rollbacks), system='sgas.AggregationUpdater')
+                    raise
+                delay = random.uniform(0, SERIALIZATION_BACKOFF * 2 ** (rollbacks - 1))
+                log.msg('Aggregation(%s) worker %i: transaction rolled back (%s), retrying in %.2f seconds' % (aggregator, worker, e.diag.message_primary, delay), system='sgas.AggregationUpdater')
+                yield task.deferLater(reactor, delay, lambda : None)
+                continue
+            except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
+                # typically means we lost the connection due to a db restart
+                if retry:
+                    log.msg('Reconnect in update failed, bailing out.', system='sgas.AggregationUpdater')
                     raise
+                log.msg('Got InterfaceError while attempting update: %s.' % str(e), system='sgas.AggregationUpdater')
+                # with several workers, only the first to notice reconnects
+                if pool_proxy.dbpool is pool:
+                    log.msg('Attempting reconnect.', system='sgas.AggregationUpdater')
+                    pool_proxy.reconnect()
+                retry = True
+                continue
 
-        except Exception as e:
-            log.err(e, system='sgas.AggregationUpdater')
-            raise
+            if idmn in (None, [], [(None,)]): # empty array -> response when all done
+                break
+            insert_date, machine_name = idmn[0][0]
+            log.msg('Aggregation(%s) updated: %s / %s' % (aggregator, insert_date, machine_name), system='sgas.AggregationUpdater')
+            updates += 1
+            retry = False
+            rollbacks = 0
 
-        finally:
-            conn.close()
+        defer.returnValue(updates)
+
+
+    @defer.inlineCallbacks
+    def updateAggregator(self, aggregator, service=None, workers=1, work_mem=None):
+        """
+        Update the aggregated data, until all pending updates are done. The
+        updates are done by workers parallel workers, each using its own
+        connection from the aggregation pool (workers above the size of the
+        pool wait for a connection). Returns the number of updated slices.
+        """
+        try:
+            results = yield defer.gatherResults( [ self._aggregationWorker(aggregator, i, work_mem, service) for i in range(workers) ],
+                                                 consumeErrors=True)
+            updates = sum(results)
+            if updates:
+                log.msg('Aggregation(%s): %i slices updated (%i workers)' % (aggregator, updates, workers), system='sgas.AggregationUpdater')
+            defer.returnValue(updates)
+        except defer.FirstError as e:
+            log.err(e.subFailure, system='sgas.AggregationUpdater')
+            e.subFailure.raiseException()
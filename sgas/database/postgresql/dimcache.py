@@ -0,0 +1,236 @@
+"""
+Dimension id cache for the insert path.
+
+Usage records reference a number of small dimension tables (machine names,
+queues, users, etc.). The urcreate procedure looks up (and possibly inserts)
+each of these for every record. This cache keeps the name -> id mappings in
+memory, so the insert path can pass resolved ids to the urcreate_ids procedure
+instead.
+
+Dimension rows are never updated, and a name -> id mapping stays valid for as
+long as the row exists. Several SGAS frontends sharing one database is
+therefore safe as long as only committed mappings are cached: ids resolved
+(or inserted) in a transaction are kept aside, and only merged into the cache
+after the transaction has been committed. The only way for an entry to become
+stale is that a dimension row is deleted (database maintenance), which will
+make the insert fail with a foreign key violation. In that case the cache is
+cleared, and the insert retried with fresh lookups.
+"""
+
+import collections
+
+from twisted.python import log
+from twisted.application import service
+
+
+
+# argument name -> (table, column)
+DIMENSIONS = {
+    'local_user_id'     : ('localuser',         'local_user'),
+    'global_user_name'  : ('globalusername',    'global_user_name'),
+    'machine_name'      : ('machinename',       'machine_name'),
+    'status'            : ('jobstatus',         'status'),
+    'queue'             : ('jobqueue',          'queue'),
+    'host'              : ('host',              'host'),
+    'project_name'      : ('projectname',       'project_name'),
+    'submit_host'       : ('submithost',        'submit_host'),
+    'insert_hostname'   : ('inserthost',        'insert_host'),
+    'insert_identity'   : ('insertidentity',    'insert_identity')
+}
+
+# vo information is identified by four arguments, and replaced by a single id
+VO_ARGUMENTS = ('vo_type', 'vo_issuer', 'vo_name', 'vo_attributes')
+VO_DIMENSION = 'voinformation'
+
+# upper bound on the number of cached entries per dimension (the host
+# dimension can grow large, as it contains node lists), the least recently
+# used entries are evicted beyond it
+MAX_ENTRIES = 50000
+
+SQL_WARM_DIMENSION  = '''SELECT id, %(column)s FROM %(table)s ORDER BY id DESC LIMIT %(limit)i'''
+SQL_SELECT_IDS      = '''SELECT id, %(column)s FROM %(table)s WHERE %(column)s = ANY(%%s)'''
+SQL_INSERT_IDS      = '''INSERT INTO %(table)s (%(column)s) SELECT unnest(%%s::varchar[]) ON CONFLICT DO NOTHING RETURNING id, %(column)s'''
+
+SQL_WARM_VO         = '''SELECT id, vo_type, vo_issuer, vo_name, vo_attributes FROM voinformation ORDER BY id DESC LIMIT %i'''
+SQL_SELECT_VO       = '''SELECT min(id) FROM voinformation
+                         WHERE vo_type       IS NOT DISTINCT FROM %s AND
+                               vo_issuer     IS NOT DISTINCT FROM %s AND
+                               vo_name       IS NOT DISTINCT FROM %s AND
+                               vo_attributes IS NOT DISTINCT FROM %s::varchar[]'''
+SQL_INSERT_VO       = '''INSERT INTO voinformation (vo_type, vo_issuer, vo_name, vo_attributes)
+                         VALUES (%s, %s, %s, %s::varchar[]) RETURNING id'''
+
+
+
+def _voKey(vo_type, vo_issuer, vo_name, vo_attributes):
+    if vo_attributes is not None:
+        vo_attributes = tuple( [ tuple(a) if isinstance(a, list) else a for a in vo_attributes ] )
+    return (vo_type, vo_issuer, vo_name, vo_attributes)
+
+
+def _voArgs(vo_key):
+    vo_type, vo_issuer, vo_name, vo_attributes = vo_key
+    if vo_attributes is not None:
+        vo_attributes = [ list(a) if isinstance(a, tuple) else a for a in vo_attributes ]
+    return vo_type, vo_issuer, vo_name, vo_attributes
+
+
+
+class DimensionCache(service.Service):
+
+    def __init__(self, pool_proxy):
+        self.pool_proxy = pool_proxy
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+
+    def startService(self):
+        service.Service.startService(self)
+        d = self.pool_proxy.dbpool.runInteraction(self.warm)
+        d.addErrback(lambda f : log.msg('Error warming dimension cache: %s' % f.getErrorMessage(), system='sgas.DimensionCache'))
+        return d
+
+
+    def clear(self):
+        self.entries = dict( [ (table, collections.OrderedDict()) for table, _ in DIMENSIONS.values() ] )
+        self.entries[VO_DIMENSION] = collections.OrderedDict()
+
+
+    def size(self):
+        return sum( [ len(e) for e in self.entries.values() ] )
+
+
+    def warm(self, txn):
+        # executed in seperate thread, so it is safe to block
+        entries = {}
+        for table, column in DIMENSIONS.values():
+            txn.execute(SQL_WARM_DIMENSION % {'table': table, 'column': column, 'limit': MAX_ENTRIES})
+            # oldest first, so the newest entries are the most recently used
+            entries[table] = collections.OrderedDict( [ (name, id_) for id_, name in reversed(txn.fetchall()) ] )
+
+        # multiple identical vo entries can exist, urcreate uses the first one
+        txn.execute(SQL_WARM_VO % MAX_ENTRIES)
+        vo_entries = collections.OrderedDict()
+        for row in reversed(txn.fetchall()):
+            vo_entries.setdefault(_voKey(*row[1:]), row[0])
+        entries[VO_DIMENSION] = vo_entries
+
+        self.update(entries)
+        log.msg('Dimension cache warmed (%i entries)' % self.size(), system='sgas.DimensionCache')
+
+
+    def update(self, entries):
+        # merge committed entries into the cache
+        for table, mapping in entries.items():
+            cache = self.entries[table]
+            for key, id_ in mapping.items():
+                cache[key] = id_
+                cache.move_to_end(key)
+            while len(cache) > MAX_ENTRIES:
+                cache.popitem(last=False)
+
+
+    def _resolveDimension(self, txn, table, column, names, pending):
+        cache = self.entries[table]
+        resolved = {}
+        missing = []
+        for name in names:
+            id_ = cache.get(name)
+            if id_ is None:
+                missing.append(name)
+            else:
+                cache.move_to_end(name)
+                resolved[name] = id_
+
+        self.hits += len(resolved)
+        self.misses += len(missing)
+        if not missing:
+            return resolved
+
+        params = {'table': table, 'column': column}
+        txn.execute(SQL_SELECT_IDS % params, (missing,))
+        found = dict( [ (name, id_) for id_, name in txn.fetchall() ] )
+
+        new_names = [ name for name in missing if name not in found ]
+        if new_names:
+            txn.execute(SQL_INSERT_IDS % params, (new_names,))
+            found.update( [ (name, id_) for id_, name in txn.fetchall() ] )
+            # names inserted by a concurrent transaction in the mean time
+            if len(found) < len(missing):
+                txn.execute(SQL_SELECT_IDS % params, ([ name for name in missing if name not in found ],))
+                found.update( [ (name, id_) for id_, name in txn.fetchall() ] )
+
+        pending.setdefault(table, {}).update(found)
+        resolved.update(found)
+        return resolved
+
+
+    def _resolveVO(self, txn, vo_keys, pending):
+        cache = self.entries[VO_DIMENSION]
+        resolved = {}
+        for vo_key in vo_keys:
+            id_ = cache.get(vo_key)
+            if id_ is not None:
+                cache.move_to_end(vo_key)
+                self.hits += 1
+                resolved[vo_key] = id_
+                continue
+
+            self.misses += 1
+            txn.execute(SQL_SELECT_VO, _voArgs(vo_key))
+            id_ = txn.fetchall()[0][0]
+            if id_ is None:
+                txn.execute(SQL_INSERT_VO, _voArgs(vo_key))
+                id_ = txn.fetchall()[0][0]
+            pending.setdefault(VO_DIMENSION, {})[vo_key] = id_
+            resolved[vo_key] = id_
+        return resolved
+
+
+    def resolveArguments(self, txn, arg_names, arg_list, pending):
+        """
+        Convert urcreate arguments into urcreate_ids arguments, i.e., replace
+        dimension values with their ids, and the vo arguments with a single vo
+        information id. Newly resolved entries are put in pending, which
+        should be merged (with update) after the transaction has committed.
+        """
+        dimension_slots = [ (idx, DIMENSIONS[name][0]) for idx, name in enumerate(arg_names) if name in DIMENSIONS ]
+        vo_slots = [ arg_names.index(name) for name in VO_ARGUMENTS ]
+        vo_name_slot = arg_names.index('vo_name')
+
+        # collect distinct values, and resolve them in one go per dimension
+        values = dict( [ (table, set()) for table, _ in DIMENSIONS.values() ] )
+        vo_keys = set()
+        for args in arg_list:
+            for idx, table in dimension_slots:
+                if args[idx] is not None:
+                    values[table].add(args[idx])
+            if args[vo_name_slot] is not None:
+                vo_keys.add(_voKey(*[ args[i] for i in vo_slots ]))
+
+        ids = {}
+        for table, column in DIMENSIONS.values():
+            ids[table] = self._resolveDimension(txn, table, column, list(values[table]), pending) if values[table] else {}
+        vo_ids = self._resolveVO(txn, vo_keys, pending)
+
+        # build the new argument lists
+        slot_tables = dict(dimension_slots)
+        vo_first, vo_skip = vo_slots[0], set(vo_slots[1:])
+        id_arg_list = []
+        for args in arg_list:
+            id_args = []
+            for idx, value in enumerate(args):
+                if idx in slot_tables:
+                    id_args.append(ids[slot_tables[idx]].get(value) if value is not None else None)
+                elif idx == vo_first:
+                    if args[vo_name_slot] is None:
+                        id_args.append(None)
+                    else:
+                        id_args.append(vo_ids[_voKey(*[ args[i] for i in vo_slots ])])
+                elif idx not in vo_skip:
+                    id_args.append(value)
+            id_arg_list.append(id_args)
+
+        return id_arg_list
+
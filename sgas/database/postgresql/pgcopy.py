@@ -0,0 +1,117 @@
+"""
+Encoding of rows into the PostgreSQL COPY text format.
+
+Used by the bulk insert path, where the arguments otherwise passed to a stored
+procedure are loaded into a staging table with COPY instead.
+"""
+
+import io
+import datetime
+
+
+COPY_NULL = '\\N'
+
+# characters which must be escaped in the COPY text format
+_COPY_ESCAPES = str.maketrans({
+    '\\' : '\\\\',
+    '\t' : '\\t',
+    '\n' : '\\n',
+    '\r' : '\\r'
+})
+
+
+def _quoteArrayElement(value):
+    # quote an element of an array literal
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (list, tuple)):
+        return _arrayLiteral(value)
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return '"' + value + '"'
+
+
+def _arrayLiteral(values):
+    return '{' + ','.join( [ _quoteArrayElement(v) for v in values ] ) + '}'
+
+
+def _compositeLiteral(values):
+    # composite literal, e.g., (1024,KB,physical), used for sgas_memory
+    fields = []
+    for v in values:
+        if v is None:
+            fields.append('')
+        else:
+            fields.append('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '(' + ','.join(fields) + ')'
+
+
+def _memoryLiteral(memory):
+    # same conversion as SgasMemory.getquoted, but without the cast
+    amount = memory.amount * memory.unit if memory.amount is not None else None
+    if amount is not None:
+        amount = int(amount)
+    return _compositeLiteral( (amount, getattr(memory, 'metric', None), memory.type) )
+
+
+def encodeValue(value):
+    """
+    Encode a single value as a field in the COPY text format.
+    """
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        elements = []
+        for v in value:
+            if hasattr(v, 'getquoted'): # sgas_memory element
+                elements.append('"' + _memoryLiteral(v).replace('\\', '\\\\').replace('"', '\\"') + '"')
+            else:
+                elements.append(_quoteArrayElement(v))
+        value = '{' + ','.join(elements) + '}'
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat(' ') if isinstance(value, datetime.datetime) else value.isoformat()
+    else:
+        value = str(value)
+    return value.translate(_COPY_ESCAPES)
+
+
+def encodeRow(row):
+    return '\t'.join( [ encodeValue(v) for v in row ] ) + '\n'
+
+
+
+class CopyReader(io.TextIOBase):
+    """
+    File-like object producing COPY data from a sequence of rows, so the rows
+    do not have to be encoded into a single big string before copying.
+    """
+    def __init__(self, rows):
+        io.TextIOBase.__init__(self)
+        self._rows = iter(rows)
+        self._buffer = ''
+
+
+    def readable(self):
+        return True
+
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer + ''.join( [ encodeRow(r) for r in self._rows ] )
+            self._buffer = ''
+            return data
+
+        chunks = [ self._buffer ]
+        length = len(self._buffer)
+        while length < size:
+            try:
+                row = encodeRow(next(self._rows))
+            except StopIteration:
+                break
+            chunks.append(row)
+            length += len(row)
+        data = ''.join(chunks)
+        self._buffer = data[size:]
+        return data[:size]
+
@@ -0,0 +1,339 @@
+"""
+Resumable, parallel rebuild of the aggregated usage data (uraggregated_data).
+
+The aggregated data is rebuilt into a shadow table, one partition (machine,
+insert month) per transaction, using several connections. Each partition is
+checkpointed in a progress table when committed, so an interrupted rebuild
+continues where it stopped. When all partitions are done, the shadow table is
+swapped in atomically. SGAS can keep running during the rebuild: it serves
+(and updates) the old aggregated data until the swap, and slices updated by
+SGAS after their partition was rebuilt are taken over from the old table
+during the swap.
+
+Used by the sgas-aggregation-rebuild tool.
+"""
+
+import re
+import time
+import datetime
+import threading
+
+from concurrent import futures
+
+
+
+AGGREGATION_TABLE   = 'uraggregated_data'
+SHADOW_TABLE        = 'uraggregated_data_rebuild'
+PROGRESS_TABLE      = 'uraggregated_rebuild_progress'
+OLD_SUFFIX          = '_old'
+SHADOW_SUFFIX       = '_rebuild'
+
+SQL_CREATE_SHADOW_TABLE = '''CREATE TABLE IF NOT EXISTS %s (LIKE %s INCLUDING DEFAULTS)''' % (SHADOW_TABLE, AGGREGATION_TABLE)
+SQL_CREATE_PROGRESS_TABLE = '''
+CREATE TABLE IF NOT EXISTS %s (
+    machine_name_id     integer,
+    month               date,
+    n_rows              integer,
+    started             timestamp,
+    PRIMARY KEY (machine_name_id, month)
+)''' % PROGRESS_TABLE
+SQL_DROP_REBUILD_TABLES = '''DROP TABLE IF EXISTS %s, %s''' % (SHADOW_TABLE, PROGRESS_TABLE)
+
+SQL_PARTITIONS = '''
+SELECT DISTINCT machine_name_id, date_trunc('month', insert_time)::date AS month
+FROM usagedata
+WHERE machine_name_id IS NOT NULL
+EXCEPT
+SELECT machine_name_id, month FROM %s
+ORDER BY month, machine_name_id''' % PROGRESS_TABLE
+
+SQL_PROGRESS = '''SELECT count(*), COALESCE(sum(n_rows), 0) FROM %s''' % PROGRESS_TABLE
+
+# same aggregation as update_uraggregate, for all days of a partition; the days
+# are given as an array, so the hash index on date(insert_time) can be used
+SQL_REBUILD_PARTITION = '''
+INSERT INTO %s
+    (execution_time, insert_time, machine_name_id, queue_id,
+     global_user_name_id, local_user_id, vo_information_id, project_name_id,
+     runtime_environments_id, status_id, insert_host_id, n_jobs, cputime, walltime, generate_time)
+SELECT
+    COALESCE(end_time::DATE, create_time::DATE)                             AS s_execute_time,
+    insert_time::DATE                                                       AS s_insert_time,
+    machine_name_id                                                         AS s_machine_name_id,
+    queue_id                                                                AS s_queue_id,
+    global_user_name_id                                                     AS s_global_user_name_id,
+    CASE WHEN global_user_name_id IS NULL THEN local_user_id ELSE NULL END  AS s_local_user_id,
+    vo_information_id                                                       AS s_vo_information_id,
+    CASE WHEN vo_information_id IS NULL THEN project_name_id ELSE NULL END  AS s_project_name_id,
+    ARRAY(SELECT runtimeenvironment_usagedata.runtimeenvironments_id
+          FROM runtimeenvironment_usagedata
+          WHERE usagedata.id = runtimeenvironment_usagedata.usagedata_id)   AS s_runtime_environments,
+    status_id                                                               AS s_status_id,
+    insert_host_id                                                          AS s_insert_host_id,
+    count(*)                                                                AS s_n_jobs,
+    SUM(COALESCE(cpu_duration::bigint,0))                                   AS s_cputime,
+    SUM(COALESCE(wall_duration::bigint,0) * COALESCE(processors,1))         AS s_walltime,
+    now()                                                                   AS s_generate_time
+FROM
+    usagedata
+WHERE
+    date(insert_time) = ANY(%%(days)s::date[]) AND machine_name_id = %%(machine_name_id)s
+GROUP BY
+    s_execute_time, s_insert_time, s_machine_name_id, s_queue_id,
+    s_global_user_name_id, s_local_user_id, s_vo_information_id, s_project_name_id,
+    s_runtime_environments, s_status_id, s_insert_host_id''' % SHADOW_TABLE
+
+SQL_CHECKPOINT = '''INSERT INTO %s (machine_name_id, month, n_rows, started) VALUES (%%s, %%s, %%s, now())''' % PROGRESS_TABLE
+
+SQL_SET_WORK_MEM = '''SET work_mem = %s'''
+SQL_REPEATABLE_READ = '''SET TRANSACTION ISOLATION LEVEL REPEATABLE READ'''
+
+SQL_INDEXES = '''SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s'''
+
+# views reading the aggregated data are bound to the table, not its name,
+# so they are recreated after the swap
+SQL_DEPENDENT_VIEWS = '''
+SELECT DISTINCT c.oid::regclass::text, c.relkind, pg_get_viewdef(c.oid)
+FROM pg_depend d
+JOIN pg_rewrite r ON (d.objid = r.oid)
+JOIN pg_class c ON (r.ev_class = c.oid)
+WHERE d.refobjid = %s::regclass AND c.oid <> %s::regclass'''
+
+SQL_LOCK_AGGREGATION_TABLE = '''LOCK TABLE %s IN EXCLUSIVE MODE''' % AGGREGATION_TABLE
+
+# slices updated by SGAS after their partition was rebuilt (or in partitions
+# which did not exist when the rebuild started) are taken over from the old table
+SQL_CATCHUP_SLICES = '''
+CREATE TEMPORARY TABLE rebuild_catchup ON COMMIT DROP AS
+SELECT a.insert_time, a.machine_name_id
+FROM %s a
+LEFT OUTER JOIN %s p ON (p.machine_name_id = a.machine_name_id AND p.month = date_trunc('month', a.insert_time)::date)
+GROUP BY a.insert_time, a.machine_name_id, p.started
+HAVING max(a.generate_time) > COALESCE(p.started, (SELECT min(started) FROM %s))''' % (AGGREGATION_TABLE, PROGRESS_TABLE, PROGRESS_TABLE)
+SQL_CATCHUP_DELETE = '''
+DELETE FROM %s s USING rebuild_catchup c
+WHERE s.insert_time = c.insert_time AND s.machine_name_id = c.machine_name_id''' % SHADOW_TABLE
+SQL_CATCHUP_INSERT = '''
+INSERT INTO %s SELECT a.* FROM %s a JOIN rebuild_catchup c USING (insert_time, machine_name_id)''' % (SHADOW_TABLE, AGGREGATION_TABLE)
+
+# the monthly rollup is updated by SGAS from the rebuilt data
+SQL_MARK_MONTHLY_UPDATES = '''
+INSERT INTO uraggregated_monthly_update (execution_month, machine_name_id)
+SELECT date_trunc('month', execution_time)::date, machine_name_id FROM %s
+WHERE execution_time IS NOT NULL AND machine_name_id IS NOT NULL
+UNION
+SELECT execution_month, machine_name_id FROM uraggregated_monthly_data
+ON CONFLICT (execution_month, machine_name_id) DO UPDATE SET queued = now()''' % AGGREGATION_TABLE
+
+SQL_RENAME_TABLE = '''ALTER TABLE %s RENAME TO %s'''
+SQL_RENAME_INDEX = '''ALTER INDEX %s RENAME TO %s'''
+SQL_DROP_TABLE   = '''DROP TABLE %s'''
+SQL_DROP_INDEX   = '''DROP INDEX IF EXISTS %s'''
+SQL_REPLACE_VIEW = '''CREATE OR REPLACE VIEW %s AS %s'''
+
+INDEX_RX = re.compile(r'^CREATE (UNIQUE )?INDEX (\S+) ON (\S+) (.*)$')
+
+
+
+class RebuildError(Exception):
+    pass
+
+
+
+def monthDays(month):
+    """
+    Return the days of the month starting at month (a datetime.date).
+    """
+    days = []
+    day = month
+    while day.month == month.month:
+        days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def shadowIndexDefinition(indexdef, shadow_table=SHADOW_TABLE):
+    """
+    Rewrite an index definition of the aggregation table (from pg_indexes)
+    into a definition of the same index on the shadow table. Returns the
+    shadow index name and definition.
+    """
+    m = INDEX_RX.match(indexdef)
+    if m is None:
+        raise RebuildError('Cannot parse index definition: %s' % indexdef)
+    unique, name, table, rest = m.groups()
+    shadow_name = name + SHADOW_SUFFIX
+    schema = table.rsplit('.', 1)[0] + '.' if '.' in table else ''
+    return shadow_name, 'CREATE %sINDEX %s ON %s%s %s' % (unique or '', shadow_name, schema, shadow_table, rest)
+
+
+
+class AggregationRebuild:
+
+    def __init__(self, connect, workers=4, work_mem=None, output=None):
+        # connect is a function returning a new psycopg2 connection
+        self.connect = connect
+        self.workers = workers
+        self.work_mem = work_mem
+        self.output = output
+        self.lock = threading.Lock()
+        self.stopping = False
+
+
+    def log(self, msg):
+        if self.output is not None:
+            self.output.write(msg + '\n')
+            self.output.flush()
+
+
+    def prepare(self, restart=False):
+        """
+        Create the shadow and progress tables (dropping existing ones if
+        restart is True), and return the partitions still to be rebuilt.
+        """
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            if restart:
+                cur.execute(SQL_DROP_REBUILD_TABLES)
+            cur.execute(SQL_CREATE_SHADOW_TABLE)
+            cur.execute(SQL_CREATE_PROGRESS_TABLE)
+            conn.commit()
+            cur.execute(SQL_PROGRESS)
+            done, rows = cur.fetchone()
+            if done:
+                self.log('Resuming rebuild: %i partitions (%i rows) already done' % (done, rows))
+            cur.execute(SQL_PARTITIONS)
+            partitions = cur.fetchall()
+            conn.commit()
+            return partitions
+        finally:
+            conn.close()
+
+
+    def _rebuildPartition(self, conn, machine_name_id, month):
+        cur = conn.cursor()
+        try:
+            cur.execute(SQL_REPEATABLE_READ)
+            cur.execute(SQL_REBUILD_PARTITION, { 'days': monthDays(month), 'machine_name_id': machine_name_id })
+            n_rows = cur.rowcount
+            cur.execute(SQL_CHECKPOINT, (machine_name_id, month, n_rows))
+            conn.commit()
+            return n_rows
+        except:
+            conn.rollback()
+            raise
+
+
+    def _worker(self, partitions, progress):
+        conn = self.connect()
+        try:
+            if self.work_mem is not None:
+                conn.cursor().execute(SQL_SET_WORK_MEM, (self.work_mem,))
+                conn.commit()
+            while not self.stopping:
+                with self.lock:
+                    if not partitions:
+                        return
+                    machine_name_id, month = partitions.pop(0)
+                n_rows = self._rebuildPartition(conn, machine_name_id, month)
+                with self.lock:
+                    progress['done'] += 1
+                    progress['rows'] += n_rows
+                    done, total = progress['done'], progress['total']
+                    elapsed = time.time() - progress['start']
+                eta = elapsed / done * (total - done)
+                self.log('[%i/%i] machine %s, %s: %i rows (%.1f%%, %i s remaining)' % \
+                         (done, total, machine_name_id, month.strftime('%Y-%m'), n_rows, 100.0 * done / total, eta))
+        except:
+            # no point in the other workers continuing
+            self.stopping = True
+            raise
+        finally:
+            conn.close()
+
+
+    def rebuildPartitions(self, partitions):
+        """
+        Rebuild the given partitions, using the configured number of workers.
+        Returns the number of aggregated rows created.
+        """
+        partitions = list(partitions)
+        progress = { 'done': 0, 'rows': 0, 'total': len(partitions), 'start': time.time() }
+        if not partitions:
+            return 0
+        self.log('Rebuilding %i partitions with %i workers' % (len(partitions), self.workers))
+        with futures.ThreadPoolExecutor(self.workers) as executor:
+            workers = [ executor.submit(self._worker, partitions, progress) for _ in range(self.workers) ]
+            try:
+                for w in workers:
+                    w.result() # re-raises worker errors
+            except KeyboardInterrupt:
+                # let the workers commit the partitions they are working on
+                self.stopping = True
+                raise
+        return progress['rows']
+
+
+    def swap(self, keep_old=False):
+        """
+        Swap the shadow table in as the aggregation table, and remove the
+        rebuild tables.
+        """
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+
+            # indexes are built before taking the lock
+            cur.execute(SQL_INDEXES, (AGGREGATION_TABLE,))
+            indexes = cur.fetchall()
+            for name, indexdef in indexes:
+                shadow_name, shadow_indexdef = shadowIndexDefinition(indexdef)
+                self.log('Creating index %s' % shadow_name)
+                cur.execute(SQL_DROP_INDEX % shadow_name) # from an earlier, failed swap
+                cur.execute(shadow_indexdef)
+            conn.commit()
+
+            cur.execute(SQL_DEPENDENT_VIEWS, (AGGREGATION_TABLE, AGGREGATION_TABLE))
+            views = cur.fetchall()
+            for view_name, relkind, _ in views:
+                if relkind != 'v':
+                    raise RebuildError('Cannot recreate %s (not a view), refusing to swap' % view_name)
+
+            # writes to the aggregation table are blocked from here, reads are not
+            cur.execute(SQL_LOCK_AGGREGATION_TABLE)
+            cur.execute(SQL_CATCHUP_SLICES)
+            cur.execute(SQL_CATCHUP_DELETE)
+            cur.execute(SQL_CATCHUP_INSERT)
+            self.log('Took over %i rows updated during the rebuild' % cur.rowcount)
+
+            old_table = AGGREGATION_TABLE + OLD_SUFFIX
+            cur.execute(SQL_RENAME_TABLE % (AGGREGATION_TABLE, old_table))
+            cur.execute(SQL_RENAME_TABLE % (SHADOW_TABLE, AGGREGATION_TABLE))
+            for name, _ in indexes:
+                cur.execute(SQL_RENAME_INDEX % (name, name + OLD_SUFFIX))
+                cur.execute(SQL_RENAME_INDEX % (name + SHADOW_SUFFIX, name))
+            for view_name, _, viewdef in views:
+                cur.execute(SQL_REPLACE_VIEW % (view_name, viewdef.rstrip().rstrip(';')))
+            if not keep_old:
+                cur.execute(SQL_DROP_TABLE % old_table)
+            cur.execute(SQL_DROP_TABLE % PROGRESS_TABLE)
+            cur.execute(SQL_MARK_MONTHLY_UPDATES)
+            conn.commit()
+            self.log('Swapped in rebuilt aggregation table' + (' (old table kept as %s)' % old_table if keep_old else ''))
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+    def run(self, restart=False, swap=True, keep_old=False):
+        partitions = self.prepare(restart)
+        rows = self.rebuildPartitions(partitions)
+        # partitions with records inserted since the rebuild started
+        rows += self.rebuildPartitions(self.prepare())
+        self.log('All partitions rebuilt (%i rows created in this run)' % rows)
+        if swap:
+            self.swap(keep_old)
+
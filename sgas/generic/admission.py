@@ -0,0 +1,139 @@
+"""
+Admission control for the insert resources.
+
+When many registrants send their backlogs at the same time, inserts can
+saturate the database thread pool, starving queries and views. The admission
+controller puts limits on the number of inserts in progress, the number of
+records being inserted, and (optionally) the number of inserts in progress per
+insert identity. Registrations over the limits are rejected right away, with a
+Retry-After hint, instead of piling up.
+"""
+
+import random
+
+from twisted.python import log
+
+from sgas.server import stats
+
+
+# admission options (in the plugin block), 0 means no limit
+MAX_INSERTS                 = 'max_inserts'
+MAX_INSERT_RECORDS          = 'max_insert_records'
+MAX_INSERTS_PER_IDENTITY    = 'max_inserts_per_identity'
+RETRY_AFTER                 = 'retry_after'
+
+DEFAULT_RETRY_AFTER         = 30 # seconds
+
+HTTP_HEADER_RETRY_AFTER     = 'retry-after'
+
+HTTP_TOO_MANY_REQUESTS      = 429
+HTTP_SERVICE_UNAVAILABLE    = 503
+
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a registration is not admitted. The code is the HTTP status
+    code to respond with, and retry_after the number of seconds the client
+    should wait before retrying.
+    """
+    def __init__(self, message, code, retry_after):
+        Exception.__init__(self, message)
+        self.code = code
+        self.retry_after = retry_after
+
+
+
+class AdmissionController:
+
+    def __init__(self, name, max_inserts=0, max_records=0, max_per_identity=0, retry_after=DEFAULT_RETRY_AFTER):
+        self.name = name
+        self.max_inserts = max_inserts
+        self.max_records = max_records
+        self.max_per_identity = max_per_identity
+        self.retry_after = retry_after
+
+        self.inserts = 0
+        self.records = 0
+        self.identity_inserts = {}
+        self.rejected = 0
+
+
+    def retryAfter(self):
+        # spread out retries, so rejected registrants do not come back at once
+        return int(self.retry_after * (1 + random.random()))
+
+
+    def _reject(self, message, code):
+        self.rejected += 1
+        log.msg('%s, rejecting %s insert' % (message, self.name), system='sgas.AdmissionController')
+        raise AdmissionError(message, code, self.retryAfter())
+
+
+    def admit(self, identity):
+        """
+        Admit an insert request from identity. Raises AdmissionError if the
+        request should be rejected, otherwise release must be called when the
+        request is done.
+        """
+        if self.max_inserts and self.inserts >= self.max_inserts:
+            self._reject('Too many inserts in progress (%i)' % self.inserts, HTTP_SERVICE_UNAVAILABLE)
+
+        identity_inserts = self.identity_inserts.get(identity, 0)
+        if self.max_per_identity and identity_inserts >= self.max_per_identity:
+            self._reject('Too many inserts in progress for %s (%i)' % (identity, identity_inserts), HTTP_TOO_MANY_REQUESTS)
+
+        self.inserts += 1
+        self.identity_inserts[identity] = identity_inserts + 1
+
+
+    def release(self, identity):
+        self.inserts -= 1
+        if self.identity_inserts[identity] > 1:
+            self.identity_inserts[identity] -= 1
+        else:
+            del self.identity_inserts[identity]
+
+
+    def reserveRecords(self, n_records):
+        """
+        Reserve room for inserting n_records records. Raises AdmissionError if
+        there is no room, otherwise releaseRecords must be called when the
+        records have been inserted (or failed). A single batch larger than the
+        limit is admitted when nothing else is being inserted.
+        """
+        if self.max_records and self.records and self.records + n_records > self.max_records:
+            self._reject('Too many records being inserted (%i)' % self.records, HTTP_SERVICE_UNAVAILABLE)
+        self.records += n_records
+
+
+    def releaseRecords(self, n_records):
+        self.records -= n_records
+
+
+    def getStatistics(self):
+        return {
+            'inserts'       : self.inserts,
+            'records'       : self.records,
+            'identities'    : len(self.identity_inserts),
+            'rejected'      : self.rejected
+        }
+
+
+
+def createAdmissionController(cfg, cfg_block, name):
+    """
+    Create admission controller from the options in a plugin block. The
+    controller is always created, but without limits configured it admits
+    everything.
+    """
+    options = {}
+    for option, key in [ (MAX_INSERTS, 'max_inserts'), (MAX_INSERT_RECORDS, 'max_records'),
+                         (MAX_INSERTS_PER_IDENTITY, 'max_per_identity'), (RETRY_AFTER, 'retry_after') ]:
+        if cfg.has_option(cfg_block, option):
+            options[key] = cfg.getint(cfg_block, option)
+
+    controller = AdmissionController(name, **options)
+    stats.registerProvider('admission:' + name, controller.getStatistics)
+    return controller
+
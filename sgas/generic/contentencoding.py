@@ -0,0 +1,168 @@
+"""
+Support for compressed (Content-Encoding gzip / deflate) request bodies.
+
+Usage record batches are repetitive XML, and compress very well. The
+DecompressingReader wraps the (compressed) request body, and decompresses it
+incrementally as the streaming parser reads from it, so the decompressed
+document is never kept in memory as a whole. As protection against
+decompression bombs, reading fails once the decompressed size exceeds a limit.
+"""
+
+import io
+import zlib
+
+
+HTTP_HEADER_CONTENT_ENCODING    = 'content-encoding'
+HTTP_HEADER_ACCEPT_ENCODING     = 'accept-encoding'
+
+GZIP        = 'gzip'
+DEFLATE     = 'deflate'
+IDENTITY    = 'identity'
+
+CONTENT_ENCODINGS = (GZIP, DEFLATE)
+
+# limit option (in the plugin block)
+MAX_DECOMPRESSED_SIZE           = 'max_decompressed_size'
+DEFAULT_MAX_DECOMPRESSED_SIZE   = 512 * 1024 * 1024
+
+READ_SIZE = 64 * 1024
+
+
+
+class DecompressionError(Exception):
+    """
+    Raised when the request body is not validly compressed.
+    """
+
+
+class DecompressionLimitError(DecompressionError):
+    """
+    Raised when the decompressed request body exceeds the size limit.
+    """
+
+
+
+def parseContentEncoding(header_value):
+    """
+    Return the content encoding of a request, given the value of its
+    Content-Encoding header (which may be None). Raises ValueError for
+    unsupported (or multiple) encodings.
+    """
+    if header_value is None:
+        return None
+    encodings = [ e.strip().lower() for e in header_value.split(',') if e.strip() ]
+    encodings = [ e for e in encodings if e != IDENTITY ]
+    if not encodings:
+        return None
+    if len(encodings) > 1 or encodings[0] not in CONTENT_ENCODINGS:
+        raise ValueError('Unsupported content encoding: %s' % header_value)
+    return encodings[0]
+
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Read-only file-like object, decompressing data read from source.
+
+    The decompressor is created on first read, so a reader which has not been
+    read from can be pickled (and parsed in a worker process).
+    """
+    def __init__(self, source, encoding, max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+        io.RawIOBase.__init__(self)
+        if encoding not in CONTENT_ENCODINGS:
+            raise ValueError('Unsupported content encoding: %s' % encoding)
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        self.source = source
+        self.encoding = encoding
+        self.max_size = max_size
+        self.size = 0
+        self._decompressor = None
+        self._pending = b''
+        self._eof = False
+
+
+    def __getstate__(self):
+        if self._decompressor is not None:
+            raise TypeError('Cannot pickle a DecompressingReader which has been read from')
+        return { 'source': self.source, 'encoding': self.encoding, 'max_size': self.max_size }
+
+
+    def __setstate__(self, state):
+        self.__init__(state['source'], state['encoding'], state['max_size'])
+
+
+    def portable(self):
+        """
+        Return a reader which can be passed to another process, i.e., with the
+        compressed data read into memory.
+        """
+        source = self.source
+        if not isinstance(source, io.BytesIO):
+            source = io.BytesIO(source.read())
+        return DecompressingReader(source, self.encoding, self.max_size)
+
+
+    def readable(self):
+        return True
+
+
+    def _createDecompressor(self, data):
+        if self.encoding == GZIP:
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # deflate should be zlib wrapped, but some clients send raw deflate
+        if len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0:
+            return zlib.decompressobj(zlib.MAX_WBITS)
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+
+
+    def _decompress(self, size):
+        # decompress until at least size bytes are available, or end of data
+        while len(self._pending) < size and not self._eof:
+            if self._decompressor is not None and self._decompressor.unconsumed_tail:
+                data = self._decompressor.unconsumed_tail
+            else:
+                data = self.source.read(READ_SIZE)
+                if self._decompressor is None:
+                    self._decompressor = self._createDecompressor(data)
+
+            if not data:
+                if not self._decompressor.eof:
+                    raise DecompressionError('Compressed request body is truncated')
+                self._eof = True
+                break
+
+            try:
+                # bounded output, so a small input cannot expand without limit
+                chunk = self._decompressor.decompress(data, READ_SIZE)
+            except zlib.error as e:
+                raise DecompressionError('Invalid %s request body (%s)' % (self.encoding, str(e)))
+
+            self.size += len(chunk)
+            if self.size > self.max_size:
+                raise DecompressionLimitError('Decompressed request body exceeds %i bytes' % self.max_size)
+            self._pending += chunk
+
+            if self._decompressor.eof:
+                self._eof = True
+
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(READ_SIZE)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+
+        self._decompress(size)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
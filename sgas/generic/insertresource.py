@@ -9,20 +9,25 @@ Copyright: NorduNET / Nordic Data Grid Facility (2009, 2010, 2011)
 """
 
 from twisted.python import log
+from twisted.internet import defer, threads
 from twisted.web import resource, server
 
 from sgas.ext.python import json
 from sgas.authz import rights
 from sgas.server import resourceutil
 from sgas.database import error as dberror
+from sgas.generic import spool, workerpool, contentencoding, admission, jsonrecords
 
 
+INSERT_CHUNK_SIZE = 'insert_chunk_size'
+
 
 class GenericInsertResource(resource.Resource):
 
     isLeaf = False
 
     authz_right = None
+    content_encodings = contentencoding.CONTENT_ENCODINGS
     insert_error_msg = 'Error during insert: %s'
     insert_authz_reject_msg = 'Rejecting insert for %s, has no insert rights.'
 
@@ -30,21 +35,115 @@ class GenericInsertResource(resource.Resource):
         resource.Resource.__init__(self)
         self.db = db
         self.authorizer = authorizer
+        self.spool = None
+        self.spool_drainer = None
+        self.worker_pool = None
+        self.max_decompressed_size = contentencoding.DEFAULT_MAX_DECOMPRESSED_SIZE
+        self.admission = None
+        self.insert_chunk_size = 0
+
+
+    def setupSpool(self, cfg, cfg_block):
+        # enable spool mode if a spool directory is configured in the plugin block
+        self.spool, self.spool_drainer = spool.createSpool(cfg, cfg_block, self.PLUGIN_ID, self.insertArguments)
+        if self.spool_drainer is not None:
+            self.db.attachService(self.spool_drainer)
+
+
+    def setupWorkerPool(self, cfg, cfg_block):
+        # parsing is done in a worker pool, unless parse_workers is set to 0
+        self.worker_pool = workerpool.createWorkerPool(cfg, cfg_block, self.PLUGIN_ID)
+        if self.worker_pool is not None:
+            self.db.attachService(self.worker_pool)
+
+
+    def setupContentEncoding(self, cfg, cfg_block):
+        # limit on the decompressed size of compressed request bodies
+        if cfg.has_option(cfg_block, contentencoding.MAX_DECOMPRESSED_SIZE):
+            self.max_decompressed_size = cfg.getint(cfg_block, contentencoding.MAX_DECOMPRESSED_SIZE)
+
+
+    def setupAdmission(self, cfg, cfg_block):
+        # limits on inserts in progress, from the plugin block
+        self.admission = admission.createAdmissionController(cfg, cfg_block, self.PLUGIN_ID)
+
+
+    def setupChunkedInsert(self, cfg, cfg_block):
+        # commit large batches in chunks, rejecting bad records individually
+        if cfg.has_option(cfg_block, INSERT_CHUNK_SIZE):
+            self.insert_chunk_size = cfg.getint(cfg_block, INSERT_CHUNK_SIZE)
+
+
+    def parseRecords(self, parse, data, *args):
+        """
+        Run parse(data, *args) in the worker pool, returns a deferred. The
+        parse function must be a module level function, and its result must be
+        picklable, as it may be run in another process.
+        """
+        if self.worker_pool is None:
+            return defer.maybeDeferred(parse, data, *args)
+        if self.worker_pool.worker_type == workerpool.WORKER_PROCESS:
+            # compressed data is passed on as is, and decompressed by the worker
+            if isinstance(data, contentencoding.DecompressingReader):
+                data = data.portable()
+            elif hasattr(data, 'read'):
+                data = data.read()
+        return self.worker_pool.submit(parse, data, *args)
 
 
-    def insertRecords(self, data, subject, hostname):
+    def insertRecords(self, data, subject, hostname, record_format=jsonrecords.XML):
         raise NotImplementedError('This method should have been overridden in subclass')
-    
+
+
+    def insertArguments(self, arg_list):
+        # insert arguments into the database, returns deferred
+        raise NotImplementedError('This method should have been overridden in subclass')
+
+
+    def submitArguments(self, arg_list):
+        """
+        Called by subclasses with the insert arguments of validated and
+        authorized records. In spool mode the arguments are written to the
+        spool, and the records are inserted into the database later. The
+        result then maps record ids to None, as no row ids are known yet.
+        """
+        if self.admission is not None:
+            # raises AdmissionError if there is no room for the records
+            self.admission.reserveRecords(len(arg_list))
+
+        if self.spool is None:
+            d = self.insertArguments(arg_list)
+        else:
+            def spooled(_):
+                self.spool_drainer.notify()
+                return dict( [ (args[0], None) for args in arg_list ] )
+
+            d = threads.deferToThread(self.spool.append, arg_list)
+            d.addCallback(spooled)
+
+        if self.admission is not None:
+            def releaseRecords(result):
+                self.admission.releaseRecords(len(arg_list))
+                return result
+            d.addBoth(releaseRecords)
+        return d
+
+
     def render_POST(self, request):
 
         def insertDone(result):
+            rejected = getattr(result, 'rejected', None)
+            if rejected:
+                # some records could not be inserted (chunked insert)
+                result = { 'accepted': result, 'rejected': rejected }
             request.write(json.dumps(result).encode('utf-8'))
             request.finish()
 
         def insertError(error):
             #log.msg("Error during insert: %s" % error.getErrorMessage(), system='sgas.InsertResource')
             log.msg(self.insert_error_msg % error.getErrorMessage(), system='sgas.InsertResource')
-            log.err(error)
+            if not error.check(admission.AdmissionError):
+                log.err(error)
 
             error_msg = error.getErrorMessage()
             if error.check(dberror.DatabaseUnavailableError):
@@ -52,6 +151,15 @@ class GenericInsertResource(resource.Resource):
                 error_msg = 'Database currently unavailable. Please try again later.'
             elif error.check(dberror.SecurityError):
                 request.setResponseCode(406) # not acceptable
+            elif error.check(dberror.InvalidUsageDataError):
+                request.setResponseCode(400) # bad request
+            elif error.check(admission.AdmissionError):
+                request.setResponseCode(error.value.code)
+                request.setHeader(admission.HTTP_HEADER_RETRY_AFTER, str(error.value.retry_after))
+            elif error.check(contentencoding.DecompressionLimitError):
+                request.setResponseCode(413) # request entity too large
+            elif error.check(contentencoding.DecompressionError):
+                request.setResponseCode(400) # bad request
             else:
                 request.setResponseCode(500)
 
@@ -70,12 +178,44 @@ class GenericInsertResource(resource.Resource):
 
         # request allowed, continue
 
+        try:
+            encoding = contentencoding.parseContentEncoding(request.getHeader(contentencoding.HTTP_HEADER_CONTENT_ENCODING))
+        except ValueError as e:
+            log.msg(str(e), system='sgas.InsertResource')
+            request.setResponseCode(415) # unsupported media type
+            request.setHeader(contentencoding.HTTP_HEADER_ACCEPT_ENCODING, ', '.join(self.content_encodings))
+            return str(e).encode('utf-8')
+
+        if self.admission is not None:
+            try:
+                self.admission.admit(subject)
+            except admission.AdmissionError as e:
+                request.setResponseCode(e.code)
+                request.setHeader(admission.HTTP_HEADER_RETRY_AFTER, str(e.retry_after))
+                return str(e).encode('utf-8')
+
+            def release(result):
+                self.admission.release(subject)
+                return result
+
+        # records can be sent as xml (default), json or ndjson
+        record_format = jsonrecords.getRecordFormat(request.getHeader(jsonrecords.HTTP_HEADER_CONTENT_TYPE))
+
+        # the request body is handed to the parser as a file, so large
+        # documents are parsed incrementally, without decoding the whole body
+        request.content.seek(0)
+        data = request.content
+        if encoding is not None:
+            data = contentencoding.DecompressingReader(data, encoding, self.max_decompressed_size)
+
         # hostname is used for logging / provenance in the usage records
-        hostname = resourceutil.getHostname(request) or resourceutil.getCN(subject)
+        def gotHostname(hostname):
+            return self.insertRecords(data, subject, hostname or resourceutil.getCN(subject), record_format)
 
-        request.content.seek(0)
-        data = request.content.read()
-        d = self.insertRecords(data.decode('utf-8'), subject, hostname)
+        d = resourceutil.getHostname(request)
+        d.addCallback(gotHostname)
+        if self.admission is not None:
+            d.addBoth(release)
         d.addCallbacks(insertDone, insertError)
         return server.NOT_DONE_YET
 
@@ -0,0 +1,135 @@
+"""
+Reading of records in JSON and NDJSON format.
+
+Besides XML, the insert resources accept records as JSON: either a document
+containing a list of record objects (or a single object), or NDJSON, i.e., one
+record object per line. NDJSON is read line by line, so large batches are not
+decoded as a whole. Each record object maps insert argument names to values,
+the conversion into insert arguments is done by urjson and srjson.
+"""
+
+import io
+
+from sgas.ext.python import json
+from sgas.database import error as dberror
+
+
+# record formats, from the content type of the request
+XML     = 'xml'
+JSON    = 'json'
+NDJSON  = 'ndjson'
+
+CONTENT_TYPES = {
+    'application/json'      : JSON,
+    'application/x-ndjson'  : NDJSON,
+    'application/ndjson'    : NDJSON,
+    'application/jsonlines' : NDJSON
+}
+
+HTTP_HEADER_CONTENT_TYPE = 'content-type'
+
+
+
+def getRecordFormat(content_type):
+    """
+    Return the record format for a content type. Anything which is not JSON is
+    treated as XML, as SGAS has never required a specific content type for it.
+    """
+    if content_type is None:
+        return XML
+    return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower(), XML)
+
+
+
+def _checkRecord(record):
+    if not isinstance(record, dict):
+        raise dberror.InvalidUsageDataError('Record must be a JSON object, not %s' % type(record).__name__)
+    return record
+
+
+def iterJSONRecords(source):
+    """
+    Iterate over the record objects of a JSON document. The source can be a
+    file like object, bytes or a string.
+    """
+    if hasattr(source, 'read'):
+        source = source.read()
+    try:
+        doc = json.loads(source)
+    except ValueError as e:
+        raise dberror.InvalidUsageDataError('Error parsing JSON document (%s)' % str(e))
+
+    if isinstance(doc, dict):
+        doc = [ doc ]
+    if not isinstance(doc, list):
+        raise dberror.InvalidUsageDataError('JSON document must be a list of records')
+    for record in doc:
+        yield _checkRecord(record)
+
+
+def iterNDJSONRecords(source):
+    """
+    Iterate over the record objects of an NDJSON document, one line at a time.
+    Empty lines are skipped.
+    """
+    if isinstance(source, (bytes, str)):
+        source = source.splitlines()
+    elif isinstance(source, io.RawIOBase):
+        source = io.BufferedReader(source)
+
+    for line_no, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise dberror.InvalidUsageDataError('Error parsing NDJSON line %i (%s)' % (line_no, str(e)))
+        yield _checkRecord(record)
+
+
+def iterRecords(source, record_format):
+    if record_format == NDJSON:
+        return iterNDJSONRecords(source)
+    return iterJSONRecords(source)
+
+
+
+class RecordConverter:
+    """
+    Table driven conversion of JSON record objects into insert arguments.
+    The table maps argument names to conversion functions (None meaning the
+    value is used as is). Insert identity, hostname and time are always set by
+    the server, and may not be given in the record.
+    """
+    def __init__(self, arg_list, conversions, required):
+        self.arg_list = arg_list
+        self.slots = dict( [ (name, idx) for idx, name in enumerate(arg_list) ] )
+        self.conversions = conversions
+        self.required = required
+        self.server_slots = [ (self.slots[name], name) for name in ('insert_identity', 'insert_hostname', 'insert_time') ]
+
+
+    def convert(self, record, server_values):
+        args = [ None ] * len(self.arg_list)
+        slots = self.slots
+        conversions = self.conversions
+        for name, value in record.items():
+            slot = slots.get(name)
+            if slot is None or name in server_values:
+                raise dberror.InvalidUsageDataError('Invalid record field: %s' % name)
+            if value is None:
+                continue
+            convert = conversions.get(name)
+            try:
+                args[slot] = convert(value) if convert is not None else value
+            except (TypeError, ValueError, KeyError, AttributeError) as e:
+                raise dberror.InvalidUsageDataError('Invalid value for %s in record %s (%s)' % (name, record.get('record_id'), str(e)))
+
+        for name in self.required:
+            if args[slots[name]] is None:
+                raise dberror.InvalidUsageDataError('Record is missing %s' % name)
+
+        for slot, name in self.server_slots:
+            args[slot] = server_values[name]
+        return args
+
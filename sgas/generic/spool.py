@@ -0,0 +1,408 @@
+"""
+Durable local spool for registrations.
+
+In spool mode, the insert resources validate and authorize the records, write
+the insert arguments to an append-only spool on local disk (fsync'ed), and
+acknowledge the registration. A drain service then moves the spooled records
+into the database in large batches, retrying if the database is unavailable
+or slow. This decouples the registrants from database hiccups (vacuum,
+checkpoints, aggregation locks).
+
+The spool consists of segment files, each containing a number of frames. A
+frame is one registration (a list of insert arguments):
+
+    header: length, crc32, number of records, spool time
+    data:   pickled argument list
+
+The drain position (segment, offset) is stored in a separate file, which is
+updated after each batch has been committed. Records are therefore delivered
+at least once; re-inserting a record is harmless as the insert procedures
+will recognize it as a duplicate.
+"""
+
+import os
+import re
+import time
+import zlib
+import struct
+import pickle
+import threading
+import collections
+
+import psycopg2
+
+from twisted.python import log
+from twisted.internet import defer, reactor, threads
+from twisted.application import service
+
+from sgas.database import error as dberror
+from sgas.server import stats
+
+
+
+# spool options (in the plugin block)
+SPOOL_DIRECTORY     = 'spool_directory'
+SPOOL_SEGMENT_SIZE  = 'spool_segment_size'
+SPOOL_BATCH_SIZE    = 'spool_batch_size'
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024 # bytes
+DEFAULT_BATCH_SIZE   = 5000             # records
+
+FRAME_HEADER        = struct.Struct('!IIId')
+SEGMENT_RX          = re.compile(r'^segment-(\d{8})\.spool$')
+SEGMENT_NAME        = 'segment-%08d.spool'
+POSITION_FILE       = 'drain.position'
+REJECTED_DIRECTORY  = 'rejected'
+
+# drain timing
+IDLE_INTERVAL       = 1     # seconds between checking an empty spool
+MIN_RETRY_DELAY     = 2
+MAX_RETRY_DELAY     = 120
+RATE_WINDOW         = 300   # seconds over which the drain rate is computed
+
+# errors caused by the database being unavailable, these are always retried
+UNAVAILABLE_ERRORS  = (dberror.DatabaseUnavailableError, psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+
+Frame = collections.namedtuple('Frame', ['segment', 'offset', 'length', 'n_records', 'spool_time'])
+
+
+
+class Spool:
+    """
+    Append-only on-disk spool. Appends happen in threads, all state changes
+    are protected by a lock.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.pending = collections.deque() # frames which has not been drained
+        self.pending_records = 0
+        self.write_segment = None
+        self.write_file = None
+        self._recover()
+
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.directory, SEGMENT_NAME % segment)
+
+
+    def _segments(self):
+        segments = []
+        for fn in os.listdir(self.directory):
+            m = SEGMENT_RX.match(fn)
+            if m:
+                segments.append(int(m.group(1)))
+        return sorted(segments)
+
+
+    def _readPosition(self):
+        try:
+            with open(os.path.join(self.directory, POSITION_FILE)) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (IOError, ValueError):
+            return 0, 0
+
+
+    def _writePosition(self, segment, offset):
+        path = os.path.join(self.directory, POSITION_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('%i %i\n' % (segment, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+
+
+    def _recover(self):
+        # scan the segments from the drain position, and build the list of pending frames
+        position_segment, position_offset = self._readPosition()
+        segments = self._segments()
+
+        for segment in segments:
+            path = self._segmentPath(segment)
+            if segment < position_segment:
+                os.unlink(path) # fully drained, but not removed
+                continue
+            offset = position_offset if segment == position_segment else 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    header = f.read(FRAME_HEADER.size)
+                    if len(header) < FRAME_HEADER.size:
+                        break
+                    length, crc, n_records, spool_time = FRAME_HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) < length or zlib.crc32(data) != crc:
+                        # torn write (crash during append), cut the segment here
+                        log.msg('Truncating spool segment %s at offset %i (incomplete frame)' % (path, offset), system='sgas.Spool')
+                        f.close()
+                        with open(path, 'r+b') as tf:
+                            tf.truncate(offset)
+                        break
+                    self.pending.append(Frame(segment, offset, length, n_records, spool_time))
+                    self.pending_records += n_records
+                    offset += FRAME_HEADER.size + length
+
+        self.write_segment = (segments[-1] + 1) if segments else max(1, position_segment)
+        if self.pending:
+            log.msg('Spool %s contains %i records in %i frames' % (self.directory, self.pending_records, len(self.pending)), system='sgas.Spool')
+
+
+    def append(self, arg_list):
+        """
+        Write a list of insert arguments to the spool, and fsync it. Blocks.
+        """
+        data = pickle.dumps(arg_list, pickle.HIGHEST_PROTOCOL)
+        spool_time = time.time()
+        header = FRAME_HEADER.pack(len(data), zlib.crc32(data), len(arg_list), spool_time)
+
+        with self.lock:
+            if self.write_file is None or self.write_file.tell() >= self.segment_size:
+                if self.write_file is not None:
+                    self.write_file.close()
+                    self.write_segment += 1
+                self.write_file = open(self._segmentPath(self.write_segment), 'ab')
+            offset = self.write_file.tell()
+            self.write_file.write(header + data)
+            self.write_file.flush()
+            os.fsync(self.write_file.fileno())
+            self.pending.append(Frame(self.write_segment, offset, len(data), len(arg_list), spool_time))
+            self.pending_records += len(arg_list)
+
+
+    def readBatch(self, max_records):
+        """
+        Return the oldest pending frames (at least one, if any), up to
+        max_records records, as a list of (frame, arg_list). Blocks.
+        """
+        with self.lock:
+            frames = []
+            n_records = 0
+            for frame in self.pending:
+                if frames and n_records + frame.n_records > max_records:
+                    break
+                frames.append(frame)
+                n_records += frame.n_records
+
+        batch = []
+        for frame in frames:
+            with open(self._segmentPath(frame.segment), 'rb') as f:
+                f.seek(frame.offset + FRAME_HEADER.size)
+                batch.append( (frame, pickle.loads(f.read(frame.length))) )
+        return batch
+
+
+    def commit(self, frames):
+        """
+        Mark the given frames (which must be the oldest pending frames) as
+        drained, and remove segments which have been fully drained. Blocks.
+        """
+        with self.lock:
+            for frame in frames:
+                assert self.pending[0] == frame
+                self.pending.popleft()
+                self.pending_records -= frame.n_records
+
+            last = frames[-1]
+            if self.pending:
+                segment, offset = self.pending[0].segment, self.pending[0].offset
+            else:
+                segment, offset = last.segment, last.offset + FRAME_HEADER.size + last.length
+            self._writePosition(segment, offset)
+
+            for old_segment in self._segments():
+                if old_segment < segment:
+                    os.unlink(self._segmentPath(old_segment))
+
+
+    def reject(self, frame, arg_list):
+        """
+        Move a frame which cannot be inserted out of the spool, so it does not
+        block the rest of the spool. Blocks.
+        """
+        rejected_dir = os.path.join(self.directory, REJECTED_DIRECTORY)
+        if not os.path.isdir(rejected_dir):
+            os.makedirs(rejected_dir)
+        path = os.path.join(rejected_dir, 'frame-%08d-%i.pickle' % (frame.segment, frame.offset))
+        with open(path, 'wb') as f:
+            pickle.dump(arg_list, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        self.commit([frame])
+        return path
+
+
+    def depth(self):
+        return self.pending_records
+
+
+    def oldestAge(self):
+        with self.lock:
+            if not self.pending:
+                return 0
+            return time.time() - self.pending[0].spool_time
+
+
+    def close(self):
+        with self.lock:
+            if self.write_file is not None:
+                self.write_file.close()
+                self.write_file = None
+
+
+
+class SpoolDrainer(service.Service):
+    """
+    Service moving records from the spool into the database.
+
+    The insert function is called with a list of insert arguments, and must
+    return a deferred, which fires once they have been committed.
+    """
+
+    def __init__(self, name, spool, insert, batch_size=DEFAULT_BATCH_SIZE):
+        self.name = name
+        self.spool = spool
+        self.insert = insert
+        self.batch_size = batch_size
+        self.drained = collections.deque() # (time, records) within the rate window
+        self.retry_delay = MIN_RETRY_DELAY
+        self.stopping = False
+        self.draining = None
+        self.wakeup = None
+        stats.registerProvider('spool:' + name, self.getStatistics)
+
+
+    def startService(self):
+        service.Service.startService(self)
+        self.stopping = False
+        self.draining = self.drain()
+        return defer.succeed(None)
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.stopping = True
+        self.notify()
+        d = self.draining or defer.succeed(None)
+        d.addBoth(lambda _ : self.spool.close())
+        return d
+
+
+    def notify(self):
+        # called when something has been spooled, cuts idle waiting short
+        if self.wakeup is not None and not self.wakeup.called:
+            self.wakeup.callback(None)
+
+
+    def _wait(self, delay):
+        self.wakeup = defer.Deferred()
+        call = reactor.callLater(delay, self.notify)
+        self.wakeup.addBoth(lambda _ : call.active() and call.cancel())
+        return self.wakeup
+
+
+    def drainRate(self):
+        now = time.time()
+        while self.drained and self.drained[0][0] < now - RATE_WINDOW:
+            self.drained.popleft()
+        return sum( [ n for _, n in self.drained ] ) / float(RATE_WINDOW)
+
+
+    def getStatistics(self):
+        return {
+            'depth'             : self.spool.depth(),
+            'oldest_age'        : round(self.spool.oldestAge(), 1),
+            'drain_rate'        : round(self.drainRate(), 2), # records / second
+            'retry_delay'       : self.retry_delay
+        }
+
+
+    @defer.inlineCallbacks
+    def _spoolError(self, action, e):
+        # errors of the spool itself (I/O errors, full disk, corrupt data). The
+        # registrations stay in the spool, so draining is retried, with backoff
+        log.msg('Error %s spool %s (%s), retrying in %i seconds' % (action, self.name, str(e), self.retry_delay), system='sgas.Spool')
+        yield self._wait(self.retry_delay)
+        self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+
+
+    @defer.inlineCallbacks
+    def drain(self):
+        batch_size = self.batch_size
+
+        while not self.stopping:
+            try:
+                batch = yield threads.deferToThread(self.spool.readBatch, batch_size)
+            except Exception as e:
+                yield self._spoolError('reading', e)
+                continue
+            if not batch:
+                yield self._wait(IDLE_INTERVAL)
+                continue
+
+            frames = [ frame for frame, _ in batch ]
+            arg_list = [ args for _, frame_args in batch for args in frame_args ]
+            try:
+                result = yield self.insert(arg_list)
+            except UNAVAILABLE_ERRORS as e:
+                log.msg('Database unavailable while draining spool %s (%s), retrying in %i seconds' % (self.name, str(e), self.retry_delay), system='sgas.Spool')
+                yield self._wait(self.retry_delay)
+                self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+                continue
+            except Exception as e:
+                if len(batch) > 1:
+                    # find the offending registration by inserting them one by one
+                    log.msg('Error draining spool %s (%s), retrying registrations individually' % (self.name, str(e)), system='sgas.Spool')
+                    batch_size = 1
+                    continue
+                try:
+                    path = yield threads.deferToThread(self.spool.reject, frames[0], arg_list)
+                except Exception as reject_error:
+                    yield self._spoolError('rejecting registration in', reject_error)
+                    continue
+                log.msg('Could not insert spooled registration (%s), moved to %s' % (str(e), path), system='sgas.Spool')
+                continue
+
+            for record_id, reason in getattr(result, 'rejected', {}).items():
+                log.msg('Spooled record %s from %s was rejected: %s' % (record_id, self.name, reason), system='sgas.Spool')
+            try:
+                yield threads.deferToThread(self.spool.commit, frames)
+            except Exception as e:
+                # the batch is read and inserted again, which is harmless
+                yield self._spoolError('committing', e)
+                continue
+            self.drained.append( (time.time(), len(arg_list)) )
+            self.retry_delay = MIN_RETRY_DELAY
+            batch_size = self.batch_size
+
+
+
+def createSpool(cfg, cfg_block, name, insert):
+    """
+    Create spool and drainer from the options in a plugin block. Returns
+    (spool, drainer) or (None, None) if spooling is not configured.
+    """
+    if not cfg.has_option(cfg_block, SPOOL_DIRECTORY):
+        return None, None
+
+    segment_size = DEFAULT_SEGMENT_SIZE
+    if cfg.has_option(cfg_block, SPOOL_SEGMENT_SIZE):
+        segment_size = cfg.getint(cfg_block, SPOOL_SEGMENT_SIZE)
+    batch_size = DEFAULT_BATCH_SIZE
+    if cfg.has_option(cfg_block, SPOOL_BATCH_SIZE):
+        batch_size = cfg.getint(cfg_block, SPOOL_BATCH_SIZE)
+
+    spool = Spool(cfg.get(cfg_block, SPOOL_DIRECTORY), segment_size)
+    drainer = SpoolDrainer(name, spool, insert, batch_size)
+    log.msg('Spooling %s registrations in %s' % (name, spool.directory), system='sgas.Setup')
+    return spool, drainer
+
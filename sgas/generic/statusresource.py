@@ -0,0 +1,55 @@
+"""
+Resource for exposing runtime statistics (spool depth, cache hit ratios,
+etc.) from SGAS as JSON.
+"""
+
+from twisted.web import resource
+
+from sgas.ext.python import json
+from sgas.authz import ctxsetchecker
+from sgas.server import resourceutil, stats
+
+
+
+JSON_MIME_TYPE = 'application/json'
+HTTP_HEADER_CONTENT_TYPE   = 'content-type'
+
+ACTION_STATUS          = 'status'
+
+
+class StatusResource(resource.Resource):
+
+    PLUGIN_ID   = 'status'
+    PLUGIN_NAME = 'Status'
+
+    isLeaf = True
+
+    def __init__(self, cfg, db, authorizer):
+        resource.Resource.__init__(self)
+        self.db = db
+        self.authorizer = authorizer
+        authorizer.addChecker(ACTION_STATUS, ctxsetchecker.AlwaysAllowedContextChecker)
+        authorizer.rights.addActions(ACTION_STATUS)
+        authorizer.rights.addOptions(ACTION_STATUS,[])
+        authorizer.rights.addContexts(ACTION_STATUS,[])
+
+
+    def render_GET(self, request):
+
+        subject = resourceutil.getSubject(request)
+        if not self.authorizer.isAllowed(subject, ACTION_STATUS, () ):
+            request.setResponseCode(403) # forbidden
+            return ("Status not allowed for %s" % subject).encode('utf-8')
+        # request allowed, continue
+
+        status = stats.collect()
+        if request.postpath and request.postpath[0]:
+            name = request.postpath[0].decode('utf-8')
+            if not name in status:
+                request.setResponseCode(404)
+                return ('No status for %s' % name).encode('utf-8')
+            status = status[name]
+
+        request.setHeader(HTTP_HEADER_CONTENT_TYPE, JSON_MIME_TYPE)
+        return json.dumps(status).encode('utf-8')
+
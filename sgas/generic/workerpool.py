@@ -0,0 +1,118 @@
+"""
+Bounded worker pool for CPU heavy work, e.g., parsing registrations.
+
+Parsing and converting a large batch of records can take seconds, and must
+therefore not be done in the reactor thread, where it blocks every other
+request. The pool runs such work either in a dedicated (bounded) thread pool,
+or in a pool of worker processes. Threads keep the reactor responsive, but
+share the GIL with it, so only processes give real parallelism on multi-core
+hosts. Work submitted to a process pool must be a module level function, and
+its arguments and results must be picklable.
+"""
+
+import multiprocessing
+from concurrent import futures
+
+from twisted.python import log, threadpool
+from twisted.internet import defer, reactor, threads
+from twisted.application import service
+
+from sgas.server.config import ConfigurationError
+
+
+# worker pool options (in the plugin block)
+PARSE_WORKERS       = 'parse_workers'
+PARSE_WORKER_TYPE   = 'parse_worker_type'
+
+WORKER_THREAD       = 'thread'
+WORKER_PROCESS      = 'process'
+
+DEFAULT_WORKERS     = 2
+DEFAULT_WORKER_TYPE = WORKER_THREAD
+
+
+
+class WorkerPool(service.Service):
+
+    def __init__(self, name, workers=DEFAULT_WORKERS, worker_type=DEFAULT_WORKER_TYPE):
+        if worker_type not in (WORKER_THREAD, WORKER_PROCESS):
+            raise ValueError('Invalid worker type: %s' % worker_type)
+        self.name = name
+        self.workers = workers
+        self.worker_type = worker_type
+        self.thread_pool = None
+        self.process_pool = None
+
+
+    def startService(self):
+        service.Service.startService(self)
+        if self.worker_type == WORKER_THREAD:
+            self.thread_pool = threadpool.ThreadPool(1, self.workers, name='sgas-' + self.name)
+            self.thread_pool.start()
+        else:
+            # spawned workers do not inherit the reactor and database threads
+            context = multiprocessing.get_context('spawn')
+            self.process_pool = futures.ProcessPoolExecutor(self.workers, mp_context=context)
+        log.msg('Started %s worker pool (%i %s workers)' % (self.name, self.workers, self.worker_type), system='sgas.WorkerPool')
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.thread_pool is not None:
+            # stopping the thread pool blocks until running work is done
+            d = threads.deferToThread(self.thread_pool.stop)
+            self.thread_pool = None
+            return d
+        if self.process_pool is not None:
+            d = threads.deferToThread(self.process_pool.shutdown)
+            self.process_pool = None
+            return d
+
+
+    def _futureToDeferred(self, future):
+        d = defer.Deferred()
+
+        def fire(future):
+            if future.cancelled():
+                d.errback(defer.CancelledError())
+            elif future.exception() is not None:
+                d.errback(future.exception())
+            else:
+                d.callback(future.result())
+
+        future.add_done_callback(lambda f : reactor.callFromThread(fire, f))
+        return d
+
+
+    def submit(self, f, *args, **kwargs):
+        """
+        Run f(*args, **kwargs) in the pool. Returns a deferred firing with the
+        result. If the pool is not running, f is called directly.
+        """
+        if self.thread_pool is not None:
+            return threads.deferToThreadPool(reactor, self.thread_pool, f, *args, **kwargs)
+        if self.process_pool is not None:
+            return self._futureToDeferred(self.process_pool.submit(f, *args, **kwargs))
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+
+def createWorkerPool(cfg, cfg_block, name):
+    """
+    Create worker pool from the options in a plugin block. Returns None if
+    the number of workers is set to 0, i.e., work is done in the reactor.
+    """
+    workers = DEFAULT_WORKERS
+    if cfg.has_option(cfg_block, PARSE_WORKERS):
+        workers = cfg.getint(cfg_block, PARSE_WORKERS)
+    worker_type = DEFAULT_WORKER_TYPE
+    if cfg.has_option(cfg_block, PARSE_WORKER_TYPE):
+        worker_type = cfg.get(cfg_block, PARSE_WORKER_TYPE).strip().lower()
+
+    if worker_type not in (WORKER_THREAD, WORKER_PROCESS):
+        raise ConfigurationError('Invalid %s in %s: %s' % (PARSE_WORKER_TYPE, cfg_block, worker_type))
+
+    if workers <= 0:
+        return None
+    return WorkerPool(name, workers, worker_type)
+
@@ -16,6 +16,9 @@ from twisted.application import service
 
 
 INSERT_HOST_SCALE_FACTOR   = '''INSERT INTO hostscalefactors (machine_name, scale_factor) VALUES (%s, %s)'''
+# the per-day cache is refreshed on changes, refreshing it at startup as well
+# keeps open ended validity periods expanded a year ahead
+REFRESH_SCALE_FACTOR_CACHE = '''REFRESH MATERIALIZED VIEW hostscalefactors_daily'''
 
 # scale options
 SCALE_BLOCK      = 'hostscaling'
@@ -143,3 +146,5 @@ class HostScaleFactorUpdater(service.Service):
 
         else:
             log.msg("No default_scale_factor_type set")
+
+        txn.execute(REFRESH_SCALE_FACTOR_CACHE)
@@ -3,11 +3,19 @@ Query builder SGAS queryengine.
 
 Used for creating SQL query from a set of query arguments.
 
+Queries with month or collapse resolution over whole months are answered from
+the monthly rollup of the aggregated data (uraggregated_monthly), as it has far
+fewer rows than the daily aggregated data.
+
 Author: Henrik Thostrup Jensen <htj@ndgf.org>
 Copyright: Nordic Data Grid Facility (2010)
 """
 
 
+AGGREGATED_TABLE = 'uraggregated'
+MONTHLY_TABLE    = 'uraggregated_monthly'
+
+
 
 def buildQuery(query_args):
 
@@ -20,7 +28,8 @@ def buildQuery(query_args):
 
     assert time_resolution in ['day', 'month', 'collapse'], 'Invalid time resolution specified'
 
-    date_extract, date_grouping = _getStartEndDatesAndGrouping(query_args)
+    monthly = _useMonthlyRollup(query_args)
+    date_extract, date_grouping = _getStartEndDatesAndGrouping(query_args, monthly)
 
     query_args = [] # RENAME me!
 
@@ -28,7 +37,7 @@ def buildQuery(query_args):
     query += date_extract
 
     query += "sum(n_jobs), sum(cputime), sum(walltime) "
-    query += "FROM uraggregated "
+    query += "FROM %s " % (MONTHLY_TABLE if monthly else AGGREGATED_TABLE)
     query += "WHERE execution_time >= %s AND execution_time < %s "
     query_args.append(start_date)
     query_args.append(end_date)
@@ -57,7 +66,21 @@ def buildQuery(query_args):
 
 
 
-def _getStartEndDatesAndGrouping(query_args):
+def _isMonthStart(date):
+    # dates are in iso format (YYYY-MM-DD)
+    return date is not None and date.endswith('-01') and len(date) == 10
+
+
+
+def _useMonthlyRollup(query_args):
+    # the end date is exclusive, so a range from the first day of one month to
+    # the first day of another covers whole months
+    return query_args.get('time_resolution') in ('month', 'collapse') and \
+           _isMonthStart(query_args.get('start_date')) and _isMonthStart(query_args.get('end_date'))
+
+
+
+def _getStartEndDatesAndGrouping(query_args, monthly=False):
 
     time_resolution = query_args.get('time_resolution')
 
@@ -78,6 +101,11 @@ def _getStartEndDatesAndGrouping(query_args):
                 # last line for getting the last day of the month
         group = "date_part('year', execution_time) || '-' || date_part('month', execution_time),"
 
+    elif time_resolution == 'collapse' and monthly:
+        # execution_time is the first day of the month in the monthly rollup
+        dates = "min(first_execution_time), max(last_execution_time), "
+        group = ''
+
     elif time_resolution == 'collapse':
         dates = "min(execution_time), max(execution_time), "
         group = ''
@@ -0,0 +1,99 @@
+"""
+Result cache for the query interface.
+
+The same queries are sent again and again (monitoring, dashboards, clients
+polling for their usage), while the answer only changes when the aggregated
+data is updated. The cache keeps the serialized JSON answers of recent
+queries, together with the generation of the aggregated data they were
+computed from. The database generation is increased by the aggregation
+updater whenever it has changed the aggregated data, which makes all cached
+answers stale at once, so there is no need to guess a lifetime.
+
+The cache is bounded both in entries and in bytes, the least recently used
+answers are evicted first.
+"""
+
+import collections
+
+
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES   = 64 * 1024 * 1024
+
+
+
+def cacheKey(query_args):
+    """
+    Return a cache key for the (parsed) query arguments. Arguments giving the
+    same answer, e.g., the same machine names in a different order, give the
+    same key.
+    """
+    key = []
+    for name, value in sorted(query_args.items()):
+        if isinstance(value, (list, tuple)):
+            value = tuple(sorted(set(value)))
+        key.append( (name, value) )
+    return tuple(key)
+
+
+
+class QueryCache:
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict() # key -> (generation, payload)
+        self.size = 0 # bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+
+    def _remove(self, key):
+        _, payload = self.entries.pop(key)
+        self.size -= len(payload)
+
+
+    def lookup(self, key, generation):
+        """
+        Return the cached payload for key, if it was computed from the given
+        generation of the aggregated data, otherwise None.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == generation:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._remove(key)
+            self.stale += 1
+        self.misses += 1
+        return None
+
+
+    def store(self, key, generation, payload):
+        if len(payload) > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (generation, payload)
+        self.size += len(payload)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+
+    def getStatistics(self):
+        total = self.hits + self.misses
+        return {
+            'entries'   : len(self.entries),
+            'bytes'     : self.size,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'stale'     : self.stale,
+            'evictions' : self.evictions,
+            'hit_ratio' : round(float(self.hits) / total, 3) if total else 0.0
+        }
+
@@ -8,12 +8,15 @@ Copyright: Nordic Data Grid Facility (2010)
 """
 
 from twisted.python import log
+from twisted.internet import defer
 from twisted.web import resource, server
 
 from sgas.ext.python import json
 from sgas.authz import rights, ctxsetchecker
-from sgas.server import resourceutil
-from sgas.queryengine import parser as queryparser, builder as querybuilder, rowrp as queryrowrp
+from sgas.server import resourceutil, stats, jsonstream
+from sgas.database import error as dberror
+from sgas.database.postgresql import database
+from sgas.queryengine import parser as queryparser, builder as querybuilder, rowrp as queryrowrp, querycache
 
 
 
@@ -25,6 +28,15 @@ CTX_MACHINE_NAME    = 'machine_name'
 CTX_USER_IDENTITY   = 'user_identity'
 CTX_VO_NAME         = 'vo_name'
 
+# cache and streaming options
+PLUGIN_CFG_BLOCK    = 'plugin:query'
+QUERY_CACHE_SIZE    = 'query_cache_size'
+QUERY_CACHE_BYTES   = 'query_cache_bytes'
+STREAMING           = 'streaming'
+STREAMING_BATCH_SIZE = 'streaming_batch_size'
+STATEMENT_TIMEOUT   = 'statement_timeout'
+
+
 class QueryResource(resource.Resource):
     
     PLUGIN_ID   = 'query'
@@ -42,13 +54,49 @@ class QueryResource(resource.Resource):
         authorizer.rights.addOptions(ACTION_QUERY,[rights.OPTION_ALL])
         authorizer.rights.addContexts(ACTION_QUERY,[CTX_MACHINE_NAME, CTX_USER_IDENTITY, CTX_VO_NAME])
 
+        # result cache, invalidated by the aggregation updater
+        cache_size = querycache.DEFAULT_MAX_ENTRIES
+        if cfg.has_option(PLUGIN_CFG_BLOCK, QUERY_CACHE_SIZE):
+            cache_size = cfg.getint(PLUGIN_CFG_BLOCK, QUERY_CACHE_SIZE)
+        cache_bytes = querycache.DEFAULT_MAX_BYTES
+        if cfg.has_option(PLUGIN_CFG_BLOCK, QUERY_CACHE_BYTES):
+            cache_bytes = cfg.getint(PLUGIN_CFG_BLOCK, QUERY_CACHE_BYTES)
+        if cache_size > 0 and db.read_replica:
+            # the generation is increased when the primary has been updated, so a
+            # lagging replica could return the old data, which would be cached
+            log.msg('Query result cache disabled, as queries are read from a replica (db_read)', system='sgas.QueryResource')
+            cache_size = 0
+        self.cache = None
+        if cache_size > 0:
+            self.cache = querycache.QueryCache(cache_size, cache_bytes)
+            stats.registerProvider('querycache', self.cache.getStatistics)
+
+        # stream results from a server-side cursor, instead of building them in memory
+        self.streaming = False
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STREAMING):
+            self.streaming = cfg.getboolean(PLUGIN_CFG_BLOCK, STREAMING)
+        self.streaming_batch_size = database.DEFAULT_STREAM_BATCH_SIZE
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STREAMING_BATCH_SIZE):
+            self.streaming_batch_size = cfg.getint(PLUGIN_CFG_BLOCK, STREAMING_BATCH_SIZE)
+
+        # queries running for longer are cancelled by the database, e.g., '30s'
+        self.statement_timeout = None
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STATEMENT_TIMEOUT):
+            self.statement_timeout = cfg.get(PLUGIN_CFG_BLOCK, STATEMENT_TIMEOUT)
+
 
     def queryDatabase(self, query_args):
         query, query_args = querybuilder.buildQuery(query_args)
-        d = self.db.query(query, query_args)
+        d = self.db.query(query, query_args, statement_timeout=self.statement_timeout, coalesce=True)
         return d
 
 
+    def streamDatabase(self, query_args, rowsReceived):
+        query, query_args = querybuilder.buildQuery(query_args)
+        return self.db.streamquery(query, query_args, rowsReceived, batch_size=self.streaming_batch_size,
+                                   statement_timeout=self.statement_timeout)
+
+
     def render_GET(self, request):
         try:
             query_args = queryparser.parseURLArguments(request.args)
@@ -65,32 +113,78 @@ class QueryResource(resource.Resource):
             return "Query not allowed for given context for identity %s" % subject
         # request allowed, continue
 
-        hostname = resourceutil.getHostname(request)
-        log.msg('Accepted query request from %s' % hostname, system='sgas.QueryResource')
+        d = resourceutil.getHostname(request)
+        d.addCallback(lambda hostname : log.msg('Accepted query request from %s' % hostname, system='sgas.QueryResource'))
+
+        # the generation is taken before querying, so a result computed while
+        # the aggregated data changes is stale right away
+        cache_key = querycache.cacheKey(query_args)
+        generation = self.db.aggregation_generation
+        if self.cache is not None:
+            payload = self.cache.lookup(cache_key, generation)
+            if payload is not None:
+                request.setHeader(HTTP_HEADER_CONTENT_TYPE, JSON_MIME_TYPE)
+                return payload
+
+        if self.streaming:
+            return self.renderStream(request, query_args, cache_key, generation)
 
         def gotDatabaseResult(rows):
             records = queryrowrp.buildDictRecords(rows, query_args)
-            payload = json.dumps(records)
+            payload = json.dumps(records).encode('utf-8')
+            if self.cache is not None:
+                self.cache.store(cache_key, generation, payload)
             request.setHeader(HTTP_HEADER_CONTENT_TYPE, JSON_MIME_TYPE)
             request.write(payload)
             request.finish()
 
         def queryError(error):
-            log.msg('Queryengine error: %s' % str(error), system='sgas.QueryResource')
-            log.msg('Queryengine error args' % str(query_args), system='sgas.QueryResource')
-            request.setResponseCode(500)
-            request.write('Queryengine error (%s)' % str(error), system='sgas.QueryResource')
+            if error.check(defer.CancelledError):
+                log.msg('Client disconnected, query cancelled', system='sgas.QueryResource')
+                return
+            log.msg('Queryengine error: %s' % str(error.value), system='sgas.QueryResource')
+            log.msg('Queryengine error args: %s' % str(query_args), system='sgas.QueryResource')
+            if error.check(dberror.QueryTimeoutError):
+                request.setResponseCode(504)
+            else:
+                request.setResponseCode(500)
+            request.write(('Queryengine error (%s)' % str(error.value)).encode('utf-8'))
             request.finish()
 
         def resultHandlingError(error):
-            log.msg('Query result error: %s' % str(error), system='sgas.QueryResource')
-            log.msg('Query result error args' % str(query_args), system='sgas.QueryResource')
+            log.msg('Query result error: %s' % str(error.value), system='sgas.QueryResource')
+            log.msg('Query result error args: %s' % str(query_args), system='sgas.QueryResource')
             request.setResponseCode(500)
-            request.write('Query result error (%s)' % str(error), system='sgas.QueryResource')
+            request.write(('Query result error (%s)' % str(error.value)).encode('utf-8'))
             request.finish()
 
         d = self.queryDatabase(query_args)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallbacks(gotDatabaseResult, queryError)
         d.addErrback(resultHandlingError)
         return server.NOT_DONE_YET
 
+
+    def renderStream(self, request, query_args, cache_key, generation):
+
+        collect_bytes = self.cache.max_bytes if self.cache is not None else 0
+        stream = jsonstream.JSONStream(request, queryrowrp.buildDictRecord, collect_bytes)
+
+        def streamDone(n_rows):
+            payload = stream.finish()
+            if self.cache is not None and payload is not None:
+                self.cache.store(cache_key, generation, payload)
+
+        def streamError(error):
+            if error.check(jsonstream.StreamStopped, defer.CancelledError):
+                log.msg('Client disconnected during query', system='sgas.QueryResource')
+            else:
+                log.msg('Queryengine error: %s' % str(error.value), system='sgas.QueryResource')
+                log.msg('Queryengine error args: %s' % str(query_args), system='sgas.QueryResource')
+            stream.fail('Queryengine error (%s)' % str(error.value))
+
+        d = self.streamDatabase(query_args, stream.writeRows)
+        resourceutil.cancelOnDisconnect(request, d)
+        d.addCallbacks(streamDone, streamError)
+        d.addErrback(lambda error : log.msg('Query result error: %s' % str(error.value), system='sgas.QueryResource'))
+        return server.NOT_DONE_YET
@@ -25,6 +25,7 @@ SERVER_BLOCK         = 'server'
 DB                   = 'db'
 AUTHZ_FILE           = 'authzfile'
 HOSTNAME_CHECK_DEPTH = 'check_depth'
+AUTHZ_LOG            = 'authz_log'
 
 # the following are no longer used, but are used to issue warnings
 HOSTKEY              = 'hostkey'
@@ -0,0 +1,163 @@
+"""
+Non-blocking, cached reverse DNS lookups of client addresses.
+
+When running behind a reverse proxy, the client address is given by the
+proxy (X-Forwarded-For), and is resolved into a hostname for logging and for
+the insert hostname of the records. The resolver library call blocks, so the
+lookups are done in a thread, and the results (including failed lookups) are
+cached, so each address is looked up at most once per TTL. Lookups which take
+longer than the timeout are answered with the address, the lookup itself is
+allowed to complete, and its result is cached for the following requests.
+"""
+
+import time
+import socket
+
+from twisted.python import log
+from twisted.internet import defer, reactor, threads
+
+from sgas.server import config, stats
+
+
+# resolver options (in the server block)
+HOSTNAME_CACHE_TTL      = 'hostname_cache_ttl'
+HOSTNAME_NEGATIVE_TTL   = 'hostname_negative_ttl'
+HOSTNAME_LOOKUP_TIMEOUT = 'hostname_lookup_timeout'
+
+DEFAULT_CACHE_TTL       = 3600  # seconds
+DEFAULT_NEGATIVE_TTL    = 300   # seconds
+DEFAULT_LOOKUP_TIMEOUT  = 1.0   # seconds
+DEFAULT_CACHE_SIZE      = 10000 # addresses
+
+
+
+def _lookup(addr):
+    # runs in a thread
+    return socket.gethostbyaddr(addr)[0]
+
+
+
+class HostnameResolver:
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 timeout=DEFAULT_LOOKUP_TIMEOUT, cache_size=DEFAULT_CACHE_SIZE,
+                 lookup=_lookup, clock=reactor):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.lookup = lookup
+        self.clock = clock
+
+        self.cache = {}   # addr -> (hostname, expire time)
+        self.pending = {} # addr -> list of waiting deferreds
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.timeouts = 0
+
+
+    def _store(self, addr, hostname, ttl):
+        if len(self.cache) >= self.cache_size and addr not in self.cache:
+            # drop expired entries first, and if that is not enough, everything
+            now = time.time()
+            for a in [ a for a, (_, expire) in self.cache.items() if expire <= now ]:
+                del self.cache[a]
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+        self.cache[addr] = (hostname, time.time() + ttl)
+
+
+    def _lookupDone(self, hostname, addr):
+        self._store(addr, hostname, self.ttl)
+        self._fire(addr, hostname)
+
+
+    def _lookupFailed(self, failure, addr):
+        self.failures += 1
+        log.msg('Error performing reverse lookup of %s: %s' % (addr, failure.getErrorMessage()), system='sgas.HostnameResolver')
+        # negative caching, the address is used as hostname until the entry expires
+        self._store(addr, addr, self.negative_ttl)
+        self._fire(addr, addr)
+
+
+    def _fire(self, addr, hostname):
+        for d in self.pending.pop(addr, []):
+            if not d.called:
+                d.callback(hostname)
+
+
+    def _timedOut(self, d, addr):
+        if not d.called:
+            self.timeouts += 1
+            log.msg('Reverse lookup of %s timed out, using address' % addr, system='sgas.HostnameResolver')
+            d.callback(addr)
+
+
+    def resolve(self, addr):
+        """
+        Return a deferred firing with the hostname of addr, or addr itself if
+        it could not be resolved (in time). The deferred never errbacks.
+        """
+        entry = self.cache.get(addr)
+        if entry is not None and entry[1] > time.time():
+            self.hits += 1
+            return defer.succeed(entry[0])
+
+        self.misses += 1
+        d = defer.Deferred()
+        if self.timeout:
+            call = self.clock.callLater(self.timeout, self._timedOut, d, addr)
+
+            def cancelTimeout(result):
+                if call.active():
+                    call.cancel()
+                return result
+
+            d.addBoth(cancelTimeout)
+
+        if addr in self.pending:
+            # lookup already in progress, wait for that one
+            self.pending[addr].append(d)
+        else:
+            self.pending[addr] = [ d ]
+            ld = threads.deferToThread(self.lookup, addr)
+            ld.addCallbacks(self._lookupDone, self._lookupFailed, callbackArgs=(addr,), errbackArgs=(addr,))
+        return d
+
+
+    def getStatistics(self):
+        lookups = self.hits + self.misses
+        return {
+            'cached'        : len(self.cache),
+            'pending'       : len(self.pending),
+            'hits'          : self.hits,
+            'misses'        : self.misses,
+            'failures'      : self.failures,
+            'timeouts'      : self.timeouts,
+            'hit_ratio'     : round(float(self.hits) / lookups, 3) if lookups else None
+        }
+
+
+
+resolver = HostnameResolver()
+
+
+def configureResolver(cfg):
+    """
+    Set the resolver options from the server block, and register the resolver
+    statistics.
+    """
+    global resolver
+    options = {}
+    for option, key in [ (HOSTNAME_CACHE_TTL, 'ttl'), (HOSTNAME_NEGATIVE_TTL, 'negative_ttl') ]:
+        if cfg.has_option(config.SERVER_BLOCK, option):
+            options[key] = cfg.getint(config.SERVER_BLOCK, option)
+    if cfg.has_option(config.SERVER_BLOCK, HOSTNAME_LOOKUP_TIMEOUT):
+        options['timeout'] = cfg.getfloat(config.SERVER_BLOCK, HOSTNAME_LOOKUP_TIMEOUT)
+
+    resolver = HostnameResolver(**options)
+    stats.registerProvider('hostnames', resolver.getStatistics)
+    return resolver
+
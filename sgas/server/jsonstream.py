@@ -0,0 +1,133 @@
+"""
+Streaming of JSON lists in HTTP responses.
+
+Used for query results which are too large to build in memory. The rows are
+written to the response as a JSON list, batch by batch as they arrive from the
+database (see PostgreSQLDatabase.streamquery), using chunked transfer encoding.
+The stream is a push producer of the response: when the client does not keep
+up, the transport pauses it, and the next batch is not fetched from the
+database until the transport has drained.
+"""
+
+from zope.interface import implementer
+
+from twisted.python import log
+from twisted.internet import defer, interfaces
+
+from sgas.ext.python import json
+
+
+
+JSON_MIME_TYPE = 'application/json'
+HTTP_HEADER_CONTENT_TYPE = 'content-type'
+
+
+
+class StreamStopped(Exception):
+    """
+    Raised when rows are written to a stream whose client has disconnected.
+    """
+
+
+
+@implementer(interfaces.IPushProducer)
+class JSONStream:
+
+    def __init__(self, request, encode=None, collect_bytes=0):
+        """
+        Rows are passed through encode (if given) before being serialized. If
+        collect_bytes is given, the response is also kept, and returned by
+        finish, if it does not exceed collect_bytes.
+        """
+        self.request = request
+        self.encode = encode
+        self.collect_bytes = collect_bytes
+
+        self.started = False
+        self.stopped = False
+        self.paused = None # deferred firing when resumed
+        self.chunks = []
+        self.size = 0
+
+        request.registerProducer(self, True)
+        request.notifyFinish().addErrback(lambda _ : self.stopProducing())
+
+
+    def pauseProducing(self):
+        if self.paused is None:
+            self.paused = defer.Deferred()
+
+
+    def resumeProducing(self):
+        d, self.paused = self.paused, None
+        if d is not None:
+            d.callback(None)
+
+
+    def stopProducing(self):
+        self.stopped = True
+        d, self.paused = self.paused, None
+        if d is not None:
+            d.errback(StreamStopped('Client connection lost'))
+
+
+    def _write(self, data):
+        self.size += len(data)
+        if self.size <= self.collect_bytes:
+            self.chunks.append(data)
+        self.request.write(data)
+
+
+    def writeRows(self, rows):
+        """
+        Write a batch of rows to the response. Returns a deferred which fires
+        when the transport is ready for more, if it is not.
+        """
+        if self.stopped:
+            raise StreamStopped('Client connection lost')
+        if self.encode is not None:
+            rows = [ self.encode(row) for row in rows ]
+        data = ','.join( [ json.dumps(row) for row in rows ] )
+        if self.started:
+            data = ',' + data
+        else:
+            self.request.setHeader(HTTP_HEADER_CONTENT_TYPE, JSON_MIME_TYPE)
+            data = '[' + data
+            self.started = True
+        self._write(data.encode('utf-8'))
+        return self.paused
+
+
+    def finish(self):
+        """
+        End the list and the response. Returns the whole response, if it was
+        collected.
+        """
+        if not self.started:
+            self.request.setHeader(HTTP_HEADER_CONTENT_TYPE, JSON_MIME_TYPE)
+        self._write(b']' if self.started else b'[]')
+        self.request.unregisterProducer()
+        if not self.stopped:
+            self.request.finish()
+        if self.size <= self.collect_bytes:
+            return b''.join(self.chunks)
+        return None
+
+
+    def fail(self, message):
+        """
+        End the response after an error. Before anything has been written, the
+        response is an error (500), after that the connection is closed, so the
+        client gets an incomplete list, instead of a valid, but partial, one.
+        """
+        self.request.unregisterProducer()
+        if self.stopped:
+            return
+        if self.started:
+            log.msg('Closing connection after error in streamed response', system='sgas.JSONStream')
+            self.request.loseConnection()
+        else:
+            self.request.setResponseCode(500)
+            self.request.write(message.encode('utf-8'))
+            self.request.finish()
+
@@ -3,10 +3,10 @@ HTTP server resource utilities.
 """
 
 import re
-import socket
 
-from twisted.python import log
+from twisted.internet import defer
 
+from sgas.server import hostresolver
 from sgas.server.util import has_headers, get_headers
 
 
@@ -34,31 +34,37 @@ def getSubject(request):
 
 def getHostname(request):
     """
-    Utility method for getting hostname of client.
+    Utility method for getting hostname of client. Returns a deferred, as the
+    hostname may have to be looked up (see hostresolver).
     """
     if request.getClientIP() in LOOPBACK_ADDRESSES and has_headers(request, X_FORWARDED_FOR):
         # nginx typically returns ip addresses
         addr = get_headers(request, X_FORWARDED_FOR)
         if isIPAddress(addr):
-            # we really shouldn't do such blocking calls in twisted,
-            # but the twisted dns interface is rather terrible and
-            # odd things happen when using it
-            # Set timeout to 1 second to limit the possible damage
-            try:
-                socket.setdefaulttimeout(1)
-                info = socket.gethostbyaddr(addr)
-                return info[0]
-            except socket.error as msg:
-                log.msg("Error performing reverse lookup: %s" % msg)
-                return addr
+            return hostresolver.resolver.resolve(addr)
         else:
-            addr
+            return defer.succeed(addr)
 
     else:
         hostname = request.getClient()
         if hostname is None:
             hostname = request.getClientIP()
-        return hostname
+        return defer.succeed(hostname)
+
+
+def cancelOnDisconnect(request, d):
+    """
+    Cancel the deferred d (typically a database query) if the client
+    disconnects before it has fired, so the database does not keep working on
+    a result no one will receive. Errbacks of d will see CancelledError, and
+    should not write to the request. Returns d.
+    """
+    def disconnected(_):
+        if not d.called:
+            d.cancel()
+
+    request.notifyFinish().addErrback(disconnected)
+    return d
 
 
 def getCN(dn):
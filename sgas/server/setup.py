@@ -2,13 +2,15 @@
 Server-setup logic
 """
 import time
+import signal
 
+from twisted.internet import reactor
 from twisted.application import internet, service
 from twisted.web import resource, server
 
 from sgas import __version__
 from sgas.authz import engine
-from sgas.server import config, messages, topresource, loadclass
+from sgas.server import config, messages, topresource, loadclass, hostresolver
 from sgas.database.postgresql import database as pgdatabase
 
 
@@ -83,13 +85,23 @@ def createSGASServer(config_file=DEFAULT_CONFIG_FILE, no_authz=False, port=None)
         from test import utils
         authorizer = utils.FakeAuthorizer()
     else:
-        authorizer = engine.AuthorizationEngine(check_depth, cfg.get(config.SERVER_BLOCK, config.AUTHZ_FILE))
+        authz_log = engine.LOG_ALL
+        if cfg.has_option(config.SERVER_BLOCK, config.AUTHZ_LOG):
+            authz_log = cfg.get(config.SERVER_BLOCK, config.AUTHZ_LOG).strip().lower()
+            if authz_log not in engine.LOG_MODES:
+                raise ConfigurationError('Invalid authz_log value: %s (must be one of %s)' % (authz_log, ', '.join(engine.LOG_MODES)))
+        authorizer = engine.AuthorizationEngine(check_depth, cfg.get(config.SERVER_BLOCK, config.AUTHZ_FILE), authz_log)
+        # reload the authz file on SIGHUP
+        signal.signal(signal.SIGHUP, lambda signum, frame : reactor.callFromThread(authorizer.reloadAuthzFile))
+
+    # reverse lookups of forwarded client addresses
+    hostresolver.configureResolver(cfg)
 
     # database
     db_url = cfg.get(config.SERVER_BLOCK, config.DB)
     if db_url.startswith('http'):
         raise ConfigurationError('CouchDB no longer supported. Please upgrade to PostgreSQL')
-    db = pgdatabase.PostgreSQLDatabase(db_url)
+    db = pgdatabase.createDatabase(cfg)
 
     # hs.setServiceParent(db)
 
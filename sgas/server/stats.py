@@ -0,0 +1,35 @@
+"""
+Registry for runtime statistics.
+
+Components (spool, caches, updaters, etc.) register a provider, which is a
+function returning a dictionary of values. The status resource collects the
+values of all providers and renders them as JSON.
+"""
+
+from twisted.python import log
+
+
+
+_providers = {}
+
+
+def registerProvider(name, provider):
+    if name in _providers:
+        log.msg('Replacing statistics provider %s' % name, system='sgas.Stats')
+    _providers[name] = provider
+
+
+def unregisterProvider(name):
+    _providers.pop(name, None)
+
+
+def collect():
+    stats = {}
+    for name, provider in sorted(_providers.items()):
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            log.msg('Error collecting statistics from %s: %s' % (name, str(e)), system='sgas.Stats')
+            stats[name] = { 'error' : str(e) }
+    return stats
+
@@ -25,12 +25,15 @@ class TopResource(resource.Resource):
         resource.Resource.__init__(self)
         self.authorizer = authorizer
         self.services = {}
+        self.content_encodings = {}
 
 
     def registerService(self, resource, resource_path, service_specs):
 
         for service_name, path_template in service_specs:
             self.services[service_name] = path_template
+            # compressed request bodies accepted by the service (if any)
+            self.content_encodings[service_name] = getattr(resource, 'content_encodings', ())
 
         self.putChild(resource_path, resource)
 
@@ -51,6 +54,9 @@ class TopResource(resource.Resource):
             se_name.text = service_name
             se_href = ET.SubElement(se, 'href')
             se_href.text = baseurl + '/' + path_template
+            for encoding in self.content_encodings.get(service_name, ()):
+                se_encoding = ET.SubElement(se, 'content-encoding')
+                se_encoding.text = encoding
         return tree
 
 
@@ -0,0 +1,79 @@
+"""
+Conversion of storage records in JSON format into insert arguments.
+
+A JSON storage record is an object with the argument names of srcreate (see
+srconverter.ARG_LIST) as keys. Times are ISO 8601 strings, and group
+attributes are given as a list of [type, value] pairs, or objects with type
+and value keys.
+"""
+
+import time
+
+from sgas.generic import jsonrecords
+from sgas.storagerecord import srparser, srconverter
+
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise ValueError('expected string')
+    return value
+
+
+def _dateTime(value):
+    return srparser.parseISODateTime(_string(value))
+
+
+def _int(value):
+    if isinstance(value, str):
+        return srparser.parseInt(value)
+    return int(value)
+
+
+def _groupAttributes(value):
+    group_attrs = []
+    for attr in value:
+        if isinstance(attr, dict):
+            attr = attr.get('type'), attr.get('value')
+        attr_type, group_attr = attr
+        group_attrs.append( [ attr_type, group_attr ] )
+    return group_attrs
+
+
+CONVERSIONS = {
+    'record_id'                 : _string,
+    'create_time'               : _dateTime,
+    'storage_system'            : _string,
+    'storage_share'             : _string,
+    'storage_media'             : _string,
+    'storage_class'             : _string,
+    'file_count'                : _int,
+    'directory_path'            : _string,
+    'local_user'                : _string,
+    'local_group'               : _string,
+    'user_identity'             : _string,
+    'group'                     : _string,
+    'group_attribute'           : _groupAttributes,
+    'site'                      : _string,
+    'start_time'                : _dateTime,
+    'end_time'                  : _dateTime,
+    'resource_capacity_used'    : _int,
+    'logical_capacity_used'     : _int
+}
+
+CONVERTER = jsonrecords.RecordConverter(srconverter.ARG_LIST, CONVERSIONS, required=('record_id',))
+
+
+
+def parseJSONRecords(storagerecord_data, record_format, insert_identity=None, insert_hostname=None, insert_time=None):
+    """
+    Convert a JSON / NDJSON storage record document into insert arguments.
+    """
+    server_values = {
+        'insert_identity'   : insert_identity,
+        'insert_hostname'   : insert_hostname,
+        'insert_time'       : time.strftime(srparser.JSON_DATETIME_FORMAT, insert_time) if insert_time is not None else None
+    }
+
+    return [ CONVERTER.convert(record, server_values) for record in jsonrecords.iterRecords(storagerecord_data, record_format) ]
+
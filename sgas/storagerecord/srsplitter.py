@@ -6,6 +6,7 @@ Author: Henrik Thostrup Jensen <htj@ndgf.org>
 Copyright: NorduNET / Nordic Data Grid Facility (2011)
 """
 
+import io
 
 from xml.etree import cElementTree as ET
 
@@ -51,3 +52,43 @@ def splitSRDocument(sr_data):
 
     return storage_records
 
+
+
+def iterSRDocument(sr_source):
+    """
+    Streaming variant of splitSRDocument. Takes a file-like object (or a
+    string) and yields the storage record elements one at a time as they are
+    parsed. Each element is cleared when the consumer asks for the next one.
+    """
+    if isinstance(sr_source, bytes):
+        sr_source = io.BytesIO(sr_source)
+    elif isinstance(sr_source, str):
+        sr_source = io.StringIO(sr_source)
+
+    stack = []
+
+    try:
+        for event, element in ET.iterparse(sr_source, events=('start', 'end')):
+            if event == 'start':
+                if not stack:
+                    if not element.tag in (sr.STORAGE_USAGE_RECORDS, sr.STORAGE_USAGE_RECORD):
+                        raise ParseError("Top element is not StorageUsageRecords or StorageUsageRecord")
+                elif stack[-1].tag == sr.STORAGE_USAGE_RECORDS and len(stack) <= 2:
+                    # records may be wrapped in one additional StorageUsageRecords element
+                    if not element.tag == sr.STORAGE_USAGE_RECORD and \
+                       not (element.tag == sr.STORAGE_USAGE_RECORDS and len(stack) == 1):
+                        raise ParseError("Subelement in StoragUsageRecords doc not a StorageUsageRecord: " +
+                                         element.tag)
+                stack.append(element)
+                continue
+
+            stack.pop()
+            if element.tag == sr.STORAGE_USAGE_RECORD and \
+               all( [ e.tag == sr.STORAGE_USAGE_RECORDS for e in stack ] ):
+                yield element
+                element.clear()
+                if stack:
+                    stack[-1].remove(element)
+
+    except ET.ParseError as e:
+        raise ParseError("Error parsing storage record data (%s)" % str(e))
@@ -18,11 +18,30 @@ import psycopg2.extensions # not used, but enables tuple adaption
 from sgas.authz import rights, ctxinsertchecker
 from sgas.generic.insertresource import GenericInsertResource
 from sgas.database import error as dberror
-from sgas.storagerecord import srsplitter, srparser, srconverter
+from sgas.generic import jsonrecords
+from sgas.storagerecord import srsplitter, srparser, srconverter, srjson
 
 ACTION_STORAGE_INSERT   = 'storageinsert'
 CTX_STORAGE_SYSTEM  = 'storage_system'
 
+PLUGIN_CFG_BLOCK    = 'plugin:storageusagerecordinsert'
+
+STORAGE_SYSTEM_SLOT = srconverter.ARG_LIST.index('storage_system')
+
+
+def parseStorageUsageRecords(storagerecord_data, insert_identity=None, insert_hostname=None, insert_time=None):
+    # parse sr data into insert arguments, run in the worker pool
+    sr_docs = []
+    for sr_element in srsplitter.iterSRDocument(storagerecord_data):
+        sr_doc = srparser.xmlToDict(sr_element,
+                                insert_identity=insert_identity,
+                                insert_hostname=insert_hostname,
+                                insert_time=insert_time)
+        sr_docs.append(sr_doc)
+
+    return srconverter.createInsertArguments(sr_docs)
+
+
 class StorageInsertChecker(ctxinsertchecker.InsertChecker):
 
     CONTEXT_KEY = CTX_STORAGE_SYSTEM
@@ -43,30 +62,35 @@ class StorageUsageRecordInsertResource(GenericInsertResource):
         authorizer.rights.addOptions(ACTION_STORAGE_INSERT,[ rights.OPTION_ALL ])
         authorizer.rights.addContexts(ACTION_STORAGE_INSERT,[ CTX_STORAGE_SYSTEM ])
 
-    def insertRecords(self, data, subject, hostname):
-        return self._insertStorageUsageRecords(data, self.db, self.authorizer, subject, hostname)
+        self.setupSpool(cfg, PLUGIN_CFG_BLOCK)
+        self.setupWorkerPool(cfg, PLUGIN_CFG_BLOCK)
+        self.setupContentEncoding(cfg, PLUGIN_CFG_BLOCK)
+        self.setupAdmission(cfg, PLUGIN_CFG_BLOCK)
+        self.setupChunkedInsert(cfg, PLUGIN_CFG_BLOCK)
+
+    def insertRecords(self, data, subject, hostname, record_format=jsonrecords.XML):
+        return self._insertStorageUsageRecords(data, self.db, self.authorizer, subject, hostname, record_format)
 
-    def _insertStorageUsageRecords(self, storagerecord_data, db, authorizer, insert_identity=None, insert_hostname=None):
+    def _insertStorageUsageRecords(self, storagerecord_data, db, authorizer, insert_identity=None, insert_hostname=None, record_format=jsonrecords.XML):
         
         insert_time = time.gmtime()
 
-        sr_docs = []
+        def checkArguments(arg_list):
+            storage_systems = set( [ args[STORAGE_SYSTEM_SLOT] for args in arg_list ] )
+            ctx = [ ('storage_system', ss) for ss in storage_systems ]
 
-        for sr_element in srsplitter.splitSRDocument(storagerecord_data):
-            sr_doc = srparser.xmlToDict(sr_element,
-                                    insert_identity=insert_identity,
-                                    insert_hostname=insert_hostname,
-                                    insert_time=insert_time)
-            sr_docs.append(sr_doc)
+            if authorizer.isAllowed(insert_identity, ACTION_STORAGE_INSERT, ctx):
+                return self.submitArguments(arg_list)
+            else:
+                MSG = 'Subject %s is not allowed to perform insertion for storage systems: %s' % (insert_identity, ','.join(storage_systems))
+                raise dberror.SecurityError(MSG)
 
-        storage_systems = set( [ doc.get('storage_system') for doc in sr_docs ] )
-        ctx = [ ('storage_system', ss) for ss in storage_systems ]
-
-        if authorizer.isAllowed(insert_identity, ACTION_STORAGE_INSERT, ctx):
-            return self.insertStorageUsageRecords(db, sr_docs)
+        if record_format == jsonrecords.XML:
+            d = self.parseRecords(parseStorageUsageRecords, storagerecord_data, insert_identity, insert_hostname, insert_time)
         else:
-            MSG = 'Subject %s is not allowed to perform insertion for storage systems: %s' % (insert_identity, ','.join(storage_systems))
-            return defer.fail(dberror.SecurityError(MSG))
+            d = self.parseRecords(srjson.parseJSONRecords, storagerecord_data, record_format, insert_identity, insert_hostname, insert_time)
+        d.addCallback(checkArguments)
+        return d
         
         
     def insertStorageUsageRecords(self, db, storagerecord_docs, retry=False):
@@ -74,3 +98,8 @@ class StorageUsageRecordInsertResource(GenericInsertResource):
         arg_list = srconverter.createInsertArguments(storagerecord_docs)
                
         return db.recordInserter('storage usage', 'srcreate', arg_list)
+
+    def insertArguments(self, arg_list):
+        if self.insert_chunk_size > 0:
+            return self.db.recordChunkInserter('storage usage', 'srcreate', arg_list, self.insert_chunk_size)
+        return self.db.recordInserter('storage usage', 'srcreate', arg_list)
@@ -18,9 +18,12 @@ import psycopg2
 import psycopg2.extensions # not used, but enables tuple adaption
 
 from sgas.authz import rights, ctxinsertchecker
-from sgas.generic.insertresource import GenericInsertResource
+from sgas.generic.insertresource import GenericInsertResource, INSERT_CHUNK_SIZE
 from sgas.database import error as dberror
-from sgas.usagerecord import ursplitter, urparser, urconverter
+from sgas.generic import jsonrecords
+from sgas.usagerecord import ursplitter, urparser, urconverter, urextractor, urjson, recentfilter
+from sgas.server import stats
+from sgas.server.config import ConfigurationError
 
 from sgas.usagerecord import updater
 
@@ -29,6 +32,25 @@ ACTION_INSERT           = 'insert' # backwards compat
 ACTION_JOB_INSERT       = 'jobinsert'
 CTX_MACHINE_NAME        = 'machine_name'
 
+PLUGIN_CFG_BLOCK        = 'plugin:jobusagerecordinsert'
+BULK_INSERT             = 'bulk_insert'
+DIMENSION_CACHE         = 'dimension_cache'
+RECENT_FILTER_SIZE      = 'recent_filter_size'
+RECENT_FILTER_AGE       = 'recent_filter_age'
+
+# staging table and template used for bulk inserts (see urcreate_bulk)
+BULK_STAGING_TABLE      = 'urbulk_staging'
+BULK_STAGING_TEMPLATE   = 'urbulk_template'
+
+def parseJobUsageRecords(usagerecord_data, insert_identity=None, insert_hostname=None, insert_time=None):
+    # parse ur data into insert arguments, run in the worker pool
+    return [ urextractor.extractInsertArguments(ur_element,
+                                                insert_identity=insert_identity,
+                                                insert_hostname=insert_hostname,
+                                                insert_time=insert_time)
+             for ur_element in ursplitter.iterURDocument(usagerecord_data) ]
+
+
 class JobInsertChecker(ctxinsertchecker.InsertChecker):
 
     CONTEXT_KEY = CTX_MACHINE_NAME
@@ -52,49 +74,145 @@ class JobUsageRecordInsertResource(GenericInsertResource):
         authorizer.rights.addOptions(ACTION_JOB_INSERT,[ rights.OPTION_ALL ])
         authorizer.rights.addContexts(ACTION_JOB_INSERT,[ CTX_MACHINE_NAME ])
         
-        self.updater = updater.AggregationUpdater(db)
+        self.bulk_insert = False
+        if cfg.has_option(PLUGIN_CFG_BLOCK, BULK_INSERT):
+            self.bulk_insert = cfg.getboolean(PLUGIN_CFG_BLOCK, BULK_INSERT)
+
+        self.dimension_cache = False
+        if cfg.has_option(PLUGIN_CFG_BLOCK, DIMENSION_CACHE):
+            self.dimension_cache = cfg.getboolean(PLUGIN_CFG_BLOCK, DIMENSION_CACHE)
+
+        self.setupChunkedInsert(cfg, PLUGIN_CFG_BLOCK)
+
+        # each selects a different insert procedure, so only one can be used
+        insert_modes = [ option for option, enabled in [ (BULK_INSERT, self.bulk_insert),
+                                                         (INSERT_CHUNK_SIZE, self.insert_chunk_size > 0),
+                                                         (DIMENSION_CACHE, self.dimension_cache) ] if enabled ]
+        if len(insert_modes) > 1:
+            raise ConfigurationError('%s cannot be used together' % ' and '.join(insert_modes))
+        if self.dimension_cache:
+            db.enableDimensionCache()
+
+        # filter for answering resubmitted records without going to the database,
+        # off by default, as it does not see records replaced by other frontends
+        filter_size = 0
+        if cfg.has_option(PLUGIN_CFG_BLOCK, RECENT_FILTER_SIZE):
+            filter_size = cfg.getint(PLUGIN_CFG_BLOCK, RECENT_FILTER_SIZE)
+        filter_age = recentfilter.DEFAULT_MAX_AGE
+        if cfg.has_option(PLUGIN_CFG_BLOCK, RECENT_FILTER_AGE):
+            filter_age = cfg.getint(PLUGIN_CFG_BLOCK, RECENT_FILTER_AGE)
+        self.recent_filter = None
+        if filter_size > 0:
+            self.recent_filter = recentfilter.RecentRecordFilter(filter_size, filter_age)
+            stats.registerProvider('recentfilter:' + self.PLUGIN_ID, self.recent_filter.getStatistics)
+
+        self.updater = updater.createAggregationUpdater(cfg, PLUGIN_CFG_BLOCK, db)
+        if self.updater.mode == updater.MODE_DELTA and not self.bulk_insert:
+            # the deltas are computed from the staging table of the bulk insert
+            raise ConfigurationError('%s=%s requires %s=true' % (updater.AGGREGATION_MODE, updater.MODE_DELTA, BULK_INSERT))
         db.attachService(self.updater)
 
-    def insertRecords(self, data, subject, hostname):
-        return self._insertJobUsageRecords(data, self.db, self.authorizer, subject, hostname)
+        self.setupSpool(cfg, PLUGIN_CFG_BLOCK)
+        self.setupWorkerPool(cfg, PLUGIN_CFG_BLOCK)
+        self.setupContentEncoding(cfg, PLUGIN_CFG_BLOCK)
+        self.setupAdmission(cfg, PLUGIN_CFG_BLOCK)
 
-    def _insertJobUsageRecords(self, usagerecord_data, db, authorizer, insert_identity=None, insert_hostname=None):
+    def insertRecords(self, data, subject, hostname, record_format=jsonrecords.XML):
+        return self._insertJobUsageRecords(data, self.db, self.authorizer, subject, hostname, record_format)
 
-        # parse ur data
-        insert_time = time.gmtime()
-
-        ur_docs = []
+    def _insertJobUsageRecords(self, usagerecord_data, db, authorizer, insert_identity=None, insert_hostname=None, record_format=jsonrecords.XML):
 
-        ur_errors = False
-        for ur_element in ursplitter.splitURDocument(usagerecord_data):
-            ur_doc = urparser.xmlToDict(ur_element,
-                                    insert_identity=insert_identity,
-                                    insert_hostname=insert_hostname,
-                                    insert_time=insert_time)
+        # parse ur data in the worker pool, directly into insert arguments
+        insert_time = time.gmtime()
 
-            if not ur_doc.get(CTX_MACHINE_NAME):
-                log.msg("ERROR: UR %s from %s doesn't have %s defined!" % (ur_doc.get("record_id"), ur_doc.get("insert_identity"), CTX_MACHINE_NAME))
-                ur_errors = True
+        def checkArguments(arg_list):
+            ur_errors = False
+            for args in arg_list:
+                if not args[urextractor.MACHINE_NAME_SLOT]:
+                    log.msg("ERROR: UR %s from %s doesn't have %s defined!" % (args[urextractor.RECORD_ID_SLOT], insert_identity, CTX_MACHINE_NAME))
+                    ur_errors = True
 
-            ur_docs.append(ur_doc)
+            if ur_errors:
+                raise Exception("There where faulty URs!")
 
-        if ur_errors:
-            raise Exception("There where faulty URs!")
+            # check authz
+            machine_names = set( [ args[urextractor.MACHINE_NAME_SLOT] for args in arg_list ] )
+            ctx = [ (CTX_MACHINE_NAME, mn) for mn in machine_names ]
 
-        # check authz
-        machine_names = set( [ doc.get(CTX_MACHINE_NAME) for doc in ur_docs ] )
-        ctx = [ (CTX_MACHINE_NAME, mn) for mn in machine_names ]
+            if authorizer.isAllowed(insert_identity, ACTION_JOB_INSERT, ctx):
+                return self.submitJobUsageArguments(arg_list)
+            else:
+                MSG = 'Subject %s is not allowed to perform insertion for machines: %s' % (insert_identity, ','.join(machine_names))
+                raise dberror.SecurityError(MSG)
 
-        if authorizer.isAllowed(insert_identity, ACTION_JOB_INSERT, ctx):
-            return self.insertJobUsageRecords(db,ur_docs)
+        if record_format == jsonrecords.XML:
+            d = self.parseRecords(parseJobUsageRecords, usagerecord_data, insert_identity, insert_hostname, insert_time)
         else:
-            MSG = 'Subject %s is not allowed to perform insertion for machines: %s' % (insert_identity, ','.join(machine_names))
-            return defer.fail(dberror.SecurityError(MSG))
+            d = self.parseRecords(urjson.parseJSONRecords, usagerecord_data, record_format, insert_identity, insert_hostname, insert_time)
+        d.addCallback(checkArguments)
+        return d
+
+    def submitJobUsageArguments(self, arg_list):
+        # answer recently inserted records from the filter, and submit the rest
+        if self.recent_filter is None:
+            return self.submitArguments(arg_list)
+
+        known = {}
+        new_arg_list = []
+        for args in arg_list:
+            row_id = self.recent_filter.lookup(args[urextractor.RECORD_ID_SLOT], args[urextractor.GLOBAL_JOB_ID_SLOT])
+            if row_id is None:
+                new_arg_list.append(args)
+            else:
+                known[args[urextractor.RECORD_ID_SLOT]] = row_id
+
+        if not new_arg_list:
+            log.msg('All %i records are recently inserted duplicates' % len(known), system='sgas.JobUsageRecordInsertResource')
+            return defer.succeed(known)
+
+        def addKnown(id_dict):
+            id_dict.update(known)
+            return id_dict
+
+        d = self.submitArguments(new_arg_list)
+        d.addCallback(addKnown)
+        return d
 
     def insertJobUsageRecords(self, db, usagerecord_docs, retry=False):
 
         arg_list = urconverter.createInsertArguments(usagerecord_docs)
-        
-        r = db.recordInserter('usage', 'urcreate', arg_list)
+        return self.insertJobUsageArguments(db, arg_list)
+
+    def insertArguments(self, arg_list):
+        return self.insertJobUsageArguments(self.db, arg_list)
+
+    def insertJobUsageArguments(self, db, arg_list):
+
+        if self.bulk_insert:
+            arg_list = urconverter.collapseDuplicates(arg_list)
+            r = db.recordBulkInserter('usage', 'urcreate_bulk', BULK_STAGING_TABLE, BULK_STAGING_TEMPLATE,
+                                      urconverter.ARG_LIST, arg_list, (self.updater.mode == updater.MODE_DELTA,))
+        elif self.insert_chunk_size > 0:
+            r = db.recordChunkInserter('usage', 'urcreate', arg_list, self.insert_chunk_size)
+        elif self.dimension_cache:
+            r = db.recordIdInserter('usage', 'urcreate_ids', urconverter.ARG_LIST, arg_list)
+        else:
+            r = db.recordInserter('usage', 'urcreate', arg_list)
         self.updater.updateNotification()
-        return r        
+
+        if self.updater.mode == updater.MODE_DELTA:
+            # the aggregated data was changed by the insert
+            def aggregationUpdated(id_dict):
+                db.aggregationUpdated()
+                return id_dict
+            r.addCallback(aggregationUpdated)
+
+        def rememberInserted(id_dict):
+            for args in arg_list:
+                record_id = args[urextractor.RECORD_ID_SLOT]
+                self.recent_filter.add(record_id, args[urextractor.GLOBAL_JOB_ID_SLOT], id_dict.get(record_id))
+            return id_dict
+
+        if self.recent_filter is not None:
+            r.addCallback(rememberInserted)
+        return r
@@ -0,0 +1,75 @@
+"""
+Filter of recently inserted usage records.
+
+Registrants often resend records which have already been inserted. The filter
+remembers the (record id, global job id) pairs of recently committed records,
+so that such duplicates can be answered without going to the database.
+
+A record is considered a duplicate following the same rule as urcreate: the
+record id is known, and the global job id is either identical to the stored
+one, or identical to the record id (minimal record). Records which would
+replace an existing record are never answered from the filter.
+
+The filter is bounded both in size (least recently used entries are evicted)
+and in age. It only knows about records committed by this process: if another
+SGAS instance (or a direct database load) replaces a record, the old record is
+still answered as a duplicate from the filter until its entry expires, where
+urcreate would have applied the resubmission as a replacement. The filter is
+therefore only enabled on request (see docs/plugins).
+"""
+
+import time
+import collections
+
+
+
+DEFAULT_MAX_SIZE = 50000
+DEFAULT_MAX_AGE  = 3600 # seconds
+
+
+
+class RecentRecordFilter:
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_age=DEFAULT_MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = collections.OrderedDict() # record_id -> (global_job_id, row_id, insert time)
+        self.hits = 0
+        self.misses = 0
+
+
+    def add(self, record_id, global_job_id, row_id):
+        if row_id is None:
+            return
+        self.entries[record_id] = (global_job_id, row_id, time.time())
+        self.entries.move_to_end(record_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+    def lookup(self, record_id, global_job_id):
+        """
+        Return the row id of the record, if it is a known duplicate, otherwise None.
+        """
+        entry = self.entries.get(record_id)
+        if entry is not None:
+            stored_global_job_id, row_id, insert_time = entry
+            if insert_time < time.time() - self.max_age:
+                del self.entries[record_id]
+            elif global_job_id is not None and global_job_id in (stored_global_job_id, record_id):
+                self.entries.move_to_end(record_id)
+                self.hits += 1
+                return row_id
+        self.misses += 1
+        return None
+
+
+    def getStatistics(self):
+        total = self.hits + self.misses
+        return {
+            'size'      : len(self.entries),
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'hit_ratio' : round(float(self.hits) / total, 3) if total else 0.0
+        }
+
@@ -10,84 +10,265 @@ Originally it was planned to use the NOTIFY/LISTEN functionality in PostgreSQL,
 but I could not make it work using adbapi (and it appears other have this
 problem as well).
 
+The updater is a small state machine: it is idle until an insert notifies it
+(or it finds queued updates, which it checks for every IDLE_POLL_INTERVAL),
+then waits a debounce window (so the slices of several inserts are updated in
+one run), updates, and goes back to idle, or updates again if more inserts
+arrived meanwhile. The debounce window shrinks as the backlog grows, so a large
+backlog is worked off without pauses. Failed updates are retried with an
+increasing delay.
+
+Each update also brings the monthly rollup of the aggregated data up to date:
+updating a slice marks the machine / months it touches, which are then
+recomputed from the aggregated data after the slices.
+
 Author: Henrik Thostrup Jensen <htj@ndgf.org>
 Copyright: Nordic Data Grid Facility (2010)
 """
 
-import psycopg2
+import time
 
 from twisted.python import log
 from twisted.internet import defer, reactor
 from twisted.application import service
-from twisted.enterprise import adbapi
+
+from sgas.server import stats
+from sgas.server.config import ConfigurationError
+from sgas.database.postgresql import database
+
+
+# aggregation options (in the plugin block)
+AGGREGATION_WORKERS     = 'aggregation_workers'
+AGGREGATION_WORK_MEM    = 'aggregation_work_mem'
+AGGREGATION_DEBOUNCE    = 'aggregation_debounce'
+AGGREGATION_MODE        = 'aggregation_mode'
+
+# aggregation modes: full recomputes every slice with inserted records, delta
+# adds the inserted records to the aggregated data when inserting them (bulk
+# inserts only), and recomputes only slices with replaced records
+MODE_FULL               = 'full'
+MODE_DELTA              = 'delta'
+AGGREGATION_MODES       = (MODE_FULL, MODE_DELTA)
+
+DEFAULT_WORKERS         = 1
+DEFAULT_DEBOUNCE        = 20    # seconds, with an empty backlog
+MIN_DEBOUNCE            = 1     # seconds, with a backlog of BACKLOG_SLICES or more
+BACKLOG_SLICES          = 100
+IDLE_POLL_INTERVAL      = 300   # seconds, between checks of the update queue when idle
+MIN_BACKOFF             = 5     # seconds
+MAX_BACKOFF             = 300   # seconds
+
+# states
+IDLE        = 'idle'
+SCHEDULED   = 'scheduled'
+UPDATING    = 'updating'
+BACKOFF     = 'backoff'
+STOPPED     = 'stopped'
+
+AGGREGATOR          = 'update_uraggregate'
+MONTHLY_AGGREGATOR  = 'update_uraggregate_monthly'
+
+SQL_UPDATE_QUEUE = '''SELECT count(*), min(insert_time), (SELECT count(*) FROM uraggregated_monthly_update) FROM uraggregated_update'''
+
 
 
 class AggregationUpdater(service.Service):
 
-    def __init__(self, db):
+    def __init__(self, db, workers=DEFAULT_WORKERS, work_mem=None, debounce=DEFAULT_DEBOUNCE, mode=MODE_FULL, clock=reactor):
         self.db          = db
+        self.mode        = mode
+        self.workers     = workers
+        self.work_mem    = work_mem
+        self.debounce    = debounce
+        self.clock       = clock
 
-        self.need_update = False
-        self.updating    = False
+        self.state       = STOPPED
         self.stopping    = False
-        self.update_call = None
-        self.update_def  = None
-        
+        self.need_update = False
+        self.running     = None
+        self.wakeup      = None
+
+        self.notifications  = 0     # since the last update started
+        self.pending_since  = None  # time of the first notification not yet updated
+        self.queue_length   = None
+        self.queue_oldest   = None
+        self.monthly_queue_length = None
+        self.failures       = 0     # consecutive
+        self.errors         = 0
+        self.slices         = 0
+        self.last_run       = None
+        self.last_duration  = None
+        self.last_slices    = None
+        self.months         = 0
+        self.last_months    = None
+
 
     def startService(self):
         service.Service.startService(self)
+        self.stopping = False
         # we might have been shutdown while some updates where pending,
         # or some records could have been inserted outside SGAS, so we
-        # always schedule an update when starting
-        self.scheduleUpdate()
+        # always start with an update
+        self.need_update = True
+        self.running = self.run()
         return defer.succeed(None)
 
 
     def stopService(self):
-        self.stopping = True
         service.Service.stopService(self)
-        if self.update_call is not None:
-            self.update_call.cancel()
-        if self.update_def is not None:
-            return self.update_def
-        else:
-            return defer.succeed(None)
+        self.stopping = True
+        # the aggregation workers check stopping between slices
+        self.notify()
+        return self.running or defer.succeed(None)
 
 
     def updateNotification(self):
-        # the database need to be updated, schedule call
+        # the database need to be updated
         self.need_update = True
-        self.scheduleUpdate()
+        self.notifications += 1
+        if self.pending_since is None:
+            self.pending_since = time.time()
+        if self.state == IDLE:
+            self.notify()
+
+
+    def notify(self):
+        if self.wakeup is not None and not self.wakeup.called:
+            self.wakeup.callback(None)
+
 
+    def _wait(self, delay=None):
+        # wait for delay seconds (or until notified if delay is None),
+        # stopping the service cuts the wait short
+        self.wakeup = defer.Deferred()
+        if delay is not None:
+            call = self.clock.callLater(delay, self.notify)
+            self.wakeup.addBoth(lambda _ : call.active() and call.cancel())
+        return self.wakeup
 
-    def scheduleUpdate(self, delay=20):
-        # only schedule call if no other call is planned
-        if self.update_call is None:
-            log.msg('Scheduling update for aggregated table in %i seconds.' % delay, system='sgas.AggregationUpdater')
-            self.update_call = reactor.callLater(delay, self.performUpdate, True)
 
+    def debounceDelay(self):
+        # the larger the backlog, the shorter the wait
+        backlog = max(self.queue_length or 0, self.notifications)
+        fill = min(backlog, BACKLOG_SLICES) / float(BACKLOG_SLICES)
+        return max(MIN_DEBOUNCE, self.debounce * (1 - fill))
 
-    def performUpdate(self, remove_call=False):
-        if remove_call:
-            self.update_call = None
-        if self.updating:
-            # if an update is running, defer this update to (much) later
-            self.scheduleUpdate(delay=120)
-            return defer.succeed(None)
-        else:
-            d = self.updateAggregator()
-            self.update_def = d
-            return d
 
-    # -- end scheduling logic
+    def backoffDelay(self):
+        return min(MAX_BACKOFF, MIN_BACKOFF * 2 ** (self.failures - 1))
+
+
+    @defer.inlineCallbacks
+    def _updateQueueStatus(self):
+        try:
+            # the queue is only up to date on the primary
+            rows = yield self.db.query(SQL_UPDATE_QUEUE, pool=database.AGGREGATION_POOL)
+            self.queue_length, self.queue_oldest, self.monthly_queue_length = rows[0]
+        except Exception as e:
+            log.msg('Error getting aggregation update queue status: %s' % str(e), system='sgas.AggregationUpdater')
+
+
+    @defer.inlineCallbacks
+    def run(self):
+
+        while not self.stopping:
+
+            if not self.need_update:
+                self.state = IDLE
+                yield self._wait(IDLE_POLL_INTERVAL)
+                if not (self.need_update or self.stopping):
+                    # updates can be queued outside SGAS, e.g., by the swap of
+                    # sgas-aggregation-rebuild, which does not notify us
+                    yield self._updateQueueStatus()
+                    if self.queue_length or self.monthly_queue_length:
+                        log.msg('Found queued aggregation updates, updating.', system='sgas.AggregationUpdater')
+                        self.need_update = True
+                continue
+
+            if not self.failures: # no debounce after backoff
+                self.state = SCHEDULED
+                delay = self.debounceDelay()
+                log.msg('Scheduling update for aggregated table in %i seconds.' % delay, system='sgas.AggregationUpdater')
+                yield self._wait(delay)
+                if self.stopping:
+                    break
+
+            self.state = UPDATING
+            self.need_update = False
+            self.notifications = 0
+            pending_since = self.pending_since
+            self.pending_since = None
+            start_time = time.time()
+            try:
+                slices = yield self.updateAggregator()
+                months = yield self.updateMonthlyRollup()
+            except Exception as e:
+                self.failures += 1
+                self.errors += 1
+                # the slices are still in the update table, so they are retried
+                self.need_update = True
+                if pending_since is not None:
+                    self.pending_since = pending_since
+                self.state = BACKOFF
+                delay = self.backoffDelay()
+                log.msg('Aggregation update failed (%s), retrying in %i seconds.' % (str(e), delay), system='sgas.AggregationUpdater')
+                yield self._wait(delay)
+                continue
+
+            self.failures = 0
+            self.slices += slices
+            self.last_run = start_time
+            self.last_duration = time.time() - start_time
+            self.last_slices = slices
+            self.months += months
+            self.last_months = months
+            if slices or months:
+                self.db.aggregationUpdated()
+
+            yield self._updateQueueStatus()
+            if self.queue_length or self.monthly_queue_length:
+                # inserts can mark slices while the update is running
+                self.need_update = True
+                if self.pending_since is None:
+                    self.pending_since = start_time
+
+        self.state = STOPPED
+
 
-    # @defer.inlineCallbacks
     def updateAggregator(self):
         # will update the parts of the aggregated data table which has been
         # specified to need an update in the update table
-        self.updating = True
-        self.db.updateAggregator('update_uraggregate',self)
-        self.updating = False
+        return self.db.updateAggregator(AGGREGATOR, self, self.workers, self.work_mem)
+
+
+    def updateMonthlyRollup(self):
+        # will update the months of the monthly rollup which has been marked
+        # by the updates of the aggregated data
+        return self.db.updateAggregator(MONTHLY_AGGREGATOR, self, self.workers, self.work_mem)
+
+
+    def getStatistics(self):
+        slices_per_second = None
+        if self.last_duration:
+            slices_per_second = round(self.last_slices / self.last_duration, 2)
+        return {
+            'state'             : self.state,
+            'mode'              : self.mode,
+            'workers'           : self.workers,
+            'queue_length'      : self.queue_length,
+            'queue_oldest'      : self.queue_oldest,
+            'lag'               : round(time.time() - self.pending_since, 1) if self.pending_since else 0,
+            'last_run'          : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.last_run)) if self.last_run else None,
+            'last_duration'     : round(self.last_duration, 2) if self.last_duration is not None else None,
+            'last_slices'       : self.last_slices,
+            'slices_per_second' : slices_per_second,
+            'slices'            : self.slices,
+            'monthly_queue_length' : self.monthly_queue_length,
+            'last_months'       : self.last_months,
+            'months'            : self.months,
+            'failures'          : self.failures,
+            'errors'            : self.errors
+        }
 
 
     def rebuild(self):
@@ -99,3 +280,31 @@ class AggregationUpdater(service.Service):
         # not quite there yet
         pass
 
+
+
+def createAggregationUpdater(cfg, cfg_block, db):
+    """
+    Create aggregation updater from the options in a plugin block, and
+    register its statistics.
+    """
+    workers = DEFAULT_WORKERS
+    if cfg.has_option(cfg_block, AGGREGATION_WORKERS):
+        workers = cfg.getint(cfg_block, AGGREGATION_WORKERS)
+    if workers < 1:
+        raise ConfigurationError('Invalid %s in %s: %i (must be at least 1)' % (AGGREGATION_WORKERS, cfg_block, workers))
+    work_mem = None
+    if cfg.has_option(cfg_block, AGGREGATION_WORK_MEM):
+        work_mem = cfg.get(cfg_block, AGGREGATION_WORK_MEM).strip()
+    debounce = DEFAULT_DEBOUNCE
+    if cfg.has_option(cfg_block, AGGREGATION_DEBOUNCE):
+        debounce = cfg.getint(cfg_block, AGGREGATION_DEBOUNCE)
+    mode = MODE_FULL
+    if cfg.has_option(cfg_block, AGGREGATION_MODE):
+        mode = cfg.get(cfg_block, AGGREGATION_MODE).strip().lower()
+    if mode not in AGGREGATION_MODES:
+        raise ConfigurationError('Invalid %s in %s: %s (must be one of %s)' % (AGGREGATION_MODE, cfg_block, mode, ', '.join(AGGREGATION_MODES)))
+
+    updater = AggregationUpdater(db, workers, work_mem, debounce, mode)
+    stats.registerProvider('aggregation', updater.getStatistics)
+    return updater
+
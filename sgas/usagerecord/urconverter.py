@@ -118,3 +118,30 @@ def createInsertArguments(usagerecord_docs, insert_identity=None, insert_hostnam
 
     return args
 
+
+
+def collapseDuplicates(insert_args):
+    """
+    Collapse insert arguments with the same record id into one entry, so that
+    the batch can be inserted with a single set-based statement. Later records
+    replace earlier ones following the same rules as urcreate: a record replaces
+    another if its global job id is set, differs from the existing global job
+    id, and is not identical to the record id (a minimal record).
+    """
+    record_idx = ARG_LIST.index('record_id')
+    global_job_idx = ARG_LIST.index('global_job_id')
+
+    collapsed = {}
+    for arg in insert_args:
+        record_id = arg[record_idx]
+        existing = collapsed.get(record_id)
+        if existing is not None:
+            global_job_id = arg[global_job_idx]
+            if global_job_id is not None and global_job_id == existing[global_job_idx]:
+                continue
+            if global_job_id is not None and global_job_id == record_id:
+                continue
+        collapsed[record_id] = arg
+
+    return list(collapsed.values())
+
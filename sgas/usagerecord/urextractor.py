@@ -0,0 +1,315 @@
+"""
+Compiled usage record extractor. Converts a usage record XML element directly
+into the positional argument list for the urcreate procedure, in a single pass
+over the element.
+
+This is equivalent to urparser.xmlToDict followed by
+urconverter.createInsertArguments, but avoids building the intermediate
+dictionary. Each tag is looked up in a table, mapping it to a slot in the
+argument list and a parse function.
+"""
+
+import time
+
+from twisted.python import log
+
+from sgas.usagerecord import urelements as ur
+from sgas.usagerecord import urparser, urconverter
+from sgas.usagerecord.memory import SgasMemory
+
+
+
+# slot indexes in the argument list
+_SLOT = dict( [ (name, idx) for idx, name in enumerate(urconverter.ARG_LIST) ] )
+
+RECORD_ID_SLOT          = _SLOT['record_id']
+CREATE_TIME_SLOT        = _SLOT['create_time']
+GLOBAL_JOB_ID_SLOT      = _SLOT['global_job_id']
+LOCAL_JOB_ID_SLOT       = _SLOT['local_job_id']
+VO_TYPE_SLOT            = _SLOT['vo_type']
+VO_ISSUER_SLOT          = _SLOT['vo_issuer']
+VO_NAME_SLOT            = _SLOT['vo_name']
+VO_ATTRIBUTES_SLOT      = _SLOT['vo_attributes']
+MACHINE_NAME_SLOT       = _SLOT['machine_name']
+CHARGE_SLOT             = _SLOT['charge']
+HOST_SLOT               = _SLOT['host']
+NODE_COUNT_SLOT         = _SLOT['node_count']
+PROCESSORS_SLOT         = _SLOT['processors']
+CPU_DURATION_SLOT       = _SLOT['cpu_duration']
+RUNTIME_ENV_SLOT        = _SLOT['runtime_environments']
+EXIT_CODE_SLOT          = _SLOT['exit_code']
+DOWNLOADS_SLOT          = _SLOT['downloads']
+UPLOADS_SLOT            = _SLOT['uploads']
+INSERT_HOSTNAME_SLOT    = _SLOT['insert_hostname']
+INSERT_IDENTITY_SLOT    = _SLOT['insert_identity']
+INSERT_TIME_SLOT        = _SLOT['insert_time']
+MEMORY_SLOT             = _SLOT['memory']
+
+N_SLOTS = len(urconverter.ARG_LIST)
+
+# same limits as in urconverter
+MAX_HOST_LENGTH         = 2700
+MAX_LOCAL_JOB_ID_LENGTH = 120
+
+
+def _text(value):
+    return value
+
+
+def _charge(value):
+    # from version 3.5 the db schema only does integers
+    charge = urparser.parseFloat(value)
+    return int(charge) if charge is not None else None
+
+
+def _exitCode(value):
+    exit_code = urparser.parseInt(value)
+    return exit_code & 0o377 if exit_code is not None else None # equivalent to modulus 256
+
+
+def _host(value):
+    if value is not None and len(value) > MAX_HOST_LENGTH:
+        return value[:MAX_HOST_LENGTH-1] + '$' # dollar marks that the string has been chopped
+    return value
+
+
+# elements which are simply parsed into a slot: tag -> (slot, parse function)
+SIMPLE_ELEMENTS = {
+    ur.JOB_NAME.text            : (_SLOT['job_name'],           _text),
+    ur.STATUS.text              : (_SLOT['status'],             _text),
+    ur.CHARGE.text              : (CHARGE_SLOT,                 _charge),
+    ur.WALL_DURATION.text       : (_SLOT['wall_duration'],      urparser.parseISODuration),
+    ur.NODE_COUNT.text          : (NODE_COUNT_SLOT,             urparser.parseInt),
+    ur.PROCESSORS.text          : (PROCESSORS_SLOT,             urparser.parseInt),
+    ur.START_TIME.text          : (_SLOT['start_time'],         urparser.parseISODateTime),
+    ur.END_TIME.text            : (_SLOT['end_time'],           urparser.parseISODateTime),
+    ur.PROJECT_NAME.text        : (_SLOT['project_name'],       _text),
+    ur.SUBMIT_HOST.text         : (_SLOT['submit_host'],        _text),
+    ur.MACHINE_NAME.text        : (MACHINE_NAME_SLOT,           _text),
+    ur.HOST.text                : (HOST_SLOT,                   _host),
+    ur.QUEUE.text               : (_SLOT['queue'],              _text),
+    ur.SUBMIT_TIME.text         : (_SLOT['submit_time'],        urparser.parseISODateTime),
+    ur.USER_TIME.text           : (_SLOT['user_time'],          urparser.parseISODuration),
+    ur.KERNEL_TIME.text         : (_SLOT['kernel_time'],        urparser.parseISODuration),
+    ur.EXIT_CODE.text           : (EXIT_CODE_SLOT,              _exitCode),
+    ur.MAJOR_PAGE_FAULTS.text   : (_SLOT['major_page_faults'],  urparser.parseInt)
+}
+
+# sub elements of the job and user identity blocks: tag -> slot
+JOB_IDENTITY_ELEMENTS = {
+    ur.GLOBAL_JOB_ID.text       : GLOBAL_JOB_ID_SLOT,
+    ur.LOCAL_JOB_ID.text        : LOCAL_JOB_ID_SLOT
+}
+
+USER_IDENTITY_ELEMENTS = {
+    ur.LOCAL_USER_ID.text       : _SLOT['local_user_id'],
+    ur.GLOBAL_USER_NAME.text    : _SLOT['global_user_name']
+}
+
+# transfer sub elements: tag -> (position, parse function)
+DOWNLOAD_ELEMENTS = {
+    ur.TRANSFER_URL.text                    : (0, _text),
+    ur.TRANSFER_SIZE.text                   : (1, urparser.parseInt),
+    ur.TRANSFER_START_TIME.text             : (2, urparser.parseISODateTime),
+    ur.TRANSFER_END_TIME.text               : (3, urparser.parseISODateTime),
+    ur.TRANSFER_BYPASS_CACHE.text           : (4, urparser.parseBoolean),
+    ur.TRANSFER_RETRIEVED_FROM_CACHE.text   : (5, urparser.parseBoolean)
+}
+
+UPLOAD_ELEMENTS = {
+    ur.TRANSFER_URL.text                    : (0, _text),
+    ur.TRANSFER_SIZE.text                   : (1, urparser.parseInt),
+    ur.TRANSFER_START_TIME.text             : (2, urparser.parseISODateTime),
+    ur.TRANSFER_END_TIME.text               : (3, urparser.parseISODateTime)
+}
+
+
+
+def _stringify(value):
+    return str(value) if value is not None else None
+
+
+def _recordIdentity(element, args):
+    record_id = element.get(ur.RECORD_ID.text)
+    if record_id is not None:
+        args[RECORD_ID_SLOT] = record_id
+    args[CREATE_TIME_SLOT] = urparser.parseISODateTime(element.get(ur.CREATE_TIME.text))
+
+
+def _jobIdentity(element, args):
+    for subele in element:
+        slot = JOB_IDENTITY_ELEMENTS.get(subele.tag)
+        if slot is None:
+            print("Unhandled job id element:", subele.tag)
+        else:
+            args[slot] = subele.text
+
+
+def _userIdentity(element, args):
+    for subele in element:
+        slot = USER_IDENTITY_ELEMENTS.get(subele.tag)
+        if slot is not None:
+            args[slot] = subele.text
+        elif subele.tag == ur.VO.text:
+            vo_type = subele.get(ur.VO_TYPE.text)
+            if vo_type is not None:
+                args[VO_TYPE_SLOT] = vo_type
+            vo_attrs = []
+            for ve in subele:
+                if   ve.tag == ur.VO_NAME.text:   args[VO_NAME_SLOT]   = ve.text
+                elif ve.tag == ur.VO_ISSUER.text: args[VO_ISSUER_SLOT] = ve.text
+                elif ve.tag == ur.VO_ATTRIBUTE.text:
+                    group, role = None, None
+                    for va in ve:
+                        if va.tag == ur.VO_GROUP.text:
+                            group = va.text
+                        elif va.tag == ur.VO_ROLE.text:
+                            role = va.text
+                        else:
+                            print("Unhandladed vo attribute element", va.tag)
+                    vo_attrs.append( [ _stringify(group), _stringify(role) ] )
+                else:
+                    print("Unhandled vo subelement", ve.tag)
+            if vo_attrs:
+                args[VO_ATTRIBUTES_SLOT] = vo_attrs
+        else:
+            print("Unhandled user id element:", subele.tag)
+
+
+def _cpuDuration(element, args):
+    # multiple cpu durations (user and system) are summed
+    cpu_duration = urparser.parseISODuration(element.text)
+    if args[CPU_DURATION_SLOT] is not None and cpu_duration is not None:
+        cpu_duration += args[CPU_DURATION_SLOT]
+    args[CPU_DURATION_SLOT] = cpu_duration
+
+
+def _runtimeEnvironment(element, args):
+    if args[RUNTIME_ENV_SLOT] is None:
+        args[RUNTIME_ENV_SLOT] = []
+    args[RUNTIME_ENV_SLOT].append(element.text)
+
+
+def _memory(element, args):
+    if args[MEMORY_SLOT] is None:
+        args[MEMORY_SLOT] = []
+    args[MEMORY_SLOT].append(SgasMemory(urparser.parseInt(element.text),
+                                        element.attrib.get(ur.MEMORY_STORAGE_UNIT.text),
+                                        element.attrib.get(ur.MEMORY_METRIC.text),
+                                        element.attrib.get(ur.MEMORY_TYPE.text)))
+
+
+def _transfer(element, table, size):
+    transfer = [ None ] * size
+    found = False
+    for subele in element:
+        entry = table.get(subele.tag)
+        if entry is not None:
+            pos, parse = entry
+            transfer[pos] = parse(subele.text)
+            found = True
+    if not found:
+        return None
+    return [ _stringify(f) for f in transfer ]
+
+
+def _fileTransfers(element, args):
+    for subele in element:
+        if subele.tag == ur.FILE_DOWNLOAD.text:
+            transfer = _transfer(subele, DOWNLOAD_ELEMENTS, 6)
+            slot = DOWNLOADS_SLOT
+        elif subele.tag == ur.FILE_UPLOAD.text:
+            transfer = _transfer(subele, UPLOAD_ELEMENTS, 4)
+            slot = UPLOADS_SLOT
+        else:
+            continue
+        if args[slot] is None:
+            args[slot] = []
+        if transfer is not None:
+            args[slot].append(transfer)
+
+
+def _deprecated(element, args):
+    log.msg('Got %s element, ignoring (deprecated)' % element.tag, system='sgas.UsageRecord')
+
+
+def _ignore(element, args):
+    pass # logger name, in the future this can be used to implement special handling for broken loggers, etc
+
+
+# elements requiring special handling: tag -> handler function
+COMPOUND_ELEMENTS = {
+    ur.RECORD_IDENTITY.text             : _recordIdentity,
+    ur.JOB_IDENTITY.text                : _jobIdentity,
+    ur.USER_IDENTITY.text               : _userIdentity,
+    ur.CPU_DURATION.text                : _cpuDuration,
+    ur.SGAS_RUNTIME_ENVIRONMENT.text    : _runtimeEnvironment,
+    ur.ARC_RUNTIME_ENVIRONMENT.text     : _runtimeEnvironment,
+    ur.MEMORY.text                      : _memory,
+    ur.FILE_TRANSFERS.text              : _fileTransfers,
+    ur.KSI2K_WALL_DURATION.text         : _deprecated,
+    ur.KSI2K_CPU_DURATION.text          : _deprecated,
+    ur.LOGGER_NAME.text                 : _ignore
+}
+
+
+
+def fixLocalJobId(args):
+    # hack for dealing with bad local job ids (occurs from time to time in ARC)
+    lji = args[LOCAL_JOB_ID_SLOT]
+    if lji is not None and (len(lji) > MAX_LOCAL_JOB_ID_LENGTH or lji.startswith('/')):
+        args[LOCAL_JOB_ID_SLOT] = None
+        # the record id is typically machine_name:local_job_id, so we need to change that as well
+        old_record_id = args[RECORD_ID_SLOT]
+        if args[GLOBAL_JOB_ID_SLOT] is not None:
+            args[RECORD_ID_SLOT] = args[GLOBAL_JOB_ID_SLOT]
+        else:
+            args[RECORD_ID_SLOT] = (args[MACHINE_NAME_SLOT] or '') + ':' + (args[CREATE_TIME_SLOT] or '')
+        log.msg('HEURISTIC IN USE. Removed LocalJobId ("%s") and rewrote recordId from %s to %s' % (lji, old_record_id, args[RECORD_ID_SLOT]))
+
+
+
+def extractInsertArguments(ur_element, insert_identity=None, insert_hostname=None, insert_time=None):
+    """
+    Convert a usage record element into the argument list for urcreate. The
+    element must be a single JobUsageRecord (see ursplitter).
+    """
+    assert ur_element.tag == ur.JOB_USAGE_RECORD
+
+    args = [ None ] * N_SLOTS
+    args[INSERT_IDENTITY_SLOT] = insert_identity
+    args[INSERT_HOSTNAME_SLOT] = insert_hostname
+    if insert_time is not None:
+        args[INSERT_TIME_SLOT] = time.strftime(urparser.JSON_DATETIME_FORMAT, insert_time)
+
+    has_processors = False
+    has_node_count = False
+
+    simple = SIMPLE_ELEMENTS
+    compound = COMPOUND_ELEMENTS
+
+    for element in ur_element:
+        tag = element.tag
+        entry = simple.get(tag)
+        if entry is not None:
+            slot, parse = entry
+            args[slot] = parse(element.text)
+            if slot == PROCESSORS_SLOT:
+                has_processors = True
+            elif slot == NODE_COUNT_SLOT:
+                has_node_count = True
+            continue
+        handler = compound.get(tag)
+        if handler is not None:
+            handler(element, args)
+
+    # backwards logger compatability
+    # if node_count is set, but processors is not, processors is set to the value of node_count
+    if has_node_count and not has_processors:
+        args[PROCESSORS_SLOT] = args[NODE_COUNT_SLOT]
+        args[NODE_COUNT_SLOT] = None
+
+    fixLocalJobId(args)
+
+    return args
+
@@ -0,0 +1,162 @@
+"""
+Conversion of usage records in JSON format into insert arguments.
+
+A JSON usage record is an object with the argument names of urcreate (see
+urconverter.ARG_LIST) as keys, e.g.:
+
+{"record_id": "host.example.org:1234", "create_time": "2010-10-15T12:00:00Z",
+ "machine_name": "host.example.org", "wall_duration": 3600, "processors": 8,
+ "vo_name": "atlas", "vo_attributes": [{"group": "/atlas", "role": null}],
+ "memory": [{"amount": 2048, "unit": "MB", "metric": "max", "type": "physical"}]}
+
+Times are ISO 8601 strings, durations are given in seconds (ISO 8601 duration
+strings are also accepted). The values are converted into the same insert
+arguments as the XML path (see urextractor) produces.
+"""
+
+import time
+
+from sgas.generic import jsonrecords
+from sgas.usagerecord import urparser, urconverter, urextractor
+from sgas.usagerecord.memory import SgasMemory
+
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise ValueError('expected string')
+    return value
+
+
+def _dateTime(value):
+    return urparser.parseISODateTime(_string(value))
+
+
+def _duration(value):
+    if isinstance(value, str):
+        return urparser.parseISODuration(value)
+    return int(value)
+
+
+def _int(value):
+    if isinstance(value, str):
+        return urparser.parseInt(value)
+    return int(value)
+
+
+def _boolean(value):
+    if isinstance(value, str):
+        return urparser.parseBoolean(value)
+    return bool(value)
+
+
+def _charge(value):
+    return int(float(value))
+
+
+def _exitCode(value):
+    return _int(value) & 0o377 # equivalent to modulus 256
+
+
+def _host(value):
+    value = _string(value)
+    if len(value) > urextractor.MAX_HOST_LENGTH:
+        return value[:urextractor.MAX_HOST_LENGTH-1] + '$' # dollar marks that the string has been chopped
+    return value
+
+
+def _stringify(value):
+    return str(value) if value is not None else None
+
+
+def _voAttributes(value):
+    vo_attrs = []
+    for attr in value:
+        if isinstance(attr, dict):
+            attr = attr.get('group'), attr.get('role')
+        group, role = attr
+        vo_attrs.append( [ _stringify(group), _stringify(role) ] )
+    return vo_attrs
+
+
+def _stringList(value):
+    return [ _string(v) for v in value ]
+
+
+def _transfers(fields):
+    # fields: (name, parse function) in the order of the transfer array
+    def convert(value):
+        transfers = []
+        for transfer in value:
+            values = []
+            for name, parse in fields:
+                v = transfer.get(name)
+                values.append(_stringify(parse(v) if v is not None and parse is not None else v))
+            transfers.append(values)
+        return transfers
+    return convert
+
+
+def _memory(value):
+    return [ SgasMemory(_int(m['amount']) if m.get('amount') is not None else None,
+                        m.get('unit'), m.get('metric'), m.get('type')) for m in value ]
+
+
+CONVERSIONS = {
+    'record_id'             : _string,
+    'create_time'           : _dateTime,
+    'global_job_id'         : _string,
+    'local_job_id'          : _string,
+    'local_user_id'         : _string,
+    'global_user_name'      : _string,
+    'vo_type'               : _string,
+    'vo_issuer'             : _string,
+    'vo_name'               : _string,
+    'vo_attributes'         : _voAttributes,
+    'machine_name'          : _string,
+    'job_name'              : _string,
+    'charge'                : _charge,
+    'status'                : _string,
+    'queue'                 : _string,
+    'host'                  : _host,
+    'node_count'            : _int,
+    'processors'            : _int,
+    'project_name'          : _string,
+    'submit_host'           : _string,
+    'start_time'            : _dateTime,
+    'end_time'              : _dateTime,
+    'submit_time'           : _dateTime,
+    'cpu_duration'          : _duration,
+    'wall_duration'         : _duration,
+    'user_time'             : _duration,
+    'kernel_time'           : _duration,
+    'major_page_faults'     : _int,
+    'runtime_environments'  : _stringList,
+    'exit_code'             : _exitCode,
+    'downloads'             : _transfers( [ ('url', None), ('size', _int), ('start_time', _dateTime),
+                                            ('end_time', _dateTime), ('bypass_cache', _boolean), ('from_cache', _boolean) ] ),
+    'uploads'               : _transfers( [ ('url', None), ('size', _int), ('start_time', _dateTime), ('end_time', _dateTime) ] ),
+    'memory'                : _memory
+}
+
+CONVERTER = jsonrecords.RecordConverter(urconverter.ARG_LIST, CONVERSIONS, required=('record_id',))
+
+
+
+def parseJSONRecords(usagerecord_data, record_format, insert_identity=None, insert_hostname=None, insert_time=None):
+    """
+    Convert a JSON / NDJSON usage record document into insert arguments.
+    """
+    server_values = {
+        'insert_identity'   : insert_identity,
+        'insert_hostname'   : insert_hostname,
+        'insert_time'       : time.strftime(urparser.JSON_DATETIME_FORMAT, insert_time) if insert_time is not None else None
+    }
+
+    arg_list = []
+    for record in jsonrecords.iterRecords(usagerecord_data, record_format):
+        args = CONVERTER.convert(record, server_values)
+        urextractor.fixLocalJobId(args)
+        arg_list.append(args)
+    return arg_list
+
@@ -6,7 +6,10 @@ Author: Henrik Thostrup Jensen <htj@ndgf.org>
 Copyright: Nordic Data Grid Facility (2010)
 """
 
+import re
 import time
+import datetime
+import functools
 
 from twisted.python import log
 
@@ -19,6 +22,15 @@ from sgas.usagerecord.memory import SgasMemory
 ISO_TIME_FORMAT   = "%Y-%m-%dT%H:%M:%SZ" # if we want to convert back some time
 JSON_DATETIME_FORMAT = "%Y %m %d %H:%M:%S"
 
+# fast path patterns for the common datetime and duration forms, e.g.,
+# 2009-11-12T20:31:27Z and PT86401S / P1DT0H0M1S. Anything else is handled by isodate
+ISO_DATETIME_RX = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.\d+)?(?:(Z)|([+-])(\d\d):(\d\d))?$')
+ISO_DURATION_RX = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+# size of the parse caches (records in a batch tend to share many timestamps)
+DATETIME_CACHE_SIZE = 8192
+DURATION_CACHE_SIZE = 4096
+
 
 
 def parseBoolean(value):
@@ -47,7 +59,19 @@ def parseFloat(value):
         return None
 
 
+def _fastISODuration(value):
+    m = ISO_DURATION_RX.match(value)
+    if m is None or value == 'P' or value.endswith('T'):
+        return None
+    days, hours, minutes, seconds = [ int(g) if g else 0 for g in m.groups() ]
+    return days * 3600*24 + hours * 3600 + minutes * 60 + seconds
+
+
+@functools.lru_cache(maxsize=DURATION_CACHE_SIZE)
 def parseISODuration(value):
+    seconds = _fastISODuration(value)
+    if seconds is not None:
+        return seconds
     try:
         td = isodate.parse_duration(value)
         return (td.days * 3600*24) + td.seconds # screw microseconds
@@ -56,7 +80,29 @@ def parseISODuration(value):
         return None
 
 
+def _fastISODateTime(value):
+    m = ISO_DATETIME_RX.match(value)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second, utc, sign, tz_hour, tz_minute = m.groups()
+    if year < '1000':
+        return None # strftime does not zero pad these, leave them to the full parser
+    try:
+        dt = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+    except ValueError:
+        return None
+    if sign is not None:
+        offset = datetime.timedelta(hours=int(tz_hour), minutes=int(tz_minute))
+        dt = dt - offset if sign == '+' else dt + offset
+        return dt.strftime(JSON_DATETIME_FORMAT)
+    return '%s %s %s %s:%s:%s' % (year, month, day, hour, minute, second)
+
+
+@functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)
 def parseISODateTime(value):
+    json_dt = _fastISODateTime(value)
+    if json_dt is not None:
+        return json_dt
     try:
         dt = isodate.parse_datetime(value)
         return time.strftime(JSON_DATETIME_FORMAT, dt.utctimetuple())
@@ -6,6 +6,7 @@ Author: Henrik Thostrup Jensen <htj@ndgf.org>
 Copyright: Nordic Data Grid Facility (2010)
 """
 
+import io
 
 from xml.etree import cElementTree as ET
 
@@ -43,3 +44,45 @@ def splitURDocument(ur_data):
 
     return usage_records
 
+
+
+def iterURDocument(ur_source):
+    """
+    Streaming variant of splitURDocument. Takes a file-like object (or a
+    string) and yields the usage record elements one at a time as they are
+    parsed. Each element is cleared when the consumer asks for the next one,
+    so the memory usage is bounded by the size of a single record, and not by
+    the size of the document.
+    """
+    if isinstance(ur_source, bytes):
+        ur_source = io.BytesIO(ur_source)
+    elif isinstance(ur_source, str):
+        ur_source = io.StringIO(ur_source)
+
+    root = None
+    depth = 0
+
+    try:
+        for event, element in ET.iterparse(ur_source, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = element
+                    if not element.tag in (ur.USAGE_RECORDS, ur.JOB_USAGE_RECORD):
+                        raise ParseError("Top element is not UsageRecords or JobUsageRecord")
+                elif depth == 2 and root.tag == ur.USAGE_RECORDS:
+                    if not element.tag == ur.JOB_USAGE_RECORD:
+                        raise ParseError("Subelement in UsageRecords doc not a JobUsageRecord")
+                continue
+
+            depth -= 1
+            if depth == 0 and element.tag == ur.JOB_USAGE_RECORD:
+                yield element
+                element.clear()
+            elif depth == 1 and root.tag == ur.USAGE_RECORDS:
+                yield element
+                element.clear()
+                root.remove(element)
+
+    except ET.ParseError as e:
+        raise ParseError("Error parsing ur document (%s)" % str(e))
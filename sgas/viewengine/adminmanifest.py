@@ -63,6 +63,7 @@ class AdminManifestResource(baseview.BaseView):
         ctx = [ (rights.CTX_VIEWGROUP, 'admin') ]
         if self.authorizer.isAllowed(subject, rights.ACTION_VIEW, ctx):
             d = self.retrieveDatabaseStats()
+            resourceutil.cancelOnDisconnect(request, d)
             d.addCallbacks(self.renderAdminManifestPage, self.renderErrorPage, callbackArgs=(request,), errbackArgs=(request,))
             return server.NOT_DONE_YET
         else:
@@ -75,19 +76,19 @@ class AdminManifestResource(baseview.BaseView):
 
         # get database info and schedule future rendering
         for query in [ DB_STATS_QUERY, INSERTS_PER_DAY, MACHINES_UR_INSERTED_RECENT, MACHINES_SR_INSERTED_RECENT, STALE_MACHINES_TWO_MONTHS ]:
-            d = self.urdb.query(query)
+            d = self.urdb.query(query, statement_timeout=self.statement_timeout)
             defs.append(d)
 
-        dl = defer.DeferredList(defs)
+        dl = defer.DeferredList(defs, consumeErrors=True)
         dl.addCallback(self.gotDatabaseResults)
         return dl
 
 
     def gotDatabaseResults(self, results):
 
-        all_success = all( [ r[0] for r in results ] )
-        if not all_success:
-            raise Exception('db error')
+        failures = [ r[1] for r in results if not r[0] ]
+        if failures:
+            failures[0].raiseException()
 
         results = [ r[1] for r in results ]
         return results
@@ -7,11 +7,15 @@ Copyright: Nordic Data Grid Facility (2011)
 
 
 from twisted.python import failure, log
+from twisted.internet import defer
 from twisted.web import server, resource
 
 from sgas.viewengine import html
 
 
+# manifest property, queries running for longer are cancelled by the database
+STATEMENT_TIMEOUT = 'statement_timeout'
+
 
 class ViewError(Exception):
     """
@@ -29,6 +33,9 @@ class BaseView(resource.Resource):
         self.urdb = urdb
         self.authorizer = authorizer
         self.manifest = manifest
+        self.statement_timeout = None
+        if manifest.hasProperty(STATEMENT_TIMEOUT):
+            self.statement_timeout = manifest.getProperty(STATEMENT_TIMEOUT)
 
 
     def renderAuthzErrorPage(self, request, pagename, subject):
@@ -44,12 +51,15 @@ class BaseView(resource.Resource):
     def renderErrorPage(self, error, request):
 
         if isinstance(error, failure.Failure):
+            if error.check(defer.CancelledError):
+                log.msg('Client disconnected, query cancelled', system='sgas.View')
+                return
             error_msg = error.getErrorMessage()
         else:
             error_msg = str(error)
 
         log.err(error)
-        request.write('Error rendering page: %s' % error_msg)
+        request.write(('Error rendering page: %s' % error_msg).encode('utf-8'))
         request.finish()
         return server.NOT_DONE_YET
 
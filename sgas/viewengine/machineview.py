@@ -88,6 +88,7 @@ class MachineListView(baseview.BaseView):
         # authz check
         if self.authorizer.hasRelevantRight(subject, rights.ACTION_VIEW):
             d = self.retrieveMachineList()
+            resourceutil.cancelOnDisconnect(request, d)
             d.addCallbacks(self.renderMachineList, self.renderErrorPage, callbackArgs=(request,), errbackArgs=(request,))
             return server.NOT_DONE_YET
         else:
@@ -96,7 +97,7 @@ class MachineListView(baseview.BaseView):
 
     def retrieveMachineList(self):
 
-        d = self.urdb.query(QUERY_MACHINE_LIST)
+        d = self.urdb.query(QUERY_MACHINE_LIST, statement_timeout=self.statement_timeout)
         return d
 
 
@@ -121,6 +122,8 @@ class MachineListView(baseview.BaseView):
 
     def renderErrorPage(self, error, request):
 
+        if error.check(defer.CancelledError):
+            return
         request.write(('Error rendering page: %s' % str(error)).encode('utf-8'))
         request.finish()
         return server.NOT_DONE_YET
@@ -148,6 +151,7 @@ class MachineView(baseview.BaseView):
         start_date, end_date = dateform.parseStartEndDates(request)
         print(start_date,end_date)
         d = self.retrieveMachineInfo(start_date, end_date)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallbacks(self.renderMachineView, self.renderErrorPage, callbackArgs=(request,), errbackArgs=(request,))
         return server.NOT_DONE_YET
 
@@ -156,17 +160,26 @@ class MachineView(baseview.BaseView):
 
         defs = []
         for query in [ QUERY_MACHINE_MANIFEST, QUERY_EXECUTED_JOBS_PER_DAY ]:
-            d = self.urdb.query(query, (self.machine_name,) )
+            d = self.urdb.query(query, (self.machine_name,), statement_timeout=self.statement_timeout)
             defs.append(d)
 
         for query in [ QUERY_TOP10_PROJECTS, QUERY_TOP20_USERS ]:
-            d = self.urdb.query(query, [self.machine_name, start_date, end_date] )
+            d = self.urdb.query(query, [self.machine_name, start_date, end_date], statement_timeout=self.statement_timeout)
             defs.append(d)
 
-        dl = defer.DeferredList(defs)
+        dl = defer.DeferredList(defs, consumeErrors=True)
+        dl.addCallback(self.gotDatabaseResults)
         return dl
 
 
+    def gotDatabaseResults(self, results):
+
+        failures = [ r[1] for r in results if not r[0] ]
+        if failures:
+            failures[0].raiseException()
+        return results
+
+
     def renderMachineView(self, results, request):
 
         machine_manifest = results[0][1][0]
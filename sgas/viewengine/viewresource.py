@@ -6,12 +6,13 @@ Copyright: Nordic Data Grid Facility (2010)
 """
 
 from twisted.python import log
+from twisted.internet import defer
 from twisted.web import resource, server
 
 from sgas.database import error as dberror
 from sgas.authz import rights as authzrights, ctxsetchecker
 from sgas.server import config, resourceutil
-from sgas.viewengine import html, pagebuilder, adminmanifest, machineview, rights
+from sgas.viewengine import html, pagebuilder, adminmanifest, machineview, baseview, rights
 
 from sgas.viewengine import viewdefinition
 from sgas.viewengine import manifest
@@ -20,21 +21,29 @@ import time
 
 # generic error handler
 def handleViewError(error, request, view_name):
+    if error.check(defer.CancelledError):
+        log.msg('Client disconnected, query for view %s cancelled' % view_name, system='sgas.ViewResource')
+        return
     error_msg = error.getErrorMessage()
     if error.check(dberror.DatabaseUnavailableError):
         error.printTraceback()
         log.err(error, system='sgas.ViewResource')
         request.setResponseCode(503)
         error_msg = 'Database is currently unavailable, please try again later'
+    elif error.check(dberror.QueryTimeoutError):
+        log.msg('Query for view %s timed out' % view_name, system='sgas.ViewResource')
+        request.setResponseCode(504)
+        error_msg = 'The query for the view took too long, try a shorter period'
     else:
         log.err(error, system='sgas.ViewResource')
         request.setResponseCode(500)
 
-    request.write(error_msg)
+    request.write(error_msg.encode('utf-8'))
     request.finish()
 
 PLUGIN_CFG_BLOCK = "plugin:view"     
 WLCG_CONFIG_FILE = 'wlcg_config_file'
+STATEMENT_TIMEOUT = 'statement_timeout'
 
 
 class ViewTopResource(resource.Resource):
@@ -58,10 +67,12 @@ class ViewTopResource(resource.Resource):
     
         if cfg.has_option(PLUGIN_CFG_BLOCK, WLCG_CONFIG_FILE):
             mfst.setProperty('wlcg_config_file', cfg.get(PLUGIN_CFG_BLOCK, WLCG_CONFIG_FILE))
+        if cfg.has_option(PLUGIN_CFG_BLOCK, STATEMENT_TIMEOUT):
+            mfst.setProperty(baseview.STATEMENT_TIMEOUT, cfg.get(PLUGIN_CFG_BLOCK, STATEMENT_TIMEOUT))
 
         self.putChild('adminmanifest'.encode('utf-8'), adminmanifest.AdminManifestResource(self.urdb, authorizer, mfst))
         self.putChild('machines'.encode('utf-8'), machineview.MachineListView(self.urdb, authorizer, mfst))
-        self.putChild('custom'.encode('utf-8'), CustomViewTopResource(self.urdb, authorizer, self.views))
+        self.putChild('custom'.encode('utf-8'), CustomViewTopResource(self.urdb, authorizer, self.views, mfst))
         
         if mfst.hasProperty(WLCG_CONFIG_FILE):
             from sgas.viewengine import wlcgview
@@ -111,7 +122,7 @@ class ViewTopResource(resource.Resource):
 
 class CustomViewTopResource(resource.Resource):
 
-    def __init__(self, urdb, authorizer, views):
+    def __init__(self, urdb, authorizer, views, mfst):
         resource.Resource.__init__(self)
         self.urdb = urdb
         self.authorizer = authorizer
@@ -119,17 +130,20 @@ class CustomViewTopResource(resource.Resource):
         self.views = views
 
         for view in self.views:
-            self.putChild(view.view_name.encode('utf-8'), GraphRenderResource(view, urdb, authorizer))
+            self.putChild(view.view_name.encode('utf-8'), GraphRenderResource(view, urdb, authorizer, mfst))
 
 
 
 class GraphRenderResource(resource.Resource):
 
-    def __init__(self, view, urdb, authorizer):
+    def __init__(self, view, urdb, authorizer, mfst):
         resource.Resource.__init__(self)
         self.view = view
         self.urdb = urdb
         self.authorizer = authorizer
+        self.statement_timeout = None
+        if mfst.hasProperty(baseview.STATEMENT_TIMEOUT):
+            self.statement_timeout = mfst.getProperty(baseview.STATEMENT_TIMEOUT)
 
 
     def render_GET(self, request):
@@ -157,7 +171,8 @@ class GraphRenderResource(resource.Resource):
             request.write(page_body.encode('utf-8'))
             request.finish()
 
-        d = self.urdb.query(self.view.query)
+        d = self.urdb.query(self.view.query, statement_timeout=self.statement_timeout, coalesce=True)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallback(gotResult)
         d.addErrback(handleViewError, request, self.view.view_name)
         return server.NOT_DONE_YET
@@ -247,7 +247,8 @@ class WLCGBaseView(baseview.BaseView):
     def __init__(self, urdb, authorizer, mfst, path):
         self.path = path
         baseview.BaseView.__init__(self, urdb, authorizer, mfst)
-        self.wlcgdb = wlcg.WLCG(urdb)
+        # many people look at the same views at the same time (start of month)
+        self.wlcgdb = wlcg.WLCG(urdb, statement_timeout=self.statement_timeout, coalesce=True)
 
 
     def render_GET(self, request):
@@ -262,6 +263,7 @@ class WLCGBaseView(baseview.BaseView):
         start_date, end_date = dateform.parseStartEndDates(request)
         t_query_start = time.time()
         d = self.retrieveWLCGData(start_date, end_date)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallback(self.renderWLCGViewPage, request, start_date, end_date, t_query_start)
         d.addErrback(self.renderErrorPage, request)
         return server.NOT_DONE_YET
@@ -500,6 +502,7 @@ class WLCGOversightView(WLCGBaseView):
 
         t_query_start = time.time()
         d = self.retrieveWLCGData(start_date, end_date, unit)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallback(self.renderWLCGViewPage, request, start_date, end_date, unit, t_query_start)
         d.addErrback(self.renderErrorPage, request)
         return server.NOT_DONE_YET
@@ -748,6 +751,7 @@ class WLCGStorageView(baseview.BaseView):
 
         t_query_start = time.time()
         d = self.retrieveWLCGData(date)
+        resourceutil.cancelOnDisconnect(request, d)
         d.addCallback(self.renderWLCGViewPage, request, date, media, t_query_start)
         d.addErrback(self.renderErrorPage, request)
         return server.NOT_DONE_YET
@@ -755,7 +759,7 @@ class WLCGStorageView(baseview.BaseView):
 
     def retrieveWLCGData(self, date):
 
-        d = self.urdb.query(self.WLCG_STORAGE_QUERY, {'timestamp': date } )
+        d = self.urdb.query(self.WLCG_STORAGE_QUERY, {'timestamp': date }, statement_timeout=self.statement_timeout, coalesce=True)
         return d
 
 
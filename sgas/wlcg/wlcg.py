@@ -134,10 +134,11 @@ class _DB():
 
 class WLCG:
     
-    def __init__(self, db=None, db_host=None, db_name=None, db_username=None, db_password=None):
+    def __init__(self, db=None, db_host=None, db_name=None, db_username=None, db_password=None, statement_timeout=None, coalesce=False):
         """
         The caller should provide either a pre-initialized 'db'-object, which has a 'query' method,
         or db_host, db_name, db_username and db_password for us to initialize a db session ourselves.
+        A statement_timeout and coalesce are passed on to the query method of the 'db'-object.
         """
 
         assert db or (db_host and db_name and db_username and db_password)
@@ -147,6 +148,8 @@ class WLCG:
         else:
             self.db = _DB(db_host, db_name, db_username, db_password)
 
+        self.statement_timeout = statement_timeout
+        self.coalesce = coalesce
         self.query = ""
         self.query_args = []
 
@@ -164,7 +167,12 @@ class WLCG:
         query_args = deepcopy(self.query_args)
         self.query = ""
         self.query_args = []
-        return self.db.query(query, query_args);
+        kwargs = {}
+        if self.statement_timeout is not None:
+            kwargs['statement_timeout'] = self.statement_timeout
+        if self.coalesce:
+            kwargs['coalesce'] = True
+        return self.db.query(query, query_args, **kwargs)
 
 
     def clear_query(self):
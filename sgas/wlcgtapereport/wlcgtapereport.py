@@ -74,8 +74,8 @@ class WLCGTapeReport(resource.Resource):
 
 
     def render_GET(self, request):
-        hostname = resourceutil.getHostname(request)
-        log.msg('Accepted query request from %s' % hostname, system='sgas.WLCGTapeReport')
+        d = resourceutil.getHostname(request)
+        d.addCallback(lambda hostname : log.msg('Accepted query request from %s' % hostname, system='sgas.WLCGTapeReport'))
 
         def gotDatabaseResult(rows):
 
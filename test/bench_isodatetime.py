@@ -0,0 +1,65 @@
+#
+# Microbenchmark for ISO 8601 datetime and duration parsing.
+#
+# Compares the urparser parse functions (fast path + cache) with the plain
+# isodate path, on the timestamps and durations found in the sample usage
+# records. Run with: python -m test.bench_isodatetime
+
+import re
+import time
+import timeit
+
+from sgas.ext import isodate
+from sgas.usagerecord import urparser
+
+from . import ursampledata
+
+
+
+ITERATIONS = 2000
+
+DATETIME_RX = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d[^<"]*')
+DURATION_RX = re.compile(r'>(P[0-9YMDTHS.]+)<')
+
+
+def sampleValues():
+    data = ''.join( [ v for k, v in vars(ursampledata).items() if k.isupper() and isinstance(v, str) ] )
+    return DATETIME_RX.findall(data), DURATION_RX.findall(data)
+
+
+def isodateDateTime(value):
+    dt = isodate.parse_datetime(value)
+    return time.strftime(urparser.JSON_DATETIME_FORMAT, dt.utctimetuple())
+
+
+def isodateDuration(value):
+    td = isodate.parse_duration(value)
+    return (td.days * 3600*24) + td.seconds
+
+
+def run(name, func, values):
+    t = timeit.timeit(lambda: [ func(v) for v in values ], number=ITERATIONS)
+    n = ITERATIONS * len(values)
+    print('%-32s %8.3f s  %8.2f us/value' % (name, t, t / n * 1e6))
+
+
+def uncached(func):
+    def parse(value):
+        func.cache_clear()
+        return func(value)
+    return parse
+
+
+if __name__ == '__main__':
+
+    datetimes, durations = sampleValues()
+    print('%i datetime values, %i duration values, %i iterations' % (len(datetimes), len(durations), ITERATIONS))
+
+    run('datetime: isodate',            isodateDateTime, datetimes)
+    run('datetime: fast path',          uncached(urparser.parseISODateTime), datetimes)
+    run('datetime: fast path + cache',  urparser.parseISODateTime, datetimes)
+
+    run('duration: isodate',            isodateDuration, durations)
+    run('duration: fast path',          uncached(urparser.parseISODuration), durations)
+    run('duration: fast path + cache',  urparser.parseISODuration, durations)
+
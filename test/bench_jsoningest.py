@@ -0,0 +1,57 @@
+#
+# Benchmark of usage record ingest formats.
+#
+# Compares parsing a batch of usage records into insert arguments from OGF-UR
+# XML (the registration parser), JSON and NDJSON. The batch consists of copies
+# of the URT sample record, with unique record ids.
+# Run with: python -m test.bench_jsoningest [number of records]
+
+import sys
+import json
+import time
+import timeit
+
+from sgas.generic import jsonrecords
+from sgas.usagerecord import jobinsertresource, urjson
+
+from . import ursampledata
+from .test_jsoningest import URT_JSON
+
+
+
+ITERATIONS = 5
+DEFAULT_RECORDS = 10000
+
+
+def createBatches(n_records):
+    record = ursampledata.URT.split('?>', 1)[-1].strip()
+    records = [ record.replace('zalizo.uio.no:21305', 'zalizo.uio.no:%i' % i) for i in range(n_records) ]
+    xml = ('<?xml version="1.0" encoding="UTF-8" ?>\n'
+           '<UsageRecords xmlns="http://schema.ogf.org/urf/2003/09/urf">\n' + '\n'.join(records) + '\n</UsageRecords>\n').encode('utf-8')
+
+    json_records = [ dict(URT_JSON, record_id='zalizo.uio.no:%i' % i) for i in range(n_records) ]
+    json_doc = json.dumps(json_records).encode('utf-8')
+    ndjson_doc = ('\n'.join( [ json.dumps(r) for r in json_records ] ) + '\n').encode('utf-8')
+    return xml, json_doc, ndjson_doc
+
+
+def run(name, parse, n_records):
+    insert_time = time.gmtime()
+    arg_list = parse(insert_time)
+    assert len(arg_list) == n_records, '%s: got %i records' % (name, len(arg_list))
+    t = timeit.timeit(lambda: parse(insert_time), number=ITERATIONS) / ITERATIONS
+    print('%-8s %8.3f s  %8.2f us/record  %8.0f records/s' % (name, t, t / n_records * 1e6, n_records / t))
+    return t
+
+
+if __name__ == '__main__':
+
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RECORDS
+    xml, json_doc, ndjson_doc = createBatches(n_records)
+    print('%i records, xml %i bytes, json %i bytes, ndjson %i bytes' % (n_records, len(xml), len(json_doc), len(ndjson_doc)))
+
+    t_xml = run('xml', lambda it: jobinsertresource.parseJobUsageRecords(xml, 'bench', 'localhost', it), n_records)
+    t_json = run('json', lambda it: urjson.parseJSONRecords(json_doc, jsonrecords.JSON, 'bench', 'localhost', it), n_records)
+    t_ndjson = run('ndjson', lambda it: urjson.parseJSONRecords(ndjson_doc, jsonrecords.NDJSON, 'bench', 'localhost', it), n_records)
+
+    print('json is %.1fx, ndjson %.1fx faster than xml' % (t_xml / t_json, t_xml / t_ndjson))
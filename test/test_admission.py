@@ -0,0 +1,58 @@
+#
+# Insert admission control unit tests
+
+from twisted.trial import unittest
+
+from sgas.generic import admission
+
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def testUnlimited(self):
+
+        ac = admission.AdmissionController('test')
+        for i in range(100):
+            ac.admit('host%i' % (i % 3))
+            ac.reserveRecords(1000)
+        self.failUnlessEqual(ac.getStatistics(), {'inserts': 100, 'records': 100000, 'identities': 3, 'rejected': 0})
+
+
+    def testInsertLimits(self):
+
+        ac = admission.AdmissionController('test', max_inserts=3, max_per_identity=2, retry_after=10)
+        ac.admit('host1')
+        ac.admit('host1')
+
+        try:
+            ac.admit('host1')
+            self.fail('Third insert from host1 should have been rejected')
+        except admission.AdmissionError as e:
+            self.failUnlessEqual(e.code, admission.HTTP_TOO_MANY_REQUESTS)
+            self.failUnless(10 <= e.retry_after <= 20)
+
+        ac.admit('host2')
+        try:
+            ac.admit('host3')
+            self.fail('Fourth insert should have been rejected')
+        except admission.AdmissionError as e:
+            self.failUnlessEqual(e.code, admission.HTTP_SERVICE_UNAVAILABLE)
+
+        ac.release('host1')
+        ac.admit('host3')
+        ac.release('host1')
+        ac.release('host2')
+        ac.release('host3')
+        self.failUnlessEqual(ac.getStatistics(), {'inserts': 0, 'records': 0, 'identities': 0, 'rejected': 2})
+
+
+    def testRecordLimit(self):
+
+        ac = admission.AdmissionController('test', max_records=100)
+        ac.reserveRecords(250) # a single large batch is let through
+        self.failUnlessRaises(admission.AdmissionError, ac.reserveRecords, 1)
+        ac.releaseRecords(250)
+        ac.reserveRecords(60)
+        self.failUnlessRaises(admission.AdmissionError, ac.reserveRecords, 41)
+        ac.reserveRecords(40)
+
@@ -0,0 +1,229 @@
+#
+# Aggregation updater unit tests
+
+import configparser
+
+import psycopg2
+import psycopg2.extensions
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+
+from sgas.database.postgresql import database
+from sgas.usagerecord import updater
+from sgas.server.config import ConfigurationError
+
+
+
+class FakeTransaction:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.result = None
+
+    def execute(self, sql, args=None):
+        self.pool.log.append(sql % args if args else sql)
+
+    def callproc(self, proc):
+        if self.pool.failures:
+            self.pool.failures -= 1
+            raise psycopg2.extensions.TransactionRollbackError('could not serialize access')
+        if self.pool.slices:
+            self.result = [ (self.pool.slices.pop(0),) ]
+        else:
+            self.result = [ (None,) ]
+
+    def fetchall(self):
+        return self.result
+
+
+
+class FakePool:
+    # interactions complete in a later reactor iteration, so workers interleave
+
+    def __init__(self, slices, failures=0):
+        self.slices = slices
+        self.failures = failures
+        self.log = []
+        self.running = 0
+        self.max_running = 0
+
+    def runInteraction(self, f, *args):
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        def run():
+            self.running -= 1
+            return f(FakeTransaction(self), *args)
+        return task.deferLater(reactor, 0, run)
+
+
+
+class FakePoolProxy:
+
+    def __init__(self, pool):
+        self.dbpool = pool
+
+
+
+class ParallelAggregationTest(unittest.TestCase):
+
+    def createDatabase(self, pool):
+        db = database.PostgreSQLDatabase.__new__(database.PostgreSQLDatabase)
+        db.pools = { database.AGGREGATION_POOL: FakePoolProxy(pool) }
+        return db
+
+
+    @defer.inlineCallbacks
+    def testWorkers(self):
+
+        pool = FakePool( [ ['2010-10-%02i' % (i + 1), str(i % 3)] for i in range(10) ] )
+        db = self.createDatabase(pool)
+        updates = yield db.updateAggregator('update_uraggregate', workers=3, work_mem='64MB')
+        self.failUnlessEqual(updates, 10)
+        self.failUnlessEqual(pool.slices, [])
+        self.failUnlessEqual(pool.max_running, 3)
+        self.failUnless("SET LOCAL work_mem = 64MB" in pool.log)
+
+
+    @defer.inlineCallbacks
+    def testRetrySerializationFailure(self):
+
+        self.patch(database, 'SERIALIZATION_BACKOFF', 0.001)
+        pool = FakePool( [ ['2010-10-01', '1'], ['2010-10-02', '1'] ], failures=2)
+        db = self.createDatabase(pool)
+        updates = yield db.updateAggregator('update_uraggregate', workers=1)
+        self.failUnlessEqual(updates, 2)
+        self.failUnlessEqual(pool.failures, 0)
+
+
+    @defer.inlineCallbacks
+    def testSerializationFailureLimit(self):
+
+        self.patch(database, 'SERIALIZATION_BACKOFF', 0.001)
+        pool = FakePool( [ ['2010-10-01', '1'] ], failures=database.SERIALIZATION_RETRIES + 1)
+        db = self.createDatabase(pool)
+        # the updater backs off, and tries again later
+        yield self.failUnlessFailure(db.updateAggregator('update_uraggregate', workers=1),
+                                     psycopg2.extensions.TransactionRollbackError)
+        self.failUnlessEqual(pool.failures, 0)
+        self.flushLoggedErrors(psycopg2.extensions.TransactionRollbackError)
+
+
+
+class FakeDatabase:
+
+    def __init__(self):
+        self.queue = 0
+        self.monthly_queue = 0
+        self.runs = []
+        self.monthly_runs = []
+        self.aggregation_generation = 0
+        self.fail = False
+
+    def updateAggregator(self, aggregator, service, workers, work_mem):
+        if aggregator == updater.MONTHLY_AGGREGATOR:
+            self.monthly_runs.append(self.monthly_queue)
+            months, self.monthly_queue = self.monthly_queue, 0
+            return defer.succeed(months)
+        self.runs.append(self.queue)
+        if self.fail:
+            return defer.fail(psycopg2.OperationalError('connection refused'))
+        # each updated slice marks a month for the monthly rollup
+        slices, self.queue = self.queue, 0
+        self.monthly_queue += min(slices, 1)
+        return defer.succeed(slices)
+
+    def query(self, query, pool=database.READ_POOL):
+        return defer.succeed( [ [self.queue, None, self.monthly_queue] ] )
+
+    def aggregationUpdated(self):
+        self.aggregation_generation += 1
+
+
+
+class AggregationUpdaterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.db = FakeDatabase()
+        self.updater = updater.AggregationUpdater(self.db, debounce=20, clock=self.clock)
+        self.updater.startService()
+
+
+    def tearDown(self):
+        return self.updater.stopService()
+
+
+    def testDebounce(self):
+
+        self.clock.advance(20) # startup update
+        self.failUnlessEqual(self.db.runs, [0])
+        self.failUnlessEqual(self.updater.state, updater.IDLE)
+
+        for i in range(3):
+            self.db.queue += 1
+            self.updater.updateNotification()
+            self.clock.advance(5)
+        self.failUnlessEqual(self.updater.state, updater.SCHEDULED)
+        self.clock.advance(5)
+        self.failUnlessEqual(self.db.runs, [0, 3]) # one update for all three inserts
+        self.failUnlessEqual(self.db.monthly_runs, [0, 1]) # monthly rollup updated after the slices
+        self.failUnlessEqual(self.db.aggregation_generation, 1) # cached query results are stale
+        self.failUnlessEqual(self.updater.state, updater.IDLE)
+
+        stats = self.updater.getStatistics()
+        self.failUnlessEqual((stats['slices'], stats['last_slices'], stats['queue_length'], stats['lag']), (3, 3, 0, 0))
+        self.failUnlessEqual((stats['months'], stats['monthly_queue_length']), (1, 0))
+
+
+    def testIdlePoll(self):
+
+        self.clock.advance(20) # startup update
+        self.failUnlessEqual(self.updater.state, updater.IDLE)
+
+        # months queued outside SGAS (sgas-aggregation-rebuild swap), without notification
+        self.db.monthly_queue = 12
+        self.clock.advance(updater.IDLE_POLL_INTERVAL)
+        self.failUnlessEqual(self.updater.state, updater.SCHEDULED)
+        self.clock.advance(20)
+        self.failUnlessEqual(self.db.monthly_runs, [0, 12])
+        self.failUnlessEqual(self.db.aggregation_generation, 1) # cached query results are stale
+        self.failUnlessEqual(self.updater.state, updater.IDLE)
+
+
+    def testAdaptiveDebounce(self):
+
+        self.failUnlessEqual(self.updater.debounceDelay(), 20)
+        self.updater.queue_length = 50
+        self.failUnlessEqual(self.updater.debounceDelay(), 10)
+        self.updater.queue_length = 5000
+        self.failUnlessEqual(self.updater.debounceDelay(), updater.MIN_DEBOUNCE)
+
+
+    def testBackoff(self):
+
+        self.db.fail = True
+        self.clock.advance(20)
+        self.failUnlessEqual(self.updater.state, updater.BACKOFF)
+        self.clock.advance(updater.MIN_BACKOFF)
+        self.clock.advance(updater.MIN_BACKOFF * 2)
+        self.failUnlessEqual(len(self.db.runs), 3)
+        self.failUnlessEqual(self.updater.getStatistics()['failures'], 3)
+
+        self.db.fail = False
+        self.clock.advance(updater.MIN_BACKOFF * 4)
+        self.failUnlessEqual(len(self.db.runs), 4)
+        self.failUnlessEqual(self.updater.state, updater.IDLE)
+        self.failUnlessEqual(self.updater.getStatistics()['failures'], 0)
+
+
+
+    def testConfiguration(self):
+
+        cfg = configparser.ConfigParser()
+        cfg.read_string('[plugin:ur]\naggregation_workers=4\naggregation_mode=Delta\n')
+        u = updater.createAggregationUpdater(cfg, 'plugin:ur', self.db)
+        self.failUnlessEqual((u.workers, u.mode), (4, updater.MODE_DELTA))
+
+        cfg.set('plugin:ur', 'aggregation_mode', 'sometimes')
+        self.failUnlessRaises(ConfigurationError, updater.createAggregationUpdater, cfg, 'plugin:ur', self.db)
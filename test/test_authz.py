@@ -6,7 +6,7 @@
 
 from twisted.trial import unittest
 
-from sgas.authz import engine, rights
+from sgas.authz import engine, rights, ctxsetchecker
 
 # includes all basic authz types and some basic combinations
 # there will probably be more later
@@ -260,3 +260,74 @@ class AuthzTest(unittest.TestCase):
         self.failUnlessFalse( self.authz.isAllowed('bot1',  rights.ACTION_STORAGE_INSERT, [( rights.CTX_STORAGE_SYSTEM, 'shost1')]) )
 
 
+
+
+
+class AuthzDecisionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        rights.Rights().addActions('testaction')
+        rights.Rights().addOptions('testaction', [ rights.OPTION_ALL ])
+        self.authz = engine.AuthorizationEngine(insert_check_depth=2, log_mode=engine.LOG_NONE)
+        self.authz.addChecker('testaction', ctxsetchecker.AnySetChecker)
+        self.authz.parseAuthzData('"user1"     testaction:machine_name=host1;host2\n')
+
+
+    def testCache(self):
+
+        ctx = [ ('machine_name', 'host1') ]
+        self.failUnless( self.authz.isAllowed('user1', 'testaction', ctx) )
+        self.failUnless( self.authz.isAllowed('user1', 'testaction', list(reversed(ctx))) )
+        self.failIf    ( self.authz.isAllowed('user1', 'testaction', [ ('machine_name', 'host3') ]) )
+        self.failIf    ( self.authz.isAllowed('user2', 'testaction', ctx) )
+
+        s = self.authz.getStatistics()
+        self.failUnlessEqual( (s['hits'], s['misses'], s['cached_decisions']), (1, 3, 3) )
+
+
+    def testReload(self):
+
+        ctx = [ ('machine_name', 'host3') ]
+        self.failIf( self.authz.isAllowed('user1', 'testaction', ctx) )
+
+        # new rights must not be answered from the cache
+        self.authz.authz_rights = {}
+        self.authz.parseAuthzData('"user1"     testaction:all\n')
+        self.failUnlessEqual(self.authz.getStatistics()['cached_decisions'], 0)
+        self.failUnless( self.authz.isAllowed('user1', 'testaction', ctx) )
+
+
+    def testReloadFile(self):
+
+        authz_file = self.mktemp()
+        with open(authz_file, 'w') as f:
+            f.write('"user2"     testaction:all\n')
+        self.authz.authz_file = authz_file
+
+        ctx = [ ('machine_name', 'host3') ]
+        self.authz.reloadAuthzFile()
+        self.failIf    ( self.authz.isAllowed('user1', 'testaction', [ ('machine_name', 'host1') ]) )
+        self.failUnless( self.authz.isAllowed('user2', 'testaction', ctx) )
+
+        # a failed parse must keep the current rights
+        def failParse(action_desc, user_authz_rights):
+            raise ValueError('parse failure')
+        self.patch(self.authz, '_parseActions', failParse)
+        self.authz.reloadAuthzFile()
+        self.failUnlessEqual(list(self.authz.authz_rights.keys()), ['user2'])
+        self.failUnless( self.authz.isAllowed('user2', 'testaction', ctx) )
+
+
+    def testListContext(self):
+
+        # query arguments, as given by the query resource
+        self.authz.addChecker('testaction', ctxsetchecker.AllSetChecker)
+        allowed = { 'machine_name': [ b'host1', b'host2' ] }
+        denied  = { 'machine_name': [ b'host1', b'host3' ] }
+
+        self.failUnless( self.authz.isAllowed('user1', 'testaction', allowed.items()) )
+        self.failIf    ( self.authz.isAllowed('user1', 'testaction', denied.items()) )
+        self.failUnless( self.authz.isAllowed('user1', 'testaction', allowed.items()) )
+
+        s = self.authz.getStatistics()
+        self.failUnlessEqual( (s['hits'], s['misses'], s['cached_decisions']), (1, 2, 2) )
@@ -0,0 +1,89 @@
+#
+# Bulk insert unit tests (COPY encoding and duplicate collapsing)
+
+import time
+
+from twisted.trial import unittest
+
+from sgas.database.postgresql import pgcopy
+from sgas.usagerecord import ursplitter, urparser, urconverter
+from sgas.usagerecord.memory import SgasMemory
+
+from . import ursampledata
+
+
+
+def createArguments(ur_data):
+    insert_time = time.gmtime()
+    docs = [ urparser.xmlToDict(e, insert_time=insert_time) for e in ursplitter.splitURDocument(ur_data) ]
+    return urconverter.createInsertArguments(docs)
+
+
+
+class CopyEncodingTest(unittest.TestCase):
+
+    def testScalars(self):
+
+        self.failUnlessEqual(pgcopy.encodeValue(None), '\\N')
+        self.failUnlessEqual(pgcopy.encodeValue(42), '42')
+        self.failUnlessEqual(pgcopy.encodeValue(True), 't')
+        self.failUnlessEqual(pgcopy.encodeValue('a\tb\nc\\d'), 'a\\tb\\nc\\\\d')
+
+
+    def testArrays(self):
+
+        self.failUnlessEqual(pgcopy.encodeValue(['a', None, 'b"c']), '{"a",NULL,"b\\\\"c"}')
+        self.failUnlessEqual(pgcopy.encodeValue([['/vo', None]]), '{{"/vo",NULL}}')
+
+
+    def testMemory(self):
+
+        memory = SgasMemory(2, 'KB', 'max', 'physical')
+        self.failUnlessEqual(pgcopy.encodeValue([memory]), '{"(\\\\"2048\\\\",\\\\"max\\\\",\\\\"physical\\\\")"}')
+
+
+    def testReader(self):
+
+        args = createArguments(ursampledata.CUR)
+        data = pgcopy.CopyReader(args).read()
+        self.failUnlessEqual(len(data.splitlines()), len(args))
+        for line in data.splitlines():
+            self.failUnlessEqual(len(line.split('\t')), len(urconverter.ARG_LIST))
+
+        # chunked reads must produce the same data
+        reader = pgcopy.CopyReader(args)
+        chunks = []
+        while True:
+            chunk = reader.read(17)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.failUnlessEqual(''.join(chunks), data)
+
+
+
+class CollapseDuplicatesTest(unittest.TestCase):
+
+    def createArg(self, record_id, global_job_id):
+        arg = [ None ] * len(urconverter.ARG_LIST)
+        arg[urconverter.ARG_LIST.index('record_id')] = record_id
+        arg[urconverter.ARG_LIST.index('global_job_id')] = global_job_id
+        return arg
+
+
+    def testReplacement(self):
+
+        first    = self.createArg('r1', 'gj1')
+        same     = self.createArg('r1', 'gj1')
+        minimal  = self.createArg('r1', 'r1')
+        replace  = self.createArg('r1', 'gj2')
+        other    = self.createArg('r2', None)
+
+        args = urconverter.collapseDuplicates([first, same, minimal, other])
+        self.failUnlessEqual(len(args), 2)
+        self.failUnlessIdentical(args[0], first)
+
+        args = urconverter.collapseDuplicates([first, replace, other])
+        self.failUnlessEqual(len(args), 2)
+        self.failUnlessIdentical(args[0], replace)
+
@@ -0,0 +1,83 @@
+#
+# Chunked insert unit tests
+
+import psycopg2
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from sgas.database.postgresql import database
+
+
+
+class FakeTransaction:
+
+    def __init__(self, log):
+        self.log = log
+        self.result = None
+
+    def execute(self, sql):
+        self.log.append(sql)
+
+    def callproc(self, proc, args):
+        if args[1] == 'bad':
+            raise psycopg2.DataError('invalid value for %s' % args[0])
+        self.result = [ ([args[0], int(args[0][1:])],) ]
+
+    def fetchall(self):
+        return self.result
+
+
+
+class FakePool:
+
+    def __init__(self):
+        self.log = []
+        self.interactions = 0
+
+    def runInteraction(self, f, *args):
+        self.interactions += 1
+        try:
+            return defer.succeed(f(FakeTransaction(self.log), *args))
+        except Exception:
+            return defer.fail()
+
+
+
+class FakePoolProxy:
+
+    def __init__(self):
+        self.dbpool = FakePool()
+
+
+
+class ChunkInsertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database.PostgreSQLDatabase.__new__(database.PostgreSQLDatabase)
+        self.db.pool_proxy = FakePoolProxy()
+
+
+    @defer.inlineCallbacks
+    def testChunks(self):
+
+        arg_list = [ ('r%i' % i, 'ok') for i in range(10) ]
+        result = yield self.db.recordChunkInserter('test', 'testcreate', arg_list, 4)
+        self.failUnlessEqual(result, dict( [ ('r%i' % i, str(i)) for i in range(10) ] ))
+        self.failUnlessEqual(result.rejected, {})
+        self.failUnlessEqual(self.db.pool_proxy.dbpool.interactions, 3)
+        self.failUnlessEqual(self.db.pool_proxy.dbpool.log, []) # no savepoints needed
+
+
+    @defer.inlineCallbacks
+    def testRejected(self):
+
+        arg_list = [ ('r%i' % i, 'bad' if i in (2, 5) else 'ok') for i in range(10) ]
+        result = yield self.db.recordChunkInserter('test', 'testcreate', arg_list, 4)
+        self.failUnlessEqual(sorted(result.keys()), [ 'r%i' % i for i in range(10) if i not in (2, 5) ])
+        self.failUnlessEqual(sorted(result.rejected.keys()), [ 'r2', 'r5' ])
+        self.failUnless('r2' in result.rejected['r2'])
+        # two chunks retried with savepoints, one without
+        self.failUnlessEqual(self.db.pool_proxy.dbpool.interactions, 5)
+        self.failUnlessEqual(self.db.pool_proxy.dbpool.log.count(database.SQL_ROLLBACK_SAVEPOINT), 2)
+
@@ -0,0 +1,74 @@
+#
+# Query coalescing unit tests
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from sgas.database.postgresql import coalescer
+
+
+
+class QueryCoalescerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.coalescer = coalescer.QueryCoalescer()
+        self.running = []
+
+    def runQuery(self):
+        d = defer.Deferred()
+        self.running.append(d)
+        return d
+
+
+    def testCoalesce(self):
+
+        key = coalescer.queryKey('SELECT * FROM wlcg WHERE vo = %s', ['atlas'], None)
+        d1 = self.coalescer.run(key, self.runQuery)
+        d2 = self.coalescer.run(key, self.runQuery)
+        d3 = self.coalescer.run(coalescer.queryKey('SELECT * FROM wlcg WHERE vo = %s', ['cms'], None), self.runQuery)
+        self.failUnlessEqual(len(self.running), 2)
+
+        self.running[0].callback( [ ['atlas', 1] ] )
+        r1, r2 = [], []
+        d1.addCallback(r1.extend)
+        d2.addCallback(r2.extend)
+        r1[0][1] = 1000 # callers get their own copy
+        self.failUnlessEqual(r2, [ ['atlas', 1] ])
+        self.failIf(d3.called)
+
+        # finished queries are run again
+        self.coalescer.run(key, self.runQuery)
+        self.failUnlessEqual(len(self.running), 3)
+
+        stats = self.coalescer.getStatistics()
+        self.failUnlessEqual((stats['queries'], stats['coalesced'], stats['inflight']), (3, 1, 2))
+
+
+    def testFailure(self):
+
+        d1 = self.coalescer.run('key', self.runQuery)
+        d2 = self.coalescer.run('key', self.runQuery)
+        self.running[0].errback(ValueError('query failed'))
+        self.failUnlessFailure(d1, ValueError)
+        self.failUnlessFailure(d2, ValueError)
+        return defer.DeferredList( [ d1, d2 ] )
+
+
+    def testCancel(self):
+
+        d1 = self.coalescer.run('key', self.runQuery)
+        d2 = self.coalescer.run('key', self.runQuery)
+        query = self.running[0]
+        query.addErrback(lambda f : f.trap(defer.CancelledError))
+
+        # the query runs as long as someone is waiting for it
+        d1.cancel()
+        self.failUnlessFailure(d1, defer.CancelledError)
+        self.failIf(query.called)
+
+        d2.cancel()
+        self.failUnlessFailure(d2, defer.CancelledError)
+        self.failUnless(query.called)
+        self.failUnlessEqual(self.coalescer.getStatistics()['inflight'], 0)
+        return defer.DeferredList( [ d1, d2 ] )
+
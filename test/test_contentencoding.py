@@ -0,0 +1,77 @@
+#
+# Compressed request body unit tests
+
+import io
+import gzip
+import zlib
+import pickle
+
+from twisted.trial import unittest
+
+from sgas.generic import contentencoding
+from sgas.usagerecord import ursplitter
+
+from . import ursampledata
+
+CUR = ursampledata.CUR.encode('utf-8')
+
+
+def _deflate(data, wbits):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+
+class ContentEncodingTest(unittest.TestCase):
+
+    def testParseHeader(self):
+
+        self.failUnlessEqual(contentencoding.parseContentEncoding(None), None)
+        self.failUnlessEqual(contentencoding.parseContentEncoding('identity'), None)
+        self.failUnlessEqual(contentencoding.parseContentEncoding('GZip'), 'gzip')
+        self.failUnlessEqual(contentencoding.parseContentEncoding('deflate'), 'deflate')
+        self.failUnlessRaises(ValueError, contentencoding.parseContentEncoding, 'br')
+        self.failUnlessRaises(ValueError, contentencoding.parseContentEncoding, 'gzip, deflate')
+
+
+    def testDecompress(self):
+
+        data = CUR * 50
+        for encoding, compressed in [ ('gzip',    gzip.compress(data)),
+                                      ('deflate', _deflate(data, zlib.MAX_WBITS)),
+                                      ('deflate', _deflate(data, -zlib.MAX_WBITS)) ]:
+            reader = contentencoding.DecompressingReader(io.BytesIO(compressed), encoding)
+            self.failUnlessEqual(reader.read(), data)
+
+        # incremental parsing, directly from the compressed data
+        reader = contentencoding.DecompressingReader(io.BytesIO(gzip.compress(CUR)), 'gzip')
+        self.failUnlessEqual(len(list(ursplitter.iterURDocument(reader))), 2)
+
+
+    def testLimit(self):
+
+        # 64 MB of zeroes compresses to less than 100 KB
+        bomb = gzip.compress(b'\0' * (64 * 1024 * 1024))
+        reader = contentencoding.DecompressingReader(io.BytesIO(bomb), 'gzip', 1024 * 1024)
+        self.failUnlessRaises(contentencoding.DecompressionLimitError, reader.read)
+        self.failIf(reader.size > 1024 * 1024 + contentencoding.READ_SIZE)
+
+
+    def testInvalid(self):
+
+        reader = contentencoding.DecompressingReader(io.BytesIO(CUR), 'gzip')
+        self.failUnlessRaises(contentencoding.DecompressionError, reader.read)
+
+        truncated = gzip.compress(CUR)[:-20]
+        reader = contentencoding.DecompressingReader(io.BytesIO(truncated), 'gzip')
+        self.failUnlessRaises(contentencoding.DecompressionError, reader.read)
+
+
+    def testPickle(self):
+
+        compressed = gzip.compress(CUR)
+        reader = contentencoding.DecompressingReader(io.BytesIO(compressed), 'gzip', 4096)
+        copy = pickle.loads(pickle.dumps(reader.portable()))
+        self.failUnlessEqual(copy.max_size, 4096)
+        self.failUnlessEqual(copy.read(), CUR)
+
@@ -0,0 +1,61 @@
+#
+# Database connection pool unit tests
+
+import configparser
+
+from twisted.trial import unittest
+
+from sgas.database.postgresql import database
+from sgas.server.config import ConfigurationError
+
+
+
+class PoolMetricsTest(unittest.TestCase):
+
+    def testOccupancy(self):
+
+        metrics = database._PoolMetrics(2)
+        seen = []
+        f1 = metrics.wrap(lambda conn : seen.append(metrics.getStatistics()))
+        f2 = metrics.wrap(lambda conn : 42)
+        self.failUnlessEqual(metrics.getStatistics()['waiting'], 2)
+
+        f1(None)
+        self.failUnlessEqual((seen[0]['busy'], seen[0]['waiting']), (1, 1))
+        self.failUnlessEqual(f2(None), 42)
+
+        stats = metrics.getStatistics()
+        self.failUnlessEqual((stats['size'], stats['busy'], stats['max_busy'], stats['waiting'], stats['runs']), (2, 0, 1, 0, 2))
+        self.failUnless(stats['wait_max'] >= stats['wait_avg'] >= 0)
+
+
+
+class PoolConfigurationTest(unittest.TestCase):
+
+    def createDatabase(self, options):
+        cfg = configparser.ConfigParser()
+        cfg.read_string('[server]\ndb=localhost:5432:sgas:sgas:secret\n' + options)
+        db = database.createDatabase(cfg)
+        for pool_proxy in db.pools.values():
+            self.addCleanup(pool_proxy.dbpool.close)
+        return db
+
+
+    def testPools(self):
+
+        db = self.createDatabase('db_read_pool_size=10\ndb_read=replica:5432:sgas:sgas:secret\n')
+        read_pool = db.pools[database.READ_POOL]
+        self.failUnlessEqual((read_pool.dbpool.max, read_pool.session_attrs), (10, 'any'))
+        self.failUnlessEqual(read_pool.dbpool.connkw['host'], 'replica')
+        self.failUnlessEqual(db.pools[database.INGEST_POOL].dbpool.max, database.DEFAULT_POOL_SIZE)
+        self.failUnlessEqual(db.pools[database.AGGREGATION_POOL].session_attrs, 'read-write')
+        self.failUnless(db.pool_proxy is db.pools[database.INGEST_POOL])
+        self.failUnless(db.read_replica)
+        self.failIf(self.createDatabase('').read_replica)
+
+
+    def testInvalidOptions(self):
+
+        self.failUnlessRaises(ConfigurationError, self.createDatabase, 'db_read_session_attrs=sometimes\n')
+        self.failUnlessRaises(ConfigurationError, self.createDatabase, 'db_ingest_pool_size=0\n')
+
@@ -0,0 +1,101 @@
+#
+# Dimension cache unit tests
+
+import time
+
+from twisted.trial import unittest
+
+from sgas.database.postgresql import dimcache
+from sgas.usagerecord import ursplitter, urparser, urconverter
+
+from . import ursampledata
+
+
+
+class FakeTransaction:
+    # just enough of a cursor to serve the dimension cache queries
+
+    def __init__(self):
+        self.tables = {}
+        self.next_id = 1
+        self.result = []
+        self.queries = 0
+
+    def _insert(self, table, key):
+        id_ = self.next_id
+        self.next_id += 1
+        self.tables.setdefault(table, {})[key] = id_
+        return id_
+
+    def execute(self, query, args=None):
+        self.queries += 1
+        table = query.split('FROM ')[-1].split()[0] if query.startswith('SELECT') else query.split()[2]
+        if query.startswith('SELECT min(id) FROM voinformation'):
+            key = dimcache._voKey(*args)
+            self.result = [ (self.tables.get('voinformation', {}).get(key),) ]
+        elif query.startswith('INSERT INTO voinformation'):
+            self.result = [ (self._insert('voinformation', dimcache._voKey(*args)),) ]
+        elif query.startswith('SELECT'):
+            rows = self.tables.get(table, {})
+            self.result = [ (rows[n], n) for n in args[0] if n in rows ]
+        else:
+            self.result = [ (self._insert(table, n), n) for n in args[0] if n not in self.tables.get(table, {}) ]
+
+    def fetchall(self):
+        return self.result
+
+
+
+class DimensionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        insert_time = time.gmtime()
+        docs = [ urparser.xmlToDict(e, insert_identity='/O=Grid/CN=host/example.org', insert_time=insert_time)
+                 for e in ursplitter.splitURDocument(ursampledata.CUR) ]
+        self.arg_list = urconverter.createInsertArguments(docs)
+        self.cache = dimcache.DimensionCache(None)
+
+
+    def testResolve(self):
+
+        txn = FakeTransaction()
+        pending = {}
+        id_args = self.cache.resolveArguments(txn, urconverter.ARG_LIST, self.arg_list, pending)
+
+        # the vo arguments are collapsed into one
+        self.failUnlessEqual(len(id_args[0]), len(urconverter.ARG_LIST) - 3)
+        machine_name_idx = urconverter.ARG_LIST.index('machine_name') - 3
+        self.failUnlessEqual(id_args[0][machine_name_idx], txn.tables['machinename'][self.arg_list[0][urconverter.ARG_LIST.index('machine_name')]])
+        self.failUnlessEqual(self.cache.size(), 0) # nothing cached before commit
+
+        # after commit, everything should be served from the cache
+        self.cache.update(pending)
+        queries = txn.queries
+        again = self.cache.resolveArguments(txn, urconverter.ARG_LIST, self.arg_list, {})
+        self.failUnlessEqual(again, id_args)
+        self.failUnlessEqual(txn.queries, queries)
+        self.failUnless(self.cache.hits > 0)
+
+
+    def testClear(self):
+
+        txn = FakeTransaction()
+        pending = {}
+        self.cache.resolveArguments(txn, urconverter.ARG_LIST, self.arg_list, pending)
+        self.cache.update(pending)
+        self.failUnless(self.cache.size() > 0)
+        self.cache.clear()
+        self.failUnlessEqual(self.cache.size(), 0)
+
+
+    def testEviction(self):
+
+        self.patch(dimcache, 'MAX_ENTRIES', 2)
+        self.cache.update( { 'machinename': { 'host1': 1, 'host2': 2 } } )
+
+        txn = FakeTransaction()
+        self.cache._resolveDimension(txn, 'machinename', 'machine_name', ['host1'], {}) # host1 is now most recently used
+        self.cache.update( { 'machinename': { 'host3': 3 } } )
+
+        self.failUnlessEqual(list(self.cache.entries['machinename'].keys()), ['host1', 'host3'])
+        self.failUnlessEqual(txn.queries, 0)
@@ -0,0 +1,107 @@
+#
+# Hostname resolver unit tests
+
+import socket
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from sgas.server import hostresolver
+
+
+
+class CountingLookup:
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.lookups = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, addr):
+        self.lookups.append(addr)
+        self.release.wait(5)
+        if addr not in self.hosts:
+            raise socket.herror(1, 'Unknown host')
+        return self.hosts[addr]
+
+
+
+class HostnameResolverTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def testCache(self):
+
+        lookup = CountingLookup( {'10.0.0.1': 'host1.example.org'} )
+        resolver = hostresolver.HostnameResolver(timeout=0, lookup=lookup)
+
+        hostname = yield resolver.resolve('10.0.0.1')
+        self.failUnlessEqual(hostname, 'host1.example.org')
+        hostname = yield resolver.resolve('10.0.0.1')
+        self.failUnlessEqual(hostname, 'host1.example.org')
+        self.failUnlessEqual(lookup.lookups, ['10.0.0.1'])
+
+        stats = resolver.getStatistics()
+        self.failUnlessEqual((stats['hits'], stats['misses'], stats['cached']), (1, 1, 1))
+
+
+    @defer.inlineCallbacks
+    def testNegativeCache(self):
+
+        lookup = CountingLookup( {} )
+        resolver = hostresolver.HostnameResolver(timeout=0, lookup=lookup)
+
+        hostname = yield resolver.resolve('10.0.0.2')
+        self.failUnlessEqual(hostname, '10.0.0.2')
+        hostname = yield resolver.resolve('10.0.0.2')
+        self.failUnlessEqual(hostname, '10.0.0.2')
+        self.failUnlessEqual(lookup.lookups, ['10.0.0.2'])
+        self.failUnlessEqual(resolver.getStatistics()['failures'], 1)
+
+        # expired entries are looked up again
+        resolver.negative_ttl = 0
+        resolver.cache.clear()
+        yield resolver.resolve('10.0.0.2')
+        yield resolver.resolve('10.0.0.2')
+        self.failUnlessEqual(len(lookup.lookups), 3)
+
+
+    @defer.inlineCallbacks
+    def testConcurrentLookups(self):
+
+        lookup = CountingLookup( {'10.0.0.1': 'host1.example.org'} )
+        lookup.release.clear()
+        resolver = hostresolver.HostnameResolver(timeout=0, lookup=lookup)
+
+        d1 = resolver.resolve('10.0.0.1')
+        d2 = resolver.resolve('10.0.0.1')
+        lookup.release.set()
+        hostnames = yield defer.gatherResults([d1, d2])
+        self.failUnlessEqual(hostnames, ['host1.example.org', 'host1.example.org'])
+        self.failUnlessEqual(lookup.lookups, ['10.0.0.1'])
+
+
+    @defer.inlineCallbacks
+    def testTimeout(self):
+
+        lookup = CountingLookup( {'10.0.0.1': 'host1.example.org'} )
+        lookup.release.clear()
+        clock = task.Clock()
+        resolver = hostresolver.HostnameResolver(timeout=1, lookup=lookup, clock=clock)
+
+        d = resolver.resolve('10.0.0.1')
+        clock.advance(1)
+        hostname = yield d
+        self.failUnlessEqual(hostname, '10.0.0.1')
+        self.failUnlessEqual(resolver.getStatistics()['timeouts'], 1)
+
+        # the lookup completes in the background, and is cached
+        d = resolver.resolve('10.0.0.1')
+        lookup.release.set()
+        hostname = yield d
+        self.failUnlessEqual(hostname, 'host1.example.org')
+        hostname = yield resolver.resolve('10.0.0.1')
+        self.failUnlessEqual(hostname, 'host1.example.org')
+        self.failUnlessEqual(lookup.lookups, ['10.0.0.1'])
+
@@ -4,6 +4,7 @@
 # Author: Henrik Thostrup Jensen <htj@ndgf.org>
 # Copyright: Nordic Data Grid Facility (2009)
 
+import time
 import datetime
 
 from twisted.trial import unittest
@@ -82,3 +83,41 @@ class ISODurationTest(unittest.TestCase):
             self.failUnlessEqual(ss, DURATION_SECONDS)
 
 
+
+
+class FastPathTest(unittest.TestCase):
+
+    # the fast path must give the same result as the full isodate parser
+
+    DATETIME_STRINGS = [
+        '2009-11-12T20:31:27Z',
+        '2009-11-12T20:31:27',
+        '2009-11-12T20:31:27.512Z',
+        '2009-11-12T20:31:27+02:00',
+        '2009-12-31T23:59:59-01:30',
+        '2009-W46-4T20:31:27Z'
+    ]
+
+    DURATION_STRINGS = [
+        'PT86401S',
+        'P0Y0M1DT0H0M1S',
+        'P1DT2H3M4S',
+        'PT5M',
+        'P2D',
+        'PT0S',
+        'PT1.5S'
+    ]
+
+    def testDateTime(self):
+
+        for dts in self.DATETIME_STRINGS:
+            dt = isodate.parse_datetime(dts)
+            self.failUnlessEqual(urparser.parseISODateTime(dts), time.strftime(urparser.JSON_DATETIME_FORMAT, dt.utctimetuple()))
+
+
+    def testDuration(self):
+
+        for tds in self.DURATION_STRINGS:
+            td = isodate.parse_duration(tds)
+            self.failUnlessEqual(urparser.parseISODuration(tds), (td.days * 3600*24) + td.seconds)
+
@@ -0,0 +1,130 @@
+#
+# JSON usage / storage record ingest unit tests
+
+import io
+import json
+import time
+
+from twisted.trial import unittest
+
+from sgas.database import error as dberror
+from sgas.generic import jsonrecords
+from sgas.usagerecord import jobinsertresource, urjson
+from sgas.storagerecord import storageinsertresource, srjson
+
+from . import ursampledata, srsampledata
+
+
+# the same record as ursampledata.URT
+URT_JSON = {
+    'record_id'             : 'zalizo.uio.no:21305',
+    'create_time'           : '2010-10-22T14:51:18Z',
+    'global_job_id'         : 'gsiftp://test.ndgf.org:2811/jobs/1125412877590561135129704',
+    'local_job_id'          : '21305',
+    'local_user_id'         : 'sgastest',
+    'global_user_name'      : '/O=Grid/O=NorduGrid/OU=ndgf.org/CN=Test User',
+    'vo_type'               : 'voms',
+    'vo_issuer'             : '/DC=ch/DC=cern/OU=computers/CN=voms.cern.ch',
+    'vo_name'               : 'atlas',
+    'vo_attributes'         : [ {'group': 'atlas'}, ['atlas/lcg1', None], {'group': 'atlas/no', 'role': None} ],
+    'machine_name'          : 'zalizo.uio.no',
+    'status'                : 'completed',
+    'queue'                 : 'fork',
+    'host'                  : 'zalizo.uio.no',
+    'node_count'            : 1,
+    'processors'            : 1,
+    'start_time'            : '2010-10-22T14:51:08Z',
+    'end_time'              : '2010-10-22T14:51:18Z',
+    'submit_time'           : '2010-10-22T14:50:56Z',
+    'cpu_duration'          : 0,
+    'wall_duration'         : 'PT10S',
+    'user_time'             : 0,
+    'kernel_time'           : 0,
+    'major_page_faults'     : 0,
+    'exit_code'             : 0,
+    'downloads'             : [ { 'url': 'srm://srm.ndgf.org/atlas/disk/atlaslocalgroupdisk/no/user10/testfile4', 'size': 10,
+                                  'start_time': '2010-10-22T16:50:57Z', 'end_time': '2010-10-22T16:50:59Z',
+                                  'bypass_cache': False, 'from_cache': False },
+                                { 'url': 'srm://srm.ndgf.org/atlas/disk/atlaslocalgroupdisk/no/user10/testfile', 'size': 5,
+                                  'start_time': '2010-10-22T16:50:57Z', 'end_time': '2010-10-22T16:51:00Z',
+                                  'bypass_cache': True, 'from_cache': False } ],
+    'uploads'               : [ { 'url': 'srm://srm.ndgf.org/atlas/disk/atlaslocalgroupdisk/no/user10/testfile%i' % i, 'size': size,
+                                  'start_time': '2010-10-22T16:51:16Z', 'end_time': '2010-10-22T16:51:18Z' }
+                                for i, size in [ (42, 11), (41, 10), (43, 12) ] ]
+}
+
+
+
+class JSONUsageRecordTest(unittest.TestCase):
+
+    def testSameAsXML(self):
+
+        insert_time = time.gmtime()
+        expected = jobinsertresource.parseJobUsageRecords(ursampledata.URT, 'test', 'host', insert_time)
+
+        arg_list = urjson.parseJSONRecords(json.dumps(URT_JSON), jsonrecords.JSON, 'test', 'host', insert_time)
+        self.failUnlessEqual(arg_list, expected)
+
+        ndjson = (json.dumps(URT_JSON) + '\n\n' + json.dumps(URT_JSON) + '\n').encode('utf-8')
+        arg_list = urjson.parseJSONRecords(io.BytesIO(ndjson), jsonrecords.NDJSON, 'test', 'host', insert_time)
+        self.failUnlessEqual(arg_list, expected * 2)
+
+
+    def testStringBooleans(self):
+
+        insert_time = time.gmtime()
+        expected = urjson.parseJSONRecords(json.dumps(URT_JSON), jsonrecords.JSON, 'test', 'host', insert_time)
+
+        record = dict(URT_JSON)
+        record['downloads'] = [ dict(d) for d in URT_JSON['downloads'] ]
+        record['downloads'][0].update( { 'bypass_cache': 'false', 'from_cache': '0' } )
+        record['downloads'][1].update( { 'bypass_cache': 'true', 'from_cache': 'False' } )
+
+        arg_list = urjson.parseJSONRecords(json.dumps(record), jsonrecords.JSON, 'test', 'host', insert_time)
+        self.failUnlessEqual(arg_list, expected)
+
+
+    def testInvalid(self):
+
+        def parse(doc, record_format=jsonrecords.JSON):
+            return urjson.parseJSONRecords(doc, record_format, 'test', 'host', time.gmtime())
+
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '[{"record_id": "r1"')
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '["r1"]')
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '{"record_id": "r1", "no_such_field": 1}')
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '{"record_id": "r1", "insert_identity": "me"}')
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '{"record_id": "r1", "processors": [1]}')
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '{"machine_name": "host"}')
+        self.failUnlessRaises(dberror.InvalidUsageDataError, parse, '{"record_id": "r1"}\n{"record_id": ', jsonrecords.NDJSON)
+
+
+    def testRecordFormat(self):
+
+        self.failUnlessEqual(jsonrecords.getRecordFormat(None), jsonrecords.XML)
+        self.failUnlessEqual(jsonrecords.getRecordFormat('text/xml'), jsonrecords.XML)
+        self.failUnlessEqual(jsonrecords.getRecordFormat('application/json; charset=utf-8'), jsonrecords.JSON)
+        self.failUnlessEqual(jsonrecords.getRecordFormat('application/x-ndjson'), jsonrecords.NDJSON)
+
+
+
+class JSONStorageRecordTest(unittest.TestCase):
+
+    def testSameAsXML(self):
+
+        insert_time = time.gmtime()
+        expected = storageinsertresource.parseStorageUsageRecords(srsampledata.SR_0, 'test', 'host', insert_time)
+
+        # build the json records from the xml ones
+        records = []
+        for args in expected:
+            record = dict( [ (name, value) for name, value in zip(srjson.CONVERTER.arg_list, args) if value is not None ] )
+            for name in ('insert_identity', 'insert_hostname', 'insert_time'):
+                del record[name]
+            for name in ('create_time', 'start_time', 'end_time'):
+                if name in record:
+                    record[name] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.strptime(record[name], '%Y %m %d %H:%M:%S'))
+            records.append(record)
+
+        arg_list = srjson.parseJSONRecords(json.dumps(records), jsonrecords.JSON, 'test', 'host', insert_time)
+        self.failUnlessEqual(arg_list, expected)
+
@@ -0,0 +1,185 @@
+#
+# Streamed JSON query result unit tests
+
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, threads
+
+from sgas.server import jsonstream
+from sgas.database.postgresql import database
+
+
+
+class FakeRequest:
+
+    def __init__(self):
+        self.written = []
+        self.headers = {}
+        self.code = 200
+        self.producer = None
+        self.finished = False
+        self.lost = False
+        self.finish_deferred = defer.Deferred()
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def notifyFinish(self):
+        return self.finish_deferred
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def write(self, data):
+        assert isinstance(data, bytes)
+        self.written.append(data)
+
+    def finish(self):
+        self.finished = True
+
+    def loseConnection(self):
+        self.lost = True
+
+
+
+class FakeCursor:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.itersize = None
+        self.fetches = 0
+
+    def execute(self, query, query_args):
+        pass
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+
+class FakeConnection:
+
+    def __init__(self, cursor):
+        self.cur = cursor
+
+    def cursor(self, name=None, cursor_factory=None):
+        return self.cur
+
+
+
+class FakePool:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def runWithConnection(self, f, *args):
+        return threads.deferToThread(f, FakeConnection(self.cursor), *args)
+
+
+
+class FakePoolProxy:
+
+    def __init__(self, pool):
+        self.dbpool = pool
+
+
+
+class JSONStreamTest(unittest.TestCase):
+
+    def testStream(self):
+
+        request = FakeRequest()
+        stream = jsonstream.JSONStream(request, lambda row : { 'n': row[0] }, collect_bytes=1024)
+        self.failUnlessEqual(request.producer, stream)
+        stream.writeRows( [ [1], [2] ] )
+        stream.writeRows( [ [3] ] )
+        payload = stream.finish()
+
+        self.failUnless(request.finished)
+        self.failUnlessEqual(request.producer, None)
+        self.failUnlessEqual(json.loads(b''.join(request.written)), [ {'n': 1}, {'n': 2}, {'n': 3} ])
+        self.failUnlessEqual(payload, b''.join(request.written))
+
+
+    def testEmptyStream(self):
+
+        request = FakeRequest()
+        stream = jsonstream.JSONStream(request)
+        self.failUnlessEqual(stream.finish(), None) # nothing collected
+        self.failUnlessEqual(b''.join(request.written), b'[]')
+
+
+    def testFlowControl(self):
+
+        request = FakeRequest()
+        stream = jsonstream.JSONStream(request)
+        self.failUnlessEqual(stream.writeRows( [ [1] ] ), None)
+
+        stream.pauseProducing()
+        d = stream.writeRows( [ [2] ] )
+        self.failIf(d.called)
+        stream.resumeProducing()
+        self.failUnless(d.called)
+
+        stream.pauseProducing()
+        d = stream.writeRows( [ [3] ] )
+        request.finish_deferred.errback(Exception('Connection lost'))
+        self.failUnlessFailure(d, jsonstream.StreamStopped)
+        self.failUnlessRaises(jsonstream.StreamStopped, stream.writeRows, [ [4] ])
+        return d
+
+
+    def testFail(self):
+
+        request = FakeRequest()
+        stream = jsonstream.JSONStream(request)
+        stream.fail('Queryengine error')
+        self.failUnlessEqual((request.code, request.finished), (500, True))
+
+        # after the list has started, the connection is closed instead
+        request = FakeRequest()
+        stream = jsonstream.JSONStream(request)
+        stream.writeRows( [ [1] ] )
+        stream.fail('Queryengine error')
+        self.failUnlessEqual((request.code, request.finished, request.lost), (200, False, True))
+
+
+
+class StreamQueryTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def testStreamQuery(self):
+
+        cursor = FakeCursor( [ (i,) for i in range(5) ] )
+        db = database.PostgreSQLDatabase.__new__(database.PostgreSQLDatabase)
+        db.pools = { database.READ_POOL: FakePoolProxy(FakePool(cursor)) }
+
+        batches = []
+        pending = []
+        def rowsReceived(rows):
+            batches.append(rows)
+            # the next batch is not fetched until the receiver is ready
+            self.failUnlessEqual(cursor.fetches, len(batches))
+            d = defer.Deferred()
+            reactor.callLater(0, d.callback, None)
+            pending.append(d)
+            return d
+
+        n_rows = yield db.streamquery('SELECT i', None, rowsReceived, batch_size=2)
+        self.failUnlessEqual(n_rows, 5)
+        self.failUnlessEqual(cursor.itersize, 2)
+        self.failUnlessEqual(batches, [ [[0], [1]], [[2], [3]], [[4]] ])
+        self.failUnless(all(d.called for d in pending))
+
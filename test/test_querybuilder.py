@@ -0,0 +1,38 @@
+#
+# Query builder unit tests
+
+from twisted.trial import unittest
+
+from sgas.queryengine import builder
+
+
+
+class QueryBuilderTest(unittest.TestCase):
+
+    def buildQuery(self, start_date, end_date, time_resolution, **kwargs):
+        query_args = { 'start_date': start_date, 'end_date': end_date, 'time_resolution': time_resolution }
+        query_args.update(kwargs)
+        return builder.buildQuery(query_args)
+
+
+    def testMonthlyRollup(self):
+
+        query, args = self.buildQuery('2010-01-01', '2011-01-01', 'month', machine_name=['host1.example.org'])
+        self.failUnless('FROM uraggregated_monthly ' in query)
+        self.failUnlessEqual(args, ['2010-01-01', '2011-01-01', ('host1.example.org',)])
+
+        query, args = self.buildQuery('2010-01-01', '2010-04-01', 'collapse')
+        self.failUnless('FROM uraggregated_monthly ' in query)
+        self.failUnless('min(first_execution_time), max(last_execution_time)' in query)
+
+
+    def testDailyAggregation(self):
+
+        # partial months and day resolution are answered from the daily data
+        for start_date, end_date, time_resolution in [ ('2010-01-01', '2010-01-15', 'month'),
+                                                       ('2010-01-10', '2010-03-01', 'collapse'),
+                                                       ('2010-01-01', '2010-03-01', 'day') ]:
+            query, _ = self.buildQuery(start_date, end_date, time_resolution)
+            self.failUnless('FROM uraggregated ' in query, query)
+            self.failIf('first_execution_time' in query)
+
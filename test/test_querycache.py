@@ -0,0 +1,50 @@
+#
+# Query result cache unit tests
+
+from twisted.trial import unittest
+
+from sgas.queryengine import querycache
+
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def testCacheKey(self):
+
+        k1 = querycache.cacheKey( {'machine_name': ['b.example.org', 'a.example.org'], 'time_resolution': 'day'} )
+        k2 = querycache.cacheKey( {'time_resolution': 'day', 'machine_name': ['a.example.org', 'b.example.org', 'a.example.org']} )
+        self.failUnlessEqual(k1, k2)
+        k3 = querycache.cacheKey( {'machine_name': ['a.example.org'], 'time_resolution': 'day'} )
+        self.failIfEqual(k1, k3)
+
+
+    def testGeneration(self):
+
+        cache = querycache.QueryCache()
+        cache.store('q1', 0, b'[]')
+        self.failUnlessEqual(cache.lookup('q1', 0), b'[]')
+        # the aggregated data has been updated
+        self.failUnlessEqual(cache.lookup('q1', 1), None)
+        self.failUnlessEqual(cache.lookup('q1', 0), None) # stale entries are dropped
+
+        stats = cache.getStatistics()
+        self.failUnlessEqual((stats['hits'], stats['misses'], stats['stale'], stats['entries']), (1, 2, 1, 0))
+
+
+    def testEviction(self):
+
+        cache = querycache.QueryCache(max_entries=2, max_bytes=10)
+        cache.store('q1', 0, b'1234')
+        cache.store('q2', 0, b'1234')
+        cache.lookup('q1', 0)
+        cache.store('q3', 0, b'1234') # evicts q2, the least recently used
+        self.failUnlessEqual(list(cache.entries.keys()), ['q1', 'q3'])
+
+        cache.store('q4', 0, b'12345678') # evicts by size
+        self.failUnlessEqual(list(cache.entries.keys()), ['q4'])
+        self.failUnlessEqual(cache.size, 8)
+        self.failUnlessEqual(cache.getStatistics()['evictions'], 3)
+
+        cache.store('q5', 0, b'12345678901') # larger than the cache
+        self.failUnlessEqual(cache.lookup('q5', 0), None)
+
@@ -0,0 +1,142 @@
+#
+# Query cancellation and statement timeout unit tests
+
+import threading
+
+import psycopg2.extensions
+
+from twisted.trial import unittest
+from twisted.internet import defer, threads
+
+from sgas.database import error
+from sgas.database.postgresql import database
+from sgas.server import resourceutil
+
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, query_args=None):
+        self.conn.executed.append( (query, query_args) )
+        if query.startswith('SET'):
+            return
+        if self.conn.block:
+            self.conn.started.set()
+            self.conn.cancelled.wait(5)
+            raise psycopg2.extensions.QueryCanceledError('canceling statement due to user request')
+        if self.conn.timeout:
+            raise psycopg2.extensions.QueryCanceledError('canceling statement due to statement timeout')
+
+    def fetchall(self):
+        return [ (1,) ]
+
+    def close(self):
+        pass
+
+
+
+class FakeConnection:
+
+    def __init__(self, block=False, timeout=False):
+        self.block = block
+        self.timeout = timeout
+        self.executed = []
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+        self.done = defer.Deferred()
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(self)
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+
+class FakePool:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def runWithConnection(self, f, *args):
+        d = threads.deferToThread(f, self.conn, *args)
+        d.addBoth(lambda r : (self.conn.done.callback(None), r)[1])
+        return d
+
+
+
+class FakePoolProxy:
+
+    def __init__(self, pool):
+        self.dbpool = pool
+        self.reconnects = 0
+
+    def reconnect(self):
+        self.reconnects += 1
+
+
+
+class FakeRequest:
+
+    def __init__(self):
+        self.finish_deferred = defer.Deferred()
+
+    def notifyFinish(self):
+        return self.finish_deferred
+
+
+
+class QueryCancelTest(unittest.TestCase):
+
+    def createDatabase(self, conn):
+        db = database.PostgreSQLDatabase.__new__(database.PostgreSQLDatabase)
+        db.pools = { database.READ_POOL: FakePoolProxy(FakePool(conn)) }
+        return db
+
+
+    @defer.inlineCallbacks
+    def testStatementTimeout(self):
+
+        conn = FakeConnection()
+        db = self.createDatabase(conn)
+        rows = yield db.query('SELECT 1', statement_timeout='30s')
+        self.failUnlessEqual(rows, [ [1] ])
+        self.failUnlessEqual(conn.executed[0], (database.SQL_SET_STATEMENT_TIMEOUT, ('30s',)))
+
+        conn = FakeConnection(timeout=True)
+        db = self.createDatabase(conn)
+        yield self.failUnlessFailure(db.query('SELECT 1', statement_timeout='30s'), error.QueryTimeoutError)
+        self.failUnlessEqual(db.pools[database.READ_POOL].reconnects, 0) # the connection is fine
+
+
+    @defer.inlineCallbacks
+    def testCancelOnDisconnect(self):
+
+        conn = FakeConnection(block=True)
+        db = self.createDatabase(conn)
+        request = FakeRequest()
+        d = resourceutil.cancelOnDisconnect(request, db.query('SELECT 1'))
+        yield threads.deferToThread(conn.started.wait, 5)
+
+        request.finish_deferred.errback(Exception('Connection lost'))
+        yield self.failUnlessFailure(d, defer.CancelledError)
+        yield conn.done # the query was stopped in the database
+        self.failUnless(conn.cancelled.is_set())
+        self.failUnlessEqual(db.pools[database.READ_POOL].reconnects, 0)
+
+
+    @defer.inlineCallbacks
+    def testFinishedRequest(self):
+
+        conn = FakeConnection()
+        db = self.createDatabase(conn)
+        request = FakeRequest()
+        d = resourceutil.cancelOnDisconnect(request, db.query('SELECT 1'))
+        rows = yield d
+        request.finish_deferred.callback(None)
+        self.failUnlessEqual(rows, [ [1] ])
+        self.failIf(conn.cancelled.is_set())
+
@@ -0,0 +1,35 @@
+#
+# Aggregation rebuild unit tests
+
+import datetime
+
+from twisted.trial import unittest
+
+from sgas.database.postgresql import rebuild
+
+
+
+class RebuildTest(unittest.TestCase):
+
+    def testMonthDays(self):
+
+        days = rebuild.monthDays(datetime.date(2012, 2, 1))
+        self.failUnlessEqual(len(days), 29)
+        self.failUnlessEqual(days[0], datetime.date(2012, 2, 1))
+        self.failUnlessEqual(days[-1], datetime.date(2012, 2, 29))
+        self.failUnlessEqual(len(rebuild.monthDays(datetime.date(2010, 12, 1))), 31)
+
+
+    def testShadowIndexDefinition(self):
+
+        name, indexdef = rebuild.shadowIndexDefinition(
+            'CREATE INDEX uraggregated_data_slice_idx ON public.uraggregated_data USING btree (insert_time, machine_name_id)')
+        self.failUnlessEqual(name, 'uraggregated_data_slice_idx_rebuild')
+        self.failUnlessEqual(indexdef,
+            'CREATE INDEX uraggregated_data_slice_idx_rebuild ON public.uraggregated_data_rebuild USING btree (insert_time, machine_name_id)')
+
+        name, indexdef = rebuild.shadowIndexDefinition('CREATE UNIQUE INDEX u_idx ON uraggregated_data USING btree (insert_time)')
+        self.failUnlessEqual(indexdef, 'CREATE UNIQUE INDEX u_idx_rebuild ON uraggregated_data_rebuild USING btree (insert_time)')
+
+        self.failUnlessRaises(rebuild.RebuildError, rebuild.shadowIndexDefinition, 'something else')
+
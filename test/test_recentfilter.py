@@ -0,0 +1,54 @@
+#
+# Recently inserted record filter unit tests
+
+from twisted.trial import unittest
+
+from sgas.usagerecord import recentfilter
+
+
+
+class RecentRecordFilterTest(unittest.TestCase):
+
+    def testReplacementRules(self):
+
+        rf = recentfilter.RecentRecordFilter()
+        rf.add('host:1', 'gsiftp://host/jobs/1', '42')
+
+        self.failUnlessEqual(rf.lookup('host:1', 'gsiftp://host/jobs/1'), '42')
+        self.failUnlessEqual(rf.lookup('host:1', 'host:1'), '42')    # minimal record
+        self.failUnlessEqual(rf.lookup('host:1', 'gsiftp://host/jobs/2'), None) # would replace
+        self.failUnlessEqual(rf.lookup('host:1', None), None)       # would replace
+        self.failUnlessEqual(rf.lookup('host:2', 'gsiftp://host/jobs/1'), None)
+
+        s = rf.getStatistics()
+        self.failUnlessEqual(s['hits'], 2)
+        self.failUnlessEqual(s['misses'], 3)
+
+
+    def testReplaced(self):
+
+        rf = recentfilter.RecentRecordFilter()
+        rf.add('host:1', 'gsiftp://host/jobs/1', '42')
+        # resubmission with a new global job id, committed as a replacement
+        self.failUnlessEqual(rf.lookup('host:1', 'gsiftp://host/jobs/2'), None)
+        rf.add('host:1', 'gsiftp://host/jobs/2', '43')
+
+        self.failUnlessEqual(rf.lookup('host:1', 'gsiftp://host/jobs/1'), None) # replaces again
+        self.failUnlessEqual(rf.lookup('host:1', 'gsiftp://host/jobs/2'), '43')
+
+
+    def testBounds(self):
+
+        rf = recentfilter.RecentRecordFilter(max_size=2)
+        rf.add('r1', 'g1', '1')
+        rf.add('r2', 'g2', '2')
+        rf.lookup('r1', 'g1') # makes r2 the least recently used
+        rf.add('r3', 'g3', '3')
+        self.failUnlessEqual(rf.lookup('r2', 'g2'), None)
+        self.failUnlessEqual(rf.lookup('r1', 'g1'), '1')
+
+        rf = recentfilter.RecentRecordFilter(max_age=-1)
+        rf.add('r1', 'g1', '1')
+        self.failUnlessEqual(rf.lookup('r1', 'g1'), None)
+        self.failUnlessEqual(rf.getStatistics()['size'], 0)
+
@@ -0,0 +1,41 @@
+#
+# Record splitter unit tests
+
+import io
+
+from twisted.trial import unittest
+
+from sgas.ext.python import json
+from sgas.usagerecord import ursplitter, urparser
+from sgas.storagerecord import srsplitter, srparser
+
+from . import ursampledata, srsampledata
+
+
+
+class StreamingSplitterTest(unittest.TestCase):
+
+    def testUsageRecords(self):
+
+        for ur_data in (ursampledata.UR1, ursampledata.CUR, ursampledata.UR_LONGHOST):
+            docs = [ urparser.xmlToDict(e) for e in ursplitter.splitURDocument(ur_data) ]
+            stream = io.BytesIO(ur_data.encode('utf-8'))
+            streamed_docs = [ urparser.xmlToDict(e) for e in ursplitter.iterURDocument(stream) ]
+            self.failUnlessEqual(json.dumps(streamed_docs, default=str), json.dumps(docs, default=str))
+
+
+    def testStorageRecords(self):
+
+        for sr_data in (srsampledata.SR_0, srsampledata.SRS):
+            docs = [ srparser.xmlToDict(e) for e in srsplitter.splitSRDocument(sr_data) ]
+            stream = io.BytesIO(sr_data.encode('utf-8'))
+            streamed_docs = [ srparser.xmlToDict(e) for e in srsplitter.iterSRDocument(stream) ]
+            self.failUnlessEqual(streamed_docs, docs)
+
+
+    def testBadDocuments(self):
+
+        self.failUnlessRaises(ursplitter.ParseError, list, ursplitter.iterURDocument(b'<notxml'))
+        self.failUnlessRaises(ursplitter.ParseError, list, ursplitter.iterURDocument(b'<foo/>'))
+        self.failUnlessRaises(srsplitter.ParseError, list, srsplitter.iterSRDocument(b'<foo/>'))
+
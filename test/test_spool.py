@@ -0,0 +1,179 @@
+#
+# Registration spool unit tests
+
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+
+from sgas.database import error as dberror
+from sgas.generic import spool
+
+
+
+def createArgs(n, prefix='r'):
+    return [ [ '%s%i' % (prefix, i), 'value', i ] for i in range(n) ]
+
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='sgas-spool-test')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def testAppendAndCommit(self):
+
+        sp = spool.Spool(self.directory)
+        sp.append(createArgs(3, 'a'))
+        sp.append(createArgs(2, 'b'))
+        self.failUnlessEqual(sp.depth(), 5)
+
+        batch = sp.readBatch(10)
+        self.failUnlessEqual(len(batch), 2)
+        self.failUnlessEqual(batch[0][1], createArgs(3, 'a'))
+
+        sp.commit([ frame for frame, _ in batch[:1] ])
+        self.failUnlessEqual(sp.depth(), 2)
+        sp.close()
+
+        # reopen, only the uncommitted registration should remain
+        sp = spool.Spool(self.directory)
+        self.failUnlessEqual(sp.depth(), 2)
+        batch = sp.readBatch(10)
+        self.failUnlessEqual(batch[0][1], createArgs(2, 'b'))
+        sp.commit([ frame for frame, _ in batch ])
+        self.failUnlessEqual(sp.depth(), 0)
+        sp.close()
+
+
+    def testBatchSize(self):
+
+        sp = spool.Spool(self.directory)
+        for i in range(5):
+            sp.append(createArgs(3))
+        self.failUnlessEqual(len(sp.readBatch(7)), 2)
+        self.failUnlessEqual(len(sp.readBatch(1)), 1) # always at least one frame
+        sp.close()
+
+
+    def testSegmentRotation(self):
+
+        sp = spool.Spool(self.directory, segment_size=100)
+        for i in range(10):
+            sp.append(createArgs(5))
+        segments = sp._segments()
+        self.failUnless(len(segments) > 1)
+
+        sp.commit([ frame for frame, _ in sp.readBatch(1000) ])
+        self.failUnlessEqual(sp._segments(), segments[-1:])
+        sp.close()
+
+
+    def testTornWrite(self):
+
+        sp = spool.Spool(self.directory)
+        sp.append(createArgs(3))
+        sp.append(createArgs(4))
+        segment_path = sp._segmentPath(sp.write_segment)
+        sp.close()
+
+        # chop off the end of the last frame
+        size = os.path.getsize(segment_path)
+        with open(segment_path, 'r+b') as f:
+            f.truncate(size - 5)
+
+        sp = spool.Spool(self.directory)
+        self.failUnlessEqual(sp.depth(), 3)
+        sp.close()
+
+
+
+class SpoolDrainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='sgas-spool-test')
+        self.inserted = []
+        self.failures = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def insert(self, arg_list):
+        if self.failures:
+            return defer.fail(self.failures.pop(0))
+        self.inserted.extend(arg_list)
+        return defer.succeed(None)
+
+
+    @defer.inlineCallbacks
+    def testDrain(self):
+
+        sp = spool.Spool(self.directory)
+        sp.append(createArgs(3, 'a'))
+        sp.append(createArgs(2, 'b'))
+        self.failures = [ dberror.DatabaseUnavailableError('down') ]
+
+        drainer = spool.SpoolDrainer('test', sp, self.insert)
+        self.patch(spool, 'MIN_RETRY_DELAY', 0)
+        drainer.retry_delay = 0
+        drainer.startService()
+        while sp.depth():
+            yield task.deferLater(reactor, 0.01, lambda : None)
+        yield drainer.stopService()
+
+        self.failUnlessEqual(self.inserted, createArgs(3, 'a') + createArgs(2, 'b'))
+        self.failUnlessEqual(drainer.getStatistics()['depth'], 0)
+
+
+    @defer.inlineCallbacks
+    def testReject(self):
+
+        sp = spool.Spool(self.directory)
+        sp.append(createArgs(3, 'a'))
+        sp.append(createArgs(2, 'b'))
+        self.failures = [ ValueError('bad batch'), ValueError('bad record') ]
+
+        drainer = spool.SpoolDrainer('test', sp, self.insert)
+        drainer.startService()
+        while sp.depth():
+            yield task.deferLater(reactor, 0.01, lambda : None)
+        yield drainer.stopService()
+
+        self.failUnlessEqual(self.inserted, createArgs(2, 'b'))
+        self.failUnlessEqual(len(os.listdir(os.path.join(self.directory, spool.REJECTED_DIRECTORY))), 1)
+
+
+
+    @defer.inlineCallbacks
+    def testSpoolError(self):
+
+        sp = spool.Spool(self.directory)
+        sp.append(createArgs(2, 'a'))
+        readBatch = sp.readBatch
+        errors = []
+        def failingReadBatch(batch_size):
+            if not errors:
+                errors.append(IOError('Input/output error'))
+                raise errors[0]
+            return readBatch(batch_size)
+        sp.readBatch = failingReadBatch
+
+        drainer = spool.SpoolDrainer('test', sp, self.insert)
+        drainer.retry_delay = 0
+        drainer.startService()
+        while sp.depth():
+            yield task.deferLater(reactor, 0.01, lambda : None)
+        yield drainer.stopService()
+
+        # draining continues after the error
+        self.failUnlessEqual(len(errors), 1)
+        self.failUnlessEqual(self.inserted, createArgs(2, 'a'))
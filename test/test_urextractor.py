@@ -0,0 +1,67 @@
+#
+# Usage record extractor unit tests
+
+import time
+
+from twisted.trial import unittest
+
+from sgas.usagerecord import ursplitter, urparser, urconverter, urextractor
+
+from . import ursampledata
+
+
+
+SAMPLE_DOCUMENTS = [
+    ursampledata.UR1,
+    ursampledata.UR2,
+    ursampledata.CUR,
+    ursampledata.URT,
+    ursampledata.UR_LONGHOST,
+    ursampledata.UR_BAD_EXIT_CODE,
+    ursampledata.UR_BAD_LOCAL_JOB_ID
+]
+
+
+def normalize(args):
+    # memory objects do not compare, so use their sql representation
+    return [ [ m.getquoted() for m in a ] if isinstance(a, list) and a and hasattr(a[0], 'getquoted') else a for a in args ]
+
+
+
+class ExtractorTest(unittest.TestCase):
+
+    def testEquivalence(self):
+
+        insert_time = time.gmtime()
+
+        for ur_data in SAMPLE_DOCUMENTS:
+            for ur_element in ursplitter.splitURDocument(ur_data):
+                ur_doc = urparser.xmlToDict(ur_element, insert_identity='/O=Grid/CN=host/example.org',
+                                            insert_hostname='example.org', insert_time=insert_time)
+                expected = urconverter.createInsertArguments([ ur_doc ])[0]
+                args = urextractor.extractInsertArguments(ur_element, insert_identity='/O=Grid/CN=host/example.org',
+                                                          insert_hostname='example.org', insert_time=insert_time)
+                self.failUnlessEqual(normalize(args), normalize(expected))
+
+
+    def testHeuristics(self):
+
+        args = urextractor.extractInsertArguments(ursplitter.splitURDocument(ursampledata.UR_BAD_EXIT_CODE)[0])
+        self.failUnless(0 <= args[urextractor.EXIT_CODE_SLOT] < 256)
+
+        args = urextractor.extractInsertArguments(ursplitter.splitURDocument(ursampledata.UR_LONGHOST)[0])
+        self.failUnlessEqual(len(args[urextractor.HOST_SLOT]), urextractor.MAX_HOST_LENGTH)
+        self.failUnless(args[urextractor.HOST_SLOT].endswith('$'))
+
+
+    def testBadLocalJobId(self):
+
+        ur_data = ursampledata.UR1.replace('<ur:GlobalJobId>gsiftp://example.org/jobs/1</ur:GlobalJobId>',
+                                           '<ur:GlobalJobId>gsiftp://example.org/jobs/1</ur:GlobalJobId>' +
+                                           '<ur:LocalJobId>/var/spool/bad/local/job/id</ur:LocalJobId>')
+        ur_element = ursplitter.splitURDocument(ur_data)[0]
+        args = urextractor.extractInsertArguments(ur_element)
+        self.failUnlessEqual(args[urextractor.LOCAL_JOB_ID_SLOT], None)
+        self.failUnlessEqual(args[urextractor.RECORD_ID_SLOT], 'gsiftp://example.org/jobs/1')
+        self.failUnlessEqual(args, urconverter.createInsertArguments([ urparser.xmlToDict(ur_element) ])[0])
+
@@ -0,0 +1,60 @@
+#
+# Worker pool unit tests
+
+import time
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from sgas.generic import workerpool
+from sgas.usagerecord import jobinsertresource, ursplitter
+from sgas.storagerecord import storageinsertresource
+
+from . import ursampledata, srsampledata
+
+
+
+def _normalize(arg_list):
+    # memory objects do not compare, use their sql representation
+    return [ [ [ v.getquoted() if hasattr(v, 'getquoted') else v for v in a ] if isinstance(a, list) else a
+               for a in args ] for args in arg_list ]
+
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def _startPool(self, worker_type):
+        pool = workerpool.WorkerPool('test', 2, worker_type)
+        pool.startService()
+        self.addCleanup(pool.stopService)
+        return pool
+
+
+    @defer.inlineCallbacks
+    def _testParse(self, worker_type):
+        pool = self._startPool(worker_type)
+        insert_time = time.gmtime()
+
+        expected = jobinsertresource.parseJobUsageRecords(ursampledata.CUR, 'test', 'host', insert_time)
+        arg_list = yield pool.submit(jobinsertresource.parseJobUsageRecords, ursampledata.CUR, 'test', 'host', insert_time)
+        self.failUnlessEqual(_normalize(arg_list), _normalize(expected))
+
+        expected = storageinsertresource.parseStorageUsageRecords(srsampledata.SR_0, 'test', 'host', insert_time)
+        arg_list = yield pool.submit(storageinsertresource.parseStorageUsageRecords, srsampledata.SR_0, 'test', 'host', insert_time)
+        self.failUnlessEqual(arg_list, expected)
+
+        # parse errors must be passed on
+        try:
+            yield pool.submit(jobinsertresource.parseJobUsageRecords, b'<not xml', 'test', 'host', insert_time)
+            self.fail('Parsing invalid document should fail')
+        except ursplitter.ParseError:
+            pass
+
+
+    def testThreadPool(self):
+        return self._testParse(workerpool.WORKER_THREAD)
+
+
+    def testProcessPool(self):
+        return self._testParse(workerpool.WORKER_PROCESS)
+